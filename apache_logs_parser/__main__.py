@@ -2,11 +2,214 @@
 # GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import argparse
-import logging
+import sys
 from apache_logs_parser import commands, __version__
-from apache_logs_parser.parser import write_json_log
-from apache_logs_parser.stats import generate_stats, display_stats, write_json_stats
-from apache_logs_parser.stats_producers import get_stat_classes_by_name, get_stats_classes_names
+
+# The modules of the commands are imported by the functions using them, so that starting the tool, for `--version` or
+# for a command, only imports what is needed. The StatProducer subclasses are only discovered when they are used.
+
+JSON_FORMAT = 'json'
+SQLITE_FORMAT = 'sqlite'
+OUTPUT_FORMATS = [JSON_FORMAT, SQLITE_FORMAT]
+
+
+class CommandError(Exception):
+    """
+    Error of the arguments found while running a command, reported like the argparse errors
+    """
+
+
+def positive_int(value):
+    """
+    argparse type for strictly positive integers
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a strictly positive integer")
+    return number
+
+
+def memory_size(value):
+    """
+    argparse type for memory sizes in bytes, with an optional K, M or G suffix
+    """
+    units = dict(K=1024, M=1024 ** 2, G=1024 ** 3)
+    multiplier = units.get(value[-1:].upper(), 1)
+    try:
+        size = int(float(value[:-1] if value[-1:].upper() in units else value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a memory size such as 512M")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a strictly positive memory size")
+    return size
+
+
+def sample_rate(value):
+    """
+    argparse type for sample rates, between 0 excluded and 1
+    """
+    rate = float(value)
+    if not 0 < rate <= 1:
+        raise argparse.ArgumentTypeError(f"{value} is not between 0 excluded and 1")
+    return rate
+
+
+def add_sample_arguments(command_parser):
+    from apache_logs_parser.constants import SAMPLE_KEYS, LINE_KEY
+
+    command_parser.add_argument('--sample', type=sample_rate, metavar='RATE',
+                                help="Keep only this fraction of the lines, decided by a hash of the sample key,"
+                                     " the stats are scaled accordingly")
+    command_parser.add_argument('--sample-key', choices=SAMPLE_KEYS, default=LINE_KEY,
+                                help="Lines with the same key are all kept or all skipped. Sampling by IP keeps the"
+                                     " per IP stats exact for the IPs of the sample")
+
+
+def get_sampler(args):
+    from apache_logs_parser.sampling import Sampler
+
+    return Sampler(args.sample, args.sample_key) if args.sample else None
+
+
+def error_rate(value):
+    """
+    argparse type for rates between 0 and 1 excluded
+    """
+    rate = float(value)
+    if not 0 < rate < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not between 0 and 1 excluded")
+    return rate
+
+
+def add_subnet_arguments(command_parser):
+    command_parser.add_argument('--subnet-prefixes', type=ipv4_prefix_length, nargs='+', metavar='LENGTH',
+                                help="IPv4 prefix lengths used to group traffic by subnet, 24 by default")
+    command_parser.add_argument('--subnet-prefixes-v6', type=ipv6_prefix_length, nargs='+', metavar='LENGTH',
+                                help="IPv6 prefix lengths used to group traffic by subnet, 48 by default")
+    command_parser.add_argument('--subnets', type=network, nargs='+', metavar='CIDR',
+                                help="Networks used to group traffic by subnet, such as 10.0.0.0/8 or 2001:db8::/32")
+
+
+def get_subnet_options(args):
+    """
+    Options of the StatPerSubnet producer
+    """
+    return dict(
+        subnet_prefixes=args.subnet_prefixes,
+        subnet_prefixes_v6=args.subnet_prefixes_v6,
+        subnets=args.subnets,
+    )
+
+
+def add_dedup_arguments(command_parser):
+    command_parser.add_argument('--dedup', action='store_true',
+                                help="Drop the lines already seen in a previous file, duplicated by copytruncate or"
+                                     " mirrors")
+    command_parser.add_argument('--dedup-capacity', type=positive_int,
+                                help="Number of different lines expected, sizes the memory used to find duplicates,"
+                                     " 1000000 by default")
+    command_parser.add_argument('--dedup-error-rate', type=error_rate,
+                                help="Rate of lines wrongly dropped as duplicates, 0.001 by default")
+
+
+def get_deduplicator(args):
+    from apache_logs_parser.dedup import Deduplicator, DEFAULT_CAPACITY, DEFAULT_ERROR_RATE
+
+    if not args.dedup:
+        return None
+    return Deduplicator(args.dedup_capacity or DEFAULT_CAPACITY, args.dedup_error_rate or DEFAULT_ERROR_RATE)
+
+
+def positive_float(value):
+    """
+    argparse type for strictly positive numbers
+    """
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a strictly positive number")
+    return number
+
+
+def add_anomaly_arguments(command_parser, alerts_help):
+    # The defaults are the ones of anomaly.AnomalyDetector, used when the options are None
+    command_parser.add_argument('--alerts-file', type=argparse.FileType('w'), metavar='FILE',
+                                help=alerts_help)
+    command_parser.add_argument('--anomaly-bucket', type=positive_int,
+                                metavar='SECONDS', help="Seconds of log time counted together, 10 by default")
+    command_parser.add_argument('--anomaly-window', type=positive_int,
+                                metavar='BUCKETS', help="Number of buckets of the sliding window compared to the"
+                                                        " baselines, 12 by default")
+    command_parser.add_argument('--anomaly-factor', type=positive_float,
+                                help="Hits in the window above this factor of the baseline are anomalous,"
+                                     " 3 by default")
+    command_parser.add_argument('--anomaly-min-hits', type=positive_int,
+                                help="Minimum number of hits in the window of an anomalous status class, path or IP,"
+                                     " 50 by default")
+    command_parser.add_argument('--anomaly-half-life', type=positive_int,
+                                metavar='SECONDS', help="Seconds after which the weight of the hits in the baselines"
+                                                        " is halved, 3600 by default")
+
+
+def get_anomaly_options(args, alerts_file=None):
+    """
+    Options of the StatAnomalies producer
+    """
+    return dict(
+        alerts=args.alerts_file or alerts_file,
+        anomaly_bucket=args.anomaly_bucket,
+        anomaly_window=args.anomaly_window,
+        anomaly_factor=args.anomaly_factor,
+        anomaly_min_hits=args.anomaly_min_hits,
+        anomaly_half_life=args.anomaly_half_life,
+    )
+
+
+def flush_anomalies(stats_instances):
+    """
+    Check the last entries for anomalies, when the stats are not displayed nor saved
+    """
+    from apache_logs_parser.stats_producers import StatAnomalies
+
+    for stat in stats_instances:
+        if isinstance(stat, StatAnomalies):
+            stat.flush()
+
+
+def network(value):
+    """
+    argparse type for networks in the CIDR notation
+    """
+    from apache_logs_parser.ip import parse_network
+
+    try:
+        parse_network(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def _prefix_length(value, max_length):
+    try:
+        length = int(value)
+    except ValueError:
+        length = -1
+    if not 0 <= length <= max_length:
+        raise argparse.ArgumentTypeError(f"{value} is not a prefix length between 0 and {max_length}")
+    return length
+
+
+def ipv4_prefix_length(value):
+    """
+    argparse type for IPv4 prefix lengths, between 0 and 32
+    """
+    return _prefix_length(value, 32)
+
+
+def ipv6_prefix_length(value):
+    """
+    argparse type for IPv6 prefix lengths, between 0 and 128
+    """
+    return _prefix_length(value, 128)
 
 
 def main():
@@ -29,74 +232,561 @@ def main():
 
     # Sub-parser for each command
     command_parser = parser.add_subparsers(dest='command', help='command', required=True)
+    add_convert_parser(command_parser)
+    add_stats_parser(command_parser)
+    add_geoip_compile_parser(command_parser)
+    add_serve_parser(command_parser)
+    add_coordinate_parser(command_parser)
+    add_worker_parser(command_parser)
+    add_watch_parser(command_parser)
+    add_query_parser(command_parser)
+
+    # Read the values from the command line
+    args = parser.parse_args()
+
+    # Process arguments from the command line
+    try:
+        process_args(args)
+    except CommandError as e:
+        parser.error(str(e))
+
+
+def add_convert_parser(command_parser):
+    """
+    Parser for converting Apache log file files into JSON
+    """
+    from apache_logs_parser.constants import TIME_TAKEN_FORMATS, DEFAULT_TIME_TAKEN_FORMAT
 
-    # Parser for converting Apache log file files into JSON
     convert_parser = command_parser.add_parser(commands.CONVERT, help='Convert Apache log files into JSON')
     convert_parser.add_argument(dest='apache_log_files', type=argparse.FileType('r'),
                                 help="Input apache log input_files",
                                 nargs='+')
-    convert_parser.add_argument('-o', '--output-json', type=argparse.FileType('w'),
-                                default='log.json', help="Output path of the JSON file")
+    convert_parser.add_argument('-o', '--output-json', '--output',
+                                help="Output path of the JSON file or SQLite database, replaced if it exists,"
+                                     " log.json or log.db by default")
+    convert_parser.add_argument('--format', choices=OUTPUT_FORMATS, default=JSON_FORMAT,
+                                help="Output format, SQLite databases are indexed and can be used by the stats command")
+    convert_parser.add_argument('--ua-rules', type=argparse.FileType('r'),
+                                help="User agent classification rules file, replaces the default rules")
+    convert_parser.add_argument('--geoip-db', type=argparse.FileType('rb'),
+                                help="GeoIP database, CSV or compiled, used to add the country and ASN of the IPs")
+    convert_parser.add_argument('--time-taken', choices=TIME_TAKEN_FORMATS.keys(), default=DEFAULT_TIME_TAKEN_FORMAT,
+                                help="Format of the optional time taken field after the user agent:"
+                                     " D for %%D (microseconds), T for %%T (seconds), ms for %%{ms}T")
+    convert_parser.add_argument('--reject-file',
+                                help="Save the lines that could not be parsed in this file")
+    add_sample_arguments(convert_parser)
+    add_dedup_arguments(convert_parser)
+    convert_parser.add_argument('--rollup', action='store_true',
+                                help="Also write a rollup snapshot of the stats next to the JSON file,"
+                                     " used by the stats command instead of reading the entries")
+
+
+def json_encoder(value):
+    """
+    argparse type for the JSON encoders, they must be installed
+    """
+    from apache_logs_parser.constants import AUTO
+
+    if value != AUTO:
+        # Imported here as the serializers import the JSON encoders
+        from apache_logs_parser.serializers import get_serializer
+
+        try:
+            get_serializer(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        except ImportError as e:
+            raise argparse.ArgumentTypeError(f"JSON encoder {value} is not installed: {e}")
+    return value
+
+
+def add_output_arguments(command_parser):
+    """
+    Arguments of the commands displaying or saving stats
+    """
+    from apache_logs_parser.constants import AUTO
+
+    # Allow the user to save stats_instances computed, to use in a BI solution for example
+    command_parser.add_argument('-o', '--output-json', type=argparse.FileType('w'),
+                                help="Save raw stats_instances in a JSON file",
+                                required=False
+                                )
+    command_parser.add_argument('--compact-json', action='store_true',
+                                help="Save the stats JSON file without indentation")
+    command_parser.add_argument('--json-encoder', type=json_encoder, default=AUTO,
+                                help="JSON encoder used to save the stats, such as orjson or json, `auto` uses the"
+                                     " fastest one installed")
+    command_parser.add_argument('--no-display', action='store_true', help="Do not display the stats_instances")
+    command_parser.add_argument('--top', type=positive_int, default=None,
+                                help="Maximum number of entries displayed per chart or list, 10 or 20 by default"
+                                     " depending on the chart")
+
+
+def output_stats(args, stats_instances, sampling=None, display=True):
+    """
+    Display and save the stats as requested by the arguments added by `add_output_arguments`
+    :param display: False to never display the stats, whatever the arguments
+    """
+    from apache_logs_parser.sampling import display_sampling
+    from apache_logs_parser.stats import display_stats, write_json_stats
+
+    # Do we want to display the stats?
+    if display and not args.no_display:
+        display_stats(stats_instances, top=args.top)
+        if sampling is not None:
+            display_sampling(sampling)
+
+    # Do we wat to save the stats to a JSON file
+    if args.output_json:
+        write_json_stats(
+            stats_instances,
+            args.output_json.name,
+            compact=args.compact_json,
+            serializer=args.json_encoder,
+            sampling=sampling,
+        )
+
+
+def stat_class_name(value):
+    """
+    argparse type for the names of the StatProducer subclasses, they are only discovered when the option is used
+    """
+    from apache_logs_parser.stats_producers import get_stat_classes_by_name
 
-    # Parser for displaying statistics
+    try:
+        get_stat_classes_by_name(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def get_stats_classes(args):
+    """
+    :return: The StatProducer subclasses selected with `--stat-classes`, None for all
+    """
+    from apache_logs_parser.stats_producers import get_stat_classes_by_name
+
+    if not args.stat_classes:
+        return None
+    return [get_stat_classes_by_name(c) for c in args.stat_classes]
+
+
+def add_stats_parser(command_parser):
+    """
+    Parser for displaying statistics
+    """
     stat_parser = command_parser.add_parser(commands.STATS, help='Display Apache statistics based on JSON files')
     stat_parser.add_argument(dest='json_logs', type=argparse.FileType('r'),
-                             help="Input apache log input_files",
+                             help="Input JSON log files or SQLite databases",
                              nargs='+')
-
-    # Allow the user to save stats_instances computed, to use in a BI solution for example
-    stat_parser.add_argument('-o', '--output-json', type=argparse.FileType('w'),
-                             help="Save raw stats_instances in a JSON file",
-                             required=False
-                             )
-    stat_parser.add_argument('--no-display', action='store_true', help="Do not display the stats_instances")
+    add_output_arguments(stat_parser)
+    add_subnet_arguments(stat_parser)
+    stat_parser.add_argument('--geoip-db', type=argparse.FileType('rb'),
+                             help="GeoIP database, CSV or compiled, used to add the country and ASN of the IPs"
+                                  " of entries converted without it")
+    stat_parser.add_argument('--ignore-rollups', action='store_true',
+                             help="Always read the JSON entries, even if an up to date rollup snapshot exists")
+    stat_parser.add_argument('--memory-limit', type=memory_size, metavar='SIZE',
+                             help="Approximate memory used by each high cardinality counter of the stats, such as the"
+                                  " hits per IP or per page, before spilling it to temporary files, e.g. 512M")
+    add_sample_arguments(stat_parser)
+    add_dedup_arguments(stat_parser)
+    add_anomaly_arguments(stat_parser, "Write the alerts of the StatAnomalies producer as JSON lines to this file,"
+                                       " StatAnomalies is only used with this option or --stat-classes")
 
     # Allow the user to specify which stats_instances are computed/displayed
-    stat_parser.add_argument('--stat-classes', choices=get_stats_classes_names(),
-                             default=get_stats_classes_names(),
-                             nargs='+', help="Name of the stats_instances producers to use, uses all by default")
+    stat_parser.add_argument('--stat-classes', type=stat_class_name,
+                             nargs='+', help="Name of the stats_instances producers to use, uses all by default"
+                                             " except StatAnomalies without --alerts-file")
 
-    # Read the values from the command line
-    args = parser.parse_args()
 
-    # Process arguments from the command line
-    process_args(args)
+def add_geoip_compile_parser(command_parser):
+    """
+    Parser for compiling a CSV GeoIP database
+    """
+    geoip_parser = command_parser.add_parser(commands.GEOIP_COMPILE,
+                                             help='Compile a CSV GeoIP database into a binary file faster to load')
+    geoip_parser.add_argument(dest='csv_file', type=argparse.FileType('r'), help="CSV GeoIP database")
+    geoip_parser.add_argument(dest='output_file', type=argparse.FileType('wb'), help="Compiled database file")
+
+
+def add_serve_parser(command_parser):
+    """
+    Parser for the stats server
+    """
+    serve_parser = command_parser.add_parser(commands.SERVE,
+                                             help='Keep the stats in memory and answer queries over HTTP')
+    serve_parser.add_argument(dest='json_logs', type=argparse.FileType('r'), nargs='*',
+                              help="JSON log files to load at start up")
+    serve_parser.add_argument('--logs', type=argparse.FileType('r'), nargs='+', default=[],
+                              help="Apache log files to load at start up")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    serve_parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    serve_parser.add_argument('--socket', help="Listen on this Unix socket instead of a TCP port")
+    serve_parser.add_argument('--stat-classes', type=stat_class_name,
+                              nargs='+', help="Name of the stats_instances producers to use, uses all by default")
+
+
+def coordinator_address(value):
+    """
+    argparse type for HOST:PORT addresses
+    """
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"{value} is not a HOST:PORT address")
+    return host.strip('[]'), int(port)
+
+
+def add_coordinate_parser(command_parser):
+    """
+    Parser for the coordinator of the distributed stats
+    """
+    from apache_logs_parser.constants import TIME_TAKEN_FORMATS, DEFAULT_TIME_TAKEN_FORMAT
+
+    coordinate_parser = command_parser.add_parser(commands.COORDINATE,
+                                                  help='Compute the stats of log files with workers running next to'
+                                                       ' the files and merge them')
+    coordinate_parser.add_argument(dest='log_files', nargs='+',
+                                   help="Apache log files, JSON log files or SQLite databases, as seen by the workers")
+    coordinate_parser.add_argument('--host', default='0.0.0.0', help="Address to listen on for the workers")
+    coordinate_parser.add_argument('--port', type=int, default=8765, help="Port to listen on for the workers")
+    coordinate_parser.add_argument('--workers', type=positive_int, default=1,
+                                   help="Number of workers expected, a file is given up when all of them failed to"
+                                        " process it")
+    coordinate_parser.add_argument('--max-attempts', type=positive_int, default=3,
+                                   help="Number of times a file is given to a worker before giving up")
+    coordinate_parser.add_argument('--task-timeout', type=positive_int, metavar='SECONDS',
+                                   help="Seconds to wait for the stats of a file before giving it to another worker")
+    coordinate_parser.add_argument('--timeout', type=positive_int, metavar='SECONDS',
+                                   help="Maximum number of seconds to wait for all the files to be processed")
+    coordinate_parser.add_argument('--time-taken', choices=TIME_TAKEN_FORMATS.keys(),
+                                   default=DEFAULT_TIME_TAKEN_FORMAT,
+                                   help="Format of the optional time taken field of the Apache log files")
+    coordinate_parser.add_argument('--memory-limit', type=memory_size, metavar='SIZE',
+                                   help="Approximate memory used by each high cardinality counter of the stats, on"
+                                        " the coordinator and the workers, before spilling it to temporary files,"
+                                        " e.g. 512M")
+    coordinate_parser.add_argument('--allow-partial', action='store_true',
+                                   help="Output the stats of the files processed even if some files could not be"
+                                        " processed, the command fails otherwise")
+    add_subnet_arguments(coordinate_parser)
+    add_output_arguments(coordinate_parser)
+    coordinate_parser.add_argument('--stat-classes', type=stat_class_name,
+                                   nargs='+', help="Name of the stats_instances producers to use, uses all by default"
+                                                   " except StatAnomalies")
+
+
+def add_worker_parser(command_parser):
+    """
+    Parser for the workers of the distributed stats
+    """
+    worker_parser = command_parser.add_parser(commands.WORKER,
+                                              help='Compute the stats of the log files given by a coordinator')
+    worker_parser.add_argument('--coordinator', type=coordinator_address, required=True, metavar='HOST:PORT',
+                               help="Address of the coordinator")
+    worker_parser.add_argument('--name', help="Name of the worker, host name and process ID by default")
+    worker_parser.add_argument('--connect-timeout', type=positive_int, default=30, metavar='SECONDS',
+                               help="Seconds to retry connecting to the coordinator")
+
+
+def add_watch_parser(command_parser):
+    """
+    Parser for the streaming anomaly detection
+    """
+    from apache_logs_parser.constants import TIME_TAKEN_FORMATS, DEFAULT_TIME_TAKEN_FORMAT
+
+    watch_parser = command_parser.add_parser(commands.WATCH,
+                                             help='Read Apache log lines as they are written and alert on sudden'
+                                                  ' rises of the hits per status class, path or IP')
+    watch_parser.add_argument(dest='apache_log_files', type=argparse.FileType('r'), nargs='*',
+                              help="Apache log files, the standard input by default")
+    watch_parser.add_argument('--time-taken', choices=TIME_TAKEN_FORMATS.keys(), default=DEFAULT_TIME_TAKEN_FORMAT,
+                              help="Format of the optional time taken field of the Apache log lines")
+    watch_parser.add_argument('--reject-file',
+                              help="Save the lines that could not be parsed in this file")
+    add_anomaly_arguments(watch_parser, "Write the alerts as JSON lines to this file instead of the standard output,"
+                                        " the stats are only displayed at the end with this option")
+    add_output_arguments(watch_parser)
+    watch_parser.add_argument('--stat-classes', type=stat_class_name,
+                              default=['StatAnomalies'],
+                              nargs='+', help="Name of the stats_instances producers to use, StatAnomalies by default")
+
+
+def group_field(value):
+    """
+    argparse type for the fields grouping the entries of a query
+    """
+    from apache_logs_parser.query import resolve_field, DERIVED_FIELDS
+
+    if value not in DERIVED_FIELDS:
+        try:
+            resolve_field(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def aggregate_expression(value):
+    """
+    argparse type for the aggregates of a query
+    """
+    from apache_logs_parser.query import parse_aggregate
+
+    try:
+        return parse_aggregate(value).name
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_query_parser(command_parser):
+    """
+    Parser for the ad-hoc aggregations
+    """
+    from apache_logs_parser.constants import AUTO
+
+    query_parser = command_parser.add_parser(commands.QUERY,
+                                             help='Group the entries of JSON files by fields and aggregate them')
+    query_parser.add_argument(dest='json_logs', type=argparse.FileType('r'), nargs='+',
+                              help="Input JSON log files or SQLite databases")
+    query_parser.add_argument('-g', '--group-by', type=group_field, nargs='+', default=[], metavar='FIELD',
+                              help="Fields grouping the entries, such as path or ip, or derived fields: minute, hour,"
+                                   " day, status_class")
+    query_parser.add_argument('-a', '--aggregate', type=aggregate_expression, nargs='+', default=['count'],
+                              metavar='AGGREGATE',
+                              help="Aggregates of each group: count, sum(FIELD), avg(FIELD), min(FIELD), max(FIELD),"
+                                   " distinct(FIELD) or percentiles such as p95(FIELD), count by default")
+    query_parser.add_argument('--order-by', metavar='AGGREGATE',
+                              help="Aggregate sorting the rows, the first one by default")
+    query_parser.add_argument('--ascending', action='store_true', help="Smallest values first")
+    query_parser.add_argument('--top', type=positive_int, default=20,
+                              help="Maximum number of rows, 20 by default")
+    query_parser.add_argument('--all', action='store_true', help="Output all the rows")
+    query_parser.add_argument('-o', '--output-json', type=argparse.FileType('w'),
+                              help="Save the rows in a JSON file")
+    query_parser.add_argument('--compact-json', action='store_true',
+                              help="Save the JSON file without indentation")
+    query_parser.add_argument('--json-encoder', type=json_encoder, default=AUTO,
+                              help="JSON encoder used to save the rows, such as orjson or json, `auto` uses the"
+                                   " fastest one installed")
+    query_parser.add_argument('--no-display', action='store_true', help="Do not display the rows")
+
+
+def get_enrichers(args):
+    """
+    Functions adding fields to the log entries, as requested by the command line
+    """
+    from apache_logs_parser.geoip import GeoIpDatabase
+
+    enrichers = []
+    if args.geoip_db:
+        enrichers.append(GeoIpDatabase.from_file(args.geoip_db.name).enrich)
+    return enrichers
 
 
 def process_args(args):
     """
     Processing arguments provided by argparse
     """
+    import logging
 
     log_level = logging.INFO
     if args.verbose:
         log_level = logging.DEBUG
     logging.basicConfig(level=log_level)
 
-    # Convert command
-    if args.command == commands.CONVERT:
-        write_json_log(
+    COMMAND_FUNCTIONS[args.command](args)
+
+
+def run_convert(args):
+    """
+    Convert command
+    """
+    from apache_logs_parser.classify import set_rules_file
+    from apache_logs_parser.parser import write_json_log, set_time_taken_format
+    from apache_logs_parser.rejects import RejectedLines
+    from apache_logs_parser.sqlite_backend import write_sqlite_log
+
+    if args.ua_rules:
+        set_rules_file(args.ua_rules.name)
+    set_time_taken_format(args.time_taken)
+    if args.format == SQLITE_FORMAT:
+        write_log, default_output = write_sqlite_log, 'log.db'
+    else:
+        write_log, default_output = write_json_log, 'log.json'
+    deduplicator = get_deduplicator(args)
+    with RejectedLines(args.reject_file) as rejects:
+        write_log(
             [f.name for f in args.apache_log_files],
-            args.output_json.name,
+            args.output_json or default_output,
+            rollup=args.rollup,
+            enrichers=get_enrichers(args),
+            rejects=rejects,
+            sampler=get_sampler(args),
+            line_filters=[deduplicator.keep_line] if deduplicator else None,
         )
+    if deduplicator:
+        deduplicator.log_summary()
 
-    # Stats command
-    if args.command == commands.STATS:
-        # We get only the stats_instances producer we want
-        stats_instances = generate_stats(
-            [f.name for f in args.json_logs],
-            [get_stat_classes_by_name(c) for c in args.stat_classes]
-        )
-        # Do we want to display the stats?
-        if not args.no_display:
-            display_stats(stats_instances)
-
-        # Do we wat to save the stats to a JSON file
-        if args.output_json:
-            write_json_stats(
-                stats_instances,
-                args.output_json.name
-            )
+
+def run_stats(args):
+    """
+    Stats command
+    """
+    from apache_logs_parser.sampling import get_sampling, sampling_metrics
+    from apache_logs_parser.stats import generate_stats
+    from apache_logs_parser.stats_producers import get_default_stats_classes
+
+    input_files = [f.name for f in args.json_logs]
+    sampler = get_sampler(args)
+    try:
+        sampling = get_sampling(input_files, sampler)
+    except ValueError as e:
+        raise CommandError(str(e))
+    deduplicator = get_deduplicator(args)
+    # We get only the stats_instances producer we want
+    stats_classes = get_stats_classes(args)
+    if stats_classes is None and not args.alerts_file:
+        stats_classes = get_default_stats_classes()
+    stats_instances = generate_stats(
+        input_files,
+        stats_classes,
+        use_rollups=not args.ignore_rollups,
+        options=dict(
+            memory_limit=args.memory_limit,
+            **get_subnet_options(args),
+            **get_anomaly_options(args),
+        ),
+        enrichers=get_enrichers(args),
+        sampler=sampler,
+        entry_filters=[deduplicator.keep_entry] if deduplicator else None,
+    )
+    if deduplicator:
+        deduplicator.log_summary()
+    flush_anomalies(stats_instances)
+    if sampling is not None:
+        sampling = sampling_metrics(sampling['rate'], sampling['key'],
+                                    sampler.kept if sampler else sampling['kept'])
+    output_stats(args, stats_instances, sampling)
+
+
+def run_geoip_compile(args):
+    """
+    GeoIP database compilation command
+    """
+    from apache_logs_parser.geoip import compile_database
+
+    compile_database(args.csv_file.name, args.output_file.name)
+
+
+def run_serve(args):
+    """
+    Stats server command
+    """
+    from apache_logs_parser.server import StatsService, serve
+
+    service = StatsService(get_stats_classes(args))
+    service.load_json_files([f.name for f in args.json_logs])
+    for log_file in args.logs:
+        with open(log_file.name, 'r') as f:
+            service.ingest_lines(f)
+    serve(service, args.host, args.port, args.socket)
+
+
+def run_coordinate(args):
+    """
+    Distributed stats coordinator command
+    """
+    from apache_logs_parser.distributed import Coordinator, coordinate
+    from apache_logs_parser.sampling import sampling_metrics
+    from apache_logs_parser.stats_producers import get_default_stats_classes
+
+    coordinator = Coordinator(
+        args.log_files,
+        get_stats_classes(args) or get_default_stats_classes(),
+        options=dict(memory_limit=args.memory_limit, **get_subnet_options(args)),
+        time_taken=args.time_taken,
+        max_attempts=args.max_attempts,
+        task_timeout=args.task_timeout,
+        expected_workers=args.workers,
+    )
+    if not coordinate(coordinator, args.host, args.port, args.timeout) and not args.allow_partial:
+        missing = len(args.log_files) - len(coordinator.processed)
+        raise CommandError(f"{missing} of {len(args.log_files)} files could not be processed,"
+                           f" use --allow-partial to output the stats of the others")
+    try:
+        stats_instances, sampling = coordinator.get_sampled_stats()
+    except ValueError as e:
+        raise CommandError(str(e))
+    if sampling is not None:
+        sampling = sampling_metrics(sampling['rate'], sampling['key'], sampling['kept'])
+    output_stats(args, stats_instances, sampling)
+
+
+def run_worker_command(args):
+    """
+    Distributed stats worker command
+    """
+    from apache_logs_parser.distributed import run_worker
+
+    host, port = args.coordinator
+    run_worker(host, port, args.name, args.connect_timeout)
+
+
+def run_watch(args):
+    """
+    Streaming anomaly detection command, the entries are fed to the producers as soon as their line is read
+    """
+    from apache_logs_parser.parser import parse_line, set_time_taken_format
+    from apache_logs_parser.rejects import RejectedLines
+    from apache_logs_parser.stats import create_stats_instances
+
+    set_time_taken_format(args.time_taken)
+    stats_instances = create_stats_instances(
+        get_stats_classes(args),
+        get_anomaly_options(args, alerts_file=sys.stdout),
+    )
+    with RejectedLines(args.reject_file) as rejects:
+        for log_file in args.apache_log_files or [sys.stdin]:
+            for line in log_file:
+                data_entry = parse_line(line, rejects)
+                if not data_entry:
+                    continue
+                for stat in stats_instances:
+                    stat.process_entry(data_entry)
+    flush_anomalies(stats_instances)
+    # Without --alerts-file the standard output is a stream of JSON alerts, the report is not mixed with them
+    output_stats(args, stats_instances, display=args.alerts_file is not None)
+
+
+def run_query_command(args):
+    """
+    Ad-hoc aggregation command
+    """
+    from apache_logs_parser.query import QueryPlan, run_query, display_rows, write_json_rows
+
+    try:
+        plan = QueryPlan(args.group_by, args.aggregate, order_by=args.order_by, ascending=args.ascending)
+    except ValueError as e:
+        raise CommandError(str(e))
+    run_query([f.name for f in args.json_logs], plan)
+    rows = plan.get_rows(top=None if args.all else args.top)
+    if not args.no_display:
+        display_rows(rows, plan.columns)
+    if args.output_json:
+        write_json_rows(plan, rows, args.output_json.name, compact=args.compact_json, serializer=args.json_encoder)
+
+
+COMMAND_FUNCTIONS = {
+    commands.CONVERT: run_convert,
+    commands.STATS: run_stats,
+    commands.GEOIP_COMPILE: run_geoip_compile,
+    commands.SERVE: run_serve,
+    commands.COORDINATE: run_coordinate,
+    commands.WORKER: run_worker_command,
+    commands.WATCH: run_watch,
+    commands.QUERY: run_query_command,
+}
 
 
 # If the file is executed, not imported
@@ -0,0 +1,298 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Streaming detection of sudden rises of the hits per response code class, path and IP.
+
+The entries are counted in buckets of a few seconds of log time. The last buckets form a sliding window, kept in a
+ring buffer of fixed size. When a bucket leaves the window, its counts are added to an exponentially decayed baseline
+of the hits per bucket of each key. A key is anomalous when its hits in the window are above `factor` times its
+baseline over the same duration. Keys without a baseline are compared to 1 hit per window.
+
+The memory used depends on the number of keys in the window, and on `max_keys` for the baselines, not on the size of
+the logs. Entries are expected in time order, entries older than the bucket being filled are skipped and counted as
+late entries.
+"""
+
+import copy
+import heapq
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+# Number of seconds of a bucket
+DEFAULT_BUCKET_SECONDS = 10
+# Number of buckets of the sliding window
+DEFAULT_WINDOW_BUCKETS = 12
+# Hits in the window above this factor of the baseline are anomalous
+DEFAULT_FACTOR = 3.0
+# Minimum number of hits in the window of an anomalous key
+DEFAULT_MIN_HITS = 50
+# Seconds after which the weight of the hits in the baseline is halved
+DEFAULT_HALF_LIFE = 3600
+# Maximum number of keys with a baseline, per dimension
+DEFAULT_MAX_KEYS = 100000
+# Baselines below this decayed number of hits are forgotten
+MIN_BASELINE = 0.01
+
+STATUS_CLASS = 'status_class'
+PATH = 'path'
+IP = 'ip'
+
+
+def _status_class(data_entry):
+    return f"{data_entry['response'] // 100}xx"
+
+
+# Function giving the key of an entry, for each dimension
+DIMENSIONS = {
+    STATUS_CLASS: _status_class,
+    PATH: lambda data_entry: data_entry['path'],
+    IP: lambda data_entry: data_entry['remote_ip'],
+}
+
+
+class SlidingWindow(object):
+    """
+    Hits per key of the last buckets, and decayed baselines of the hits per bucket of the buckets before them
+    """
+
+    def __init__(self, size, decay, max_keys=DEFAULT_MAX_KEYS):
+        """
+        :param size: Number of buckets of the window
+        :param decay: Weight of the hits of a bucket in the baseline after each bucket, between 0 and 1
+        :param max_keys: Maximum number of keys with a baseline, the ones with the lowest baselines are forgotten
+        """
+        self.size = size
+        self.decay = decay
+        self.max_keys = max_keys
+        # Ring buffer of (bucket, Counter of hits per key)
+        self.slots = [None] * size
+        self.position = 0
+        # Hits per key in the window
+        self.totals = Counter()
+        # Decayed sum of the hits per key, and bucket it was last updated at
+        self.sums = dict()
+        # Decayed number of buckets in the sums, as of `baseline_bucket`
+        self.weight = 0.0
+        self.baseline_bucket = None
+        # Number of buckets which left the window
+        self.history = 0
+
+    def push(self, bucket, counts):
+        """
+        Add the counts of a bucket to the window, the oldest bucket leaves the window
+        :param bucket: Index of the bucket, greater than the ones already pushed
+        :param counts: Hits per key of the bucket
+        :type counts: Counter
+        """
+        evicted = self.slots[self.position]
+        if evicted is not None:
+            self._add_to_baseline(*evicted)
+        self.slots[self.position] = (bucket, counts)
+        self.position = (self.position + 1) % self.size
+        self.totals.update(counts)
+        if self.position == 0:
+            self._prune()
+
+    def _add_to_baseline(self, bucket, counts):
+        if self.baseline_bucket is not None:
+            self.weight *= self.decay ** (bucket - self.baseline_bucket)
+        self.weight += 1
+        self.baseline_bucket = bucket
+        self.history += 1
+        totals, sums, decay = self.totals, self.sums, self.decay
+        for key, hits in counts.items():
+            total, last_bucket = sums.get(key, (0.0, bucket))
+            sums[key] = (total * decay ** (bucket - last_bucket) + hits, bucket)
+            totals[key] -= hits
+            if not totals[key]:
+                del totals[key]
+
+    def _decayed_sum(self, key):
+        total, last_bucket = self.sums.get(key, (0.0, self.baseline_bucket))
+        return total * self.decay ** (self.baseline_bucket - last_bucket)
+
+    def _prune(self):
+        if self.baseline_bucket is None:
+            return
+        decayed = {key: self._decayed_sum(key) for key in self.sums}
+        forgotten = [key for key, total in decayed.items() if total < MIN_BASELINE]
+        if len(decayed) - len(forgotten) > self.max_keys:
+            kept = set(heapq.nlargest(self.max_keys, decayed, key=decayed.get))
+            forgotten = [key for key in decayed if key not in kept]
+        for key in forgotten:
+            del self.sums[key]
+
+    def copy(self):
+        """
+        :return: Copy of the window which can be pushed to without changing this window
+        """
+        window = copy.copy(self)
+        window.slots = list(self.slots)
+        window.totals = Counter(self.totals)
+        window.sums = dict(self.sums)
+        return window
+
+    def expected(self, key):
+        """
+        :return: Hits of the key expected in the window according to its baseline, None before a window of history
+        :rtype: float|None
+        """
+        if self.history < self.size:
+            return None
+        return self._decayed_sum(key) / self.weight * self.size
+
+
+class AnomalyDetector(object):
+    """
+    Count the entries in sliding windows per dimension and call a function for each anomaly found
+    """
+
+    def __init__(self, bucket_seconds=None, window_buckets=None, factor=None, min_hits=None, half_life=None,
+                 max_keys=DEFAULT_MAX_KEYS, on_alert=None):
+        """
+        :param bucket_seconds: Number of seconds of a bucket
+        :param window_buckets: Number of buckets of the sliding window
+        :param factor: Hits in the window above this factor of the baseline are anomalous
+        :param min_hits: Minimum number of hits in the window of an anomalous key
+        :param half_life: Seconds after which the weight of the hits in the baseline is halved
+        :param max_keys: Maximum number of keys with a baseline, per dimension
+        :param on_alert: Function called with each alert, see `alert`
+        """
+        self.bucket_seconds = bucket_seconds or DEFAULT_BUCKET_SECONDS
+        self.window_buckets = window_buckets or DEFAULT_WINDOW_BUCKETS
+        self.factor = factor or DEFAULT_FACTOR
+        self.min_hits = min_hits or DEFAULT_MIN_HITS
+        decay = 0.5 ** (self.bucket_seconds / (half_life or DEFAULT_HALF_LIFE))
+        self.windows = {name: SlidingWindow(self.window_buckets, decay, max_keys) for name in DIMENSIONS}
+        self.on_alert = on_alert
+        # Bucket being filled and its hits per key, per dimension
+        self.bucket = None
+        self.current = {name: Counter() for name in DIMENSIONS}
+        # Anomalous keys already alerted, per dimension
+        self.active = {name: set() for name in DIMENSIONS}
+        self._last_time = None
+        self._last_bucket = None
+        # Entries older than the bucket being filled when they were added
+        self.late_entries = 0
+
+    def get_bucket(self, time):
+        """
+        :param time: Time of an entry in the ISO 8601 format
+        :return: Index of the bucket of the time
+        """
+        # Consecutive entries often have the same time
+        if time != self._last_time:
+            self._last_time = time
+            self._last_bucket = int(datetime.fromisoformat(time).timestamp() // self.bucket_seconds)
+        return self._last_bucket
+
+    def add_entries(self, data_entries):
+        """
+        Count entries, buckets are closed and checked for anomalies when an entry of a later bucket is found.
+        Entries of a bucket already closed are skipped, counting them in the bucket being filled would raise alerts
+        :param data_entries: List of Apache log lines as dicts
+        """
+        start = 0
+        for index, data_entry in enumerate(data_entries):
+            bucket = self.get_bucket(data_entry['time'])
+            if self.bucket is None:
+                self.bucket = bucket
+            elif bucket > self.bucket:
+                self._count(data_entries[start:index])
+                start = index
+                self._advance(bucket)
+            elif bucket < self.bucket:
+                self._count(data_entries[start:index])
+                start = index + 1
+                self.late_entries += 1
+        self._count(data_entries[start:])
+
+    def _count(self, data_entries):
+        for name, get_key in DIMENSIONS.items():
+            self.current[name].update(map(get_key, data_entries))
+
+    def _advance(self, bucket):
+        self._close()
+        # Empty buckets older than the window do not change the window
+        for empty in range(max(self.bucket, bucket - self.window_buckets), bucket):
+            for window in self.windows.values():
+                window.push(empty, Counter())
+        self.bucket = bucket
+
+    def _close(self):
+        for name, window in self.windows.items():
+            counts = self.current[name]
+            window.push(self.bucket, counts)
+            self._check(name, window, counts)
+            self.current[name] = Counter()
+        self.bucket += 1
+
+    def flush(self):
+        """
+        Close the bucket being filled, at the end of the entries
+        """
+        if self.bucket is not None and any(self.current.values()):
+            self._close()
+
+    def pending_alerts(self):
+        """
+        Check the bucket being filled for anomalies as if it was closed, without closing it nor calling `on_alert`
+        :return: Alerts of the bucket being filled which would be raised if there were no more entries
+        :rtype: list
+        """
+        if self.bucket is None or not any(self.current.values()):
+            return []
+        alerts = []
+        preview = copy.copy(self)
+        preview.windows = {name: window.copy() for name, window in self.windows.items()}
+        preview.current = dict(self.current)
+        preview.active = {name: set(keys) for name, keys in self.active.items()}
+        preview.on_alert = alerts.append
+        preview._close()
+        return alerts
+
+    def _check(self, name, window, counts):
+        active = self.active[name]
+        for key in list(active):
+            expected = window.expected(key)
+            if expected is None or window.totals[key] < self.factor * max(expected, 1.0):
+                active.discard(key)
+        for key in counts:
+            if key in active:
+                continue
+            hits = window.totals[key]
+            expected = window.expected(key)
+            if expected is None or hits < self.min_hits:
+                continue
+            expected = max(expected, 1.0)
+            if hits >= self.factor * expected:
+                active.add(key)
+                if self.on_alert is not None:
+                    self.on_alert(self.alert(name, key, hits, expected))
+
+    def alert(self, dimension, key, hits, expected):
+        """
+        :return: Description of an anomaly, at the end of the window of the bucket being closed
+        :rtype: dict
+        """
+        end = datetime.fromtimestamp((self.bucket + 1) * self.bucket_seconds, timezone.utc)
+        return dict(
+            time=end.isoformat(),
+            dimension=dimension,
+            key=key,
+            hits=hits,
+            expected=round(expected, 1),
+            ratio=round(hits / expected, 1),
+            window_seconds=self.window_buckets * self.bucket_seconds,
+        )
+
+
+def write_alert(alerts_file, alert):
+    """
+    Write an alert as a JSON line, flushed so it can be followed while the logs are read
+    :param alerts_file: Text file
+    :param alert: Alert returned by `AnomalyDetector.alert`
+    """
+    alerts_file.write(json.dumps(alert) + '\n')
+    alerts_file.flush()
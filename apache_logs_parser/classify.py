@@ -0,0 +1,224 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+User agent classification.
+All the tokens of a rules file are compiled in a single Aho-Corasick automaton, so a user agent is read once whatever
+the number of rules.
+"""
+
+import logging
+import os
+import re
+import shlex
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+BOT = 'bot'
+MOBILE = 'mobile'
+DESKTOP = 'desktop'
+CATEGORIES = (BOT, MOBILE, DESKTOP)
+
+# What can follow a token to be part of the system agent
+VERSIONS = {
+    'dotted': re.compile(r'\d+(?:\.\d+)*'),
+    'underscored': re.compile(r'\d+(?:_\d+)*'),
+    'word': re.compile(r'[A-Za-z0-9._ ]+'),
+}
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ua_rules.txt')
+
+# Lower case only ASCII letters so that positions in the lowered string match the original string
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+UNKNOWN_SYSTEM_AGENT = 'Unknown'
+
+
+class MultiPatternMatcher(object):
+    """
+    Aho-Corasick automaton finding all the occurrences of several patterns in a single pass over a text
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: List of strings to search for
+        :type patterns: list[str]
+        """
+        self.patterns = list(patterns)
+        # State 0 is the root, each state has its transitions, its failure state and the patterns ending there
+        self.transitions = [dict()]
+        self.failures = [0]
+        self.outputs = [[]]
+        for index, pattern in enumerate(self.patterns):
+            self._add_pattern(pattern, index)
+        self._build_failures()
+
+    def _add_pattern(self, pattern, index):
+        if not pattern:
+            raise ValueError("Patterns can't be empty")
+        state = 0
+        for char in pattern:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][char] = next_state
+                self.transitions.append(dict())
+                self.failures.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(index)
+
+    def _build_failures(self):
+        # Breadth first, so the failure state of the parent is known when handling a state
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(char, 0)
+                self.failures[next_state] = failure if failure != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failures[next_state]]
+
+    def iter_matches(self, text):
+        """
+        Find all the occurrences of the patterns
+        :param text: Text to search in
+        :return: Generator of (start position, pattern index) tuples, ordered by end position
+        """
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+        patterns = self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(char, 0)
+            for index in outputs[state]:
+                yield position - len(patterns[index]) + 1, index
+
+
+class Rule(object):
+    """
+    A classification rule, see ua_rules.txt for the format
+    """
+
+    def __init__(self, category, token, version=None):
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown rule category {category}")
+        if version is not None and version not in VERSIONS:
+            raise ValueError(f"Unknown rule version {version}")
+        self.category = category
+        self.token = token
+        self.version_re = VERSIONS[version] if version else None
+
+    def match_end(self, user_agent, start):
+        """
+        :return: The end position of the system agent found at `start` or None if the version does not match
+        :rtype: int|None
+        """
+        end = start + len(self.token)
+        if self.version_re is None:
+            return end
+        version_match = self.version_re.match(user_agent, end)
+        if version_match:
+            return version_match.end()
+        return None
+
+
+def read_rules(file_name):
+    """
+    Read a rules file
+    :param file_name: Name of the rules file, see ua_rules.txt for the format
+    :rtype: list[Rule]
+    """
+    rules = []
+    with open(file_name, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            try:
+                rules.append(Rule(*fields))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid rule line {line_number} in {file_name}: {e}")
+    return rules
+
+
+class UserAgentClassifier(object):
+    """
+    Classify user agents as bots, mobile or desktop clients and identify their system agent
+    """
+
+    def __init__(self, rules, cache_size=4096):
+        """
+        :param rules: List of Rule
+        :param cache_size: Number of user agents whose classification is kept, user agents are very repetitive
+        """
+        self.rules = list(rules)
+        self.matcher = MultiPatternMatcher([rule.token.translate(_ASCII_LOWER) for rule in self.rules])
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    @classmethod
+    def from_file(cls, file_name=DEFAULT_RULES_FILE):
+        return cls(read_rules(file_name))
+
+    def _classify(self, user_agent):
+        is_bot = False
+        # Best match per category as (start, rule index, end)
+        best = dict()
+        for start, index in self.matcher.iter_matches(user_agent.translate(_ASCII_LOWER)):
+            rule = self.rules[index]
+            if rule.category == BOT:
+                is_bot = True
+                continue
+            current = best.get(rule.category)
+            # Rightmost match wins, then the first rule
+            if current is not None and (current[0], -current[1]) > (start, -index):
+                continue
+            end = rule.match_end(user_agent, start)
+            if end is not None:
+                best[rule.category] = (start, index, end)
+
+        is_mobile = MOBILE in best
+        match = best.get(MOBILE) or best.get(DESKTOP)
+        os_string = UNKNOWN_SYSTEM_AGENT
+        if match:
+            os_string = user_agent[match[0]:match[2]]
+        else:
+            logger.debug('OS could not be guessed for UA "{}"'.format(user_agent))
+
+        return dict(
+            is_mobile=is_mobile,
+            is_bot=is_bot,
+            system_agent=os_string,
+        )
+
+
+_default_classifier = None
+
+
+def get_classifier():
+    """
+    Classifier used by `extract.extract_client_information`, loaded from the default rules file unless
+    `set_rules_file` was called
+    :rtype: UserAgentClassifier
+    """
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = UserAgentClassifier.from_file()
+    return _default_classifier
+
+
+def set_rules_file(file_name):
+    """
+    Use the rules of another file to classify user agents
+    :param file_name: Name of the rules file, see ua_rules.txt for the format
+    """
+    global _default_classifier
+    _default_classifier = UserAgentClassifier.from_file(file_name)
+    logger.info(f"Loaded {len(_default_classifier.rules)} user agent rules from {file_name}")
@@ -15,5 +15,9 @@ class Colors(object):
     UNDERLINE = '\033[4m'
 
 
+def format_header(title):
+    return Colors.BOLD + Colors.HEADER + Colors.UNDERLINE + title + Colors.ENDC
+
+
 def header(title):
-    print(Colors.BOLD + Colors.HEADER + Colors.UNDERLINE + title + Colors.ENDC)
+    print(format_header(title))
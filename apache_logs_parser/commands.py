@@ -4,7 +4,19 @@ Constants to prevent typos
 
 CONVERT = 'convert'
 STATS = 'stats'
+GEOIP_COMPILE = 'geoip-compile'
+SERVE = 'serve'
+COORDINATE = 'coordinate'
+WORKER = 'worker'
+WATCH = 'watch'
+QUERY = 'query'
 COMMANDS = [
     CONVERT,
     STATS,
+    GEOIP_COMPILE,
+    SERVE,
+    COORDINATE,
+    WORKER,
+    WATCH,
+    QUERY,
 ]
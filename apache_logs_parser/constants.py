@@ -0,0 +1,25 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Values shared by the command line and the modules of the commands.
+This module imports nothing, so that the parsers of the commands are built without importing the modules of the
+commands.
+"""
+
+# Number of microseconds in the unit of each format of the time taken field, see `parser.set_time_taken_format`
+TIME_TAKEN_FORMATS = {
+    'D': 1,
+    'T': 1000000,
+    'ms': 1000,
+}
+DEFAULT_TIME_TAKEN_FORMAT = 'D'
+
+# Sample keys, see sampling.py
+IP_KEY = 'ip'
+SESSION_KEY = 'session'
+LINE_KEY = 'line'
+# From the coarsest to the finest
+SAMPLE_KEYS = [IP_KEY, SESSION_KEY, LINE_KEY]
+
+# Name of the JSON serializer using the fastest encoder installed, see `serializers.get_serializer`
+AUTO = 'auto'
@@ -0,0 +1,200 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Removal of duplicate log lines, found in several input files when logs are rotated with copytruncate or pulled from
+load-balanced mirrors.
+
+Lines are not kept in memory: a 16 bytes BLAKE2b fingerprint of each line is added to a Bloom filter, whose size only
+depends on the expected number of lines and on the accepted false positive rate. A false positive drops a line which
+is not a duplicate.
+
+Only the lines already seen in a previous input file are dropped: identical requests of a client in the same second
+are identical lines of the same file, and they are real hits. The fingerprints of the current file are added to a
+second filter, merged in the filter of the previous files when the next file starts.
+"""
+
+import hashlib
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 1000000
+DEFAULT_ERROR_RATE = 0.001
+# Fields identifying an entry, all the fields of a line
+ENTRY_FIELDS = ['remote_ip', 'time', 'request', 'response', 'bytes', 'referrer', 'user_agent', 'response_time_us']
+
+
+def fingerprint(value):
+    """
+    :param value: Line or key of an entry
+    :type value: str
+    :rtype: bytes
+    """
+    return hashlib.blake2b(value.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+
+class BloomFilter(object):
+    """
+    Set of fingerprints with a bounded memory, membership tests can give false positives
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """
+        :param capacity: Number of fingerprints expected, the false positive rate increases above it
+        :param error_rate: False positive rate when the filter holds `capacity` fingerprints
+        """
+        if capacity <= 0:
+            raise ValueError("Capacity must be strictly positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate must be between 0 and 1 excluded")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, digest):
+        """
+        Add a fingerprint
+        :param digest: Fingerprint of at least 16 bytes, see `fingerprint`
+        :type digest: bytes
+        :return: True if the fingerprint was probably already added
+        :rtype: bool
+        """
+        # Double hashing: the positions are derived from two halves of the fingerprint
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        bits = self.bits
+        present = True
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def update(self, other):
+        """
+        Add the fingerprints of another filter with the same capacity and error rate
+        :type other: BloomFilter
+        """
+        merged = int.from_bytes(self.bits, 'little') | int.from_bytes(other.bits, 'little')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'little'))
+        self.count += other.count
+
+    def false_positive_rate(self, count=None):
+        """
+        :param count: Number of fingerprints added, the ones of this filter by default
+        :return: Estimated false positive rate
+        :rtype: float
+        """
+        count = self.count if count is None else count
+        return (1 - math.exp(-self.hashes * count / self.size)) ** self.hashes
+
+    def __contains__(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in ((h1 + i * h2) % self.size for i in range(self.hashes)))
+
+    def __len__(self):
+        return self.count
+
+
+class FileFilter(object):
+    """
+    Filter function of a Deduplicator, `parser.parse_log_file` and `stats.generate_stats` call its `start_file` method
+    before the lines or entries of each file
+    """
+
+    def __init__(self, deduplicator, get_key):
+        self.deduplicator = deduplicator
+        self.get_key = get_key
+
+    def __call__(self, value):
+        """
+        :return: False for the duplicates of lines of the previous files
+        :rtype: bool
+        """
+        # Empty lines are left to the parser
+        return not value or self.deduplicator.keep(self.get_key(value))
+
+    def start_file(self, file_name):
+        self.deduplicator.start_file(file_name)
+
+
+def start_file(filters, file_name):
+    """
+    Tell the filters which need it, like the ones of a Deduplicator, that the lines of a new file follow
+    :param filters: List of functions returning False for the lines or entries to skip, or None
+    :param file_name: Name of the file
+    """
+    for keep in filters or ():
+        if isinstance(keep, FileFilter):
+            keep.start_file(file_name)
+
+
+def entry_key(data_entry):
+    return '\0'.join(str(data_entry.get(field)) for field in ENTRY_FIELDS)
+
+
+class Deduplicator(object):
+    """
+    Drop the lines, or entries, already seen in a previous file
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        """
+        :param capacity: Number of different lines expected
+        :param error_rate: Rate of lines wrongly dropped when there are `capacity` different lines
+        """
+        # Lines of the previous files, and of the current file
+        self.previous = BloomFilter(capacity, error_rate)
+        self.current = BloomFilter(capacity, error_rate)
+        self.capacity = capacity
+        self.duplicates = 0
+        # Filters of the lines and of the entries, given to the parser or to the stats
+        self.keep_line = FileFilter(self, str)
+        self.keep_entry = FileFilter(self, entry_key)
+
+    def __len__(self):
+        """
+        :return: Number of different lines seen
+        """
+        return len(self.previous) + len(self.current)
+
+    def start_file(self, file_name):
+        """
+        Lines of the file starting are dropped if they were in the files before it
+        """
+        if len(self.current):
+            self.previous.update(self.current)
+            self.current = BloomFilter(self.capacity, self.current.error_rate)
+        logger.debug(f"Looking for lines of previous files in {file_name}")
+
+    def keep(self, key):
+        """
+        :param key: Line or key of an entry
+        :return: False if the key was seen in a previous file
+        :rtype: bool
+        """
+        digest = fingerprint(key)
+        if digest in self.previous:
+            self.duplicates += 1
+            return False
+        if not self.current.add(digest) and len(self) == self.capacity + 1:
+            logger.warning(f"More than {self.capacity} different lines, lines are wrongly dropped as duplicates"
+                           f" more often, increase the capacity")
+        return True
+
+    def log_summary(self):
+        logger.info(f"Dropped {self.duplicates} duplicate lines, {len(self)} different lines")
+        if len(self) > self.capacity:
+            logger.warning(f"{len(self)} different lines for a capacity of {self.capacity}, up to"
+                           f" {self.previous.false_positive_rate(len(self)):.2%} of the lines were wrongly dropped,"
+                           f" increase the capacity")
@@ -1,7 +1,11 @@
 # (c) 2021 Martin DENIZET
 # GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
-from apache_logs_parser.colors import header, Colors
+import heapq
+import sys
+from operator import itemgetter
+
+from apache_logs_parser.colors import format_header, Colors
 
 
 def size_format(size):
@@ -18,45 +22,89 @@ def size_format(size):
     return f"{size:.2f}YiB"
 
 
+def select_top(data, top=None, descending_sort=True):
+    """
+    Sort the items of a dictionary by value.
+    When `top` is set, only the `top` first items are selected, without sorting all the items.
+    :param data: Dictionary to sort by value
+    :type data: dict
+    :param top: Maximum number of items to return, None for all
+    :type top: int|None
+    :param descending_sort: Biggest values first
+    :return: List of (key, value) tuples
+    :rtype: list[tuple]
+    """
+    if top is None:
+        return sorted(data.items(), key=itemgetter(1), reverse=descending_sort)
+    if descending_sort:
+        return heapq.nlargest(top, data.items(), key=itemgetter(1))
+    return heapq.nsmallest(top, data.items(), key=itemgetter(1))
+
+
+def write_lines(lines, output=None):
+    """
+    Print lines in a single write instead of one print per line
+    :param lines: Lines to print, without line ending
+    :type lines: list[str]
+    :param output: Text stream written to, the standard output by default
+    """
+    if lines:
+        (output or sys.stdout).write("\n".join(lines) + "\n")
+
+
 class Graph(object):
     """
     Static class for graphs
     """
+    # Number of bars displayed by the producers when no limit is requested
+    DEFAULT_TOP = 20
 
     @classmethod
-    def display(cls, data, title=None, unit='hits', show_percents=True, descending_sort=True, top=None):
+    def display(cls, data, title=None, unit='hits', show_percents=True, descending_sort=True, top=None, output=None):
         """
-
+        Print a bar chart of the data
         :param data:
         :type data: dict
         :param title:
         :param unit:
         :param show_percents:
         :param descending_sort:
-        :param top:
+        :param top: Reduce the number of bars to specified number, None for all
+        :param output: Text stream written to, the standard output by default
         """
+        write_lines(cls.render(data, title, unit, show_percents, descending_sort, top), output)
 
+    @classmethod
+    def render(cls, data, title=None, unit='hits', show_percents=True, descending_sort=True, top=None):
+        """
+        Same as `display` but returns the lines instead of printing them
+        :rtype: list[str]
+        """
+        lines = []
         if title:
-            header(title + (f" Top {top}" if top is not None else ""))
-
-        data = dict(sorted(data.items(), key=lambda x: x[1], reverse=descending_sort))
-        if top is not None:
-            data = data[0:top]
-        max_value = max(data.values())
-        sum_values = sum(data.values())
-        label_max_length = max([len(label) for label in data.keys()])
-        for key, value in data.items():
-            bar_size = value * 100 / max_value
+            lines.append(format_header(title + (f" Top {top}" if top is not None else "")))
+        if not data:
+            return lines
+
+        items = select_top(data, top, descending_sort)
+        max_value = max(value for _, value in items)
+        # Percents are relative to all the values, not only the ones displayed
+        sum_values = sum(data.values()) if show_percents else 0
+        labels = [str(key) for key, _ in items]
+        label_max_length = max(len(label) for label in labels)
+        for label, (_, value) in zip(labels, items):
+            bar_size = value * 100 / max_value if max_value else 0
             bars = cls.horizontal_bar(bar_size)
             percent_string = ""
             if show_percents:
-                percent = value * 100 / sum_values
+                percent = value * 100 / sum_values if sum_values else 0
                 percent_string = f"/ {percent:.2f}%"
             formatted_value = f"{value} {unit}"
             if unit == 'bytes':
                 formatted_value = size_format(value)
-            print(f"    {Colors.OKBLUE + key.ljust(label_max_length) + Colors.ENDC}|{bars} :"
-                  f" {Colors.OKGREEN}{formatted_value}{Colors.ENDC}{percent_string}")
+            lines.append(f"    {Colors.OKBLUE + label.ljust(label_max_length) + Colors.ENDC}|{bars} :"
+                         f" {Colors.OKGREEN}{formatted_value}{Colors.ENDC}{percent_string}")
+        return lines
 
     @classmethod
     def horizontal_bar(cls, percent, scale=100):
@@ -87,9 +135,11 @@ class Graph(object):
 
 
 class TopList(object):
+    # Number of entries displayed when no limit is requested
+    DEFAULT_TOP = 10
 
     @classmethod
-    def display(cls, data, title=None, unit='hits', top=10):
+    def display(cls, data, title=None, unit='hits', top=DEFAULT_TOP, key_format=str, output=None):
         """
 
         :param data:
@@ -99,13 +149,24 @@ class TopList(object):
         :type unit: str
         :param top: Reduce the number of entries to specified number
         :type top: int
+        :param key_format: Function converting the keys of the data into the labels displayed
+        :param output: Text stream written to, the standard output by default
         """
-        data = sorted(data.items(), key=lambda x: x[1], reverse=True)[0:top]
+        write_lines(cls.render(data, title, unit, top, key_format), output)
+
+    @classmethod
+    def render(cls, data, title=None, unit='hits', top=DEFAULT_TOP, key_format=str):
+        """
+        Same as `display` but returns the lines instead of printing them
+        :rtype: list[str]
+        """
+        lines = []
         if title:
-            header(title + f" Top {top}" if top is not None else "")
+            lines.append(format_header(title + (f" Top {top}" if top is not None else "")))
 
-        for index, value in enumerate(data):
-            formatted_value = f"{value[1]} {unit}"
+        for index, (key, value) in enumerate(select_top(data, top)):
+            formatted_value = f"{value} {unit}"
             if unit == 'bytes':
-                formatted_value = size_format(value[1])
-            print(f"    #{index + 1}: {value[0]} {Colors.OKGREEN}{formatted_value}{Colors.ENDC}")
+                formatted_value = size_format(value)
+            lines.append(f"    #{index + 1}: {key_format(key)} {Colors.OKGREEN}{formatted_value}{Colors.ENDC}")
+        return lines
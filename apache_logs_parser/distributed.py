@@ -0,0 +1,393 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Distributed stats: workers running next to the logs compute the state of the StatProducer for one file at a time,
+and send it to a coordinator which merges the states of all the files.
+
+Workers connect to the coordinator over TCP and pull the files to process from its queue. Messages are JSON objects
+compressed with zlib, each one prefixed with its length as a 4 bytes big endian integer:
+- worker: `{"type": "ready", "worker": name}` when it can process a file
+- coordinator: `{"type": "task", "file": name, "stat_classes": [...], "time_taken": format, "options": {...}}`, or
+  `{"type": "done"}` when there are no files left
+- worker: `{"type": "result", "file": name, "states": {producer name: state}, "sampling": sampling}`, the sampling
+  of a converted file being saved next to it, see sampling.py, or `{"type": "error", "file": name, "error": message}`
+  if it could not process the file
+
+When a worker fails, or loses its connection, while processing a file, the file is queued again. A file a worker
+reported an error for, or sent invalid states for, is not given to this worker again.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from collections import deque, defaultdict, Counter
+
+from apache_logs_parser.parser import parse_log_file, set_time_taken_format
+from apache_logs_parser.rejects import RejectedLines
+from apache_logs_parser.sampling import read_sampling, merge_samplings
+from apache_logs_parser.stats import create_stats_instances, feed_stats, generate_stats
+from apache_logs_parser.stats_producers import get_stat_classes_by_name
+
+logger = logging.getLogger(__name__)
+
+READY = 'ready'
+TASK = 'task'
+DONE = 'done'
+RESULT = 'result'
+ERROR = 'error'
+
+FRAME_HEADER = struct.Struct('>I')
+# Largest message accepted, a corrupted length must not allocate all the memory
+MAX_FRAME_SIZE = 1 << 30
+
+
+def send_message(sock, message):
+    """
+    :param sock: Connected socket
+    :param message: JSON serializable dictionary
+    """
+    payload = zlib.compress(json.dumps(message, separators=(',', ':')).encode())
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def read_message(rfile):
+    """
+    :param rfile: Binary file of a connected socket
+    :return: Message sent with `send_message`
+    :rtype: dict
+    :raise ConnectionError: If the connection is closed
+    :raise ValueError: If the message is invalid
+    """
+    header = rfile.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise ConnectionError("Connection closed")
+    length, = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Message of {length} bytes is too large")
+    payload = rfile.read(length)
+    if len(payload) < length:
+        raise ConnectionError("Connection closed while reading a message")
+    try:
+        return json.loads(zlib.decompress(payload))
+    except zlib.error as e:
+        raise ValueError(f"Invalid message: {e}")
+
+
+def is_json_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(64).lstrip()[:1] == b'['
+
+
+def compute_file_states(file_name, stat_classes_names, time_taken=None, options=None):
+    """
+    Compute the state of StatProducer for a file
+    :param file_name: Apache log file, JSON log file or SQLite database
+    :param stat_classes_names: Names of the StatProducer classes
+    :param time_taken: Format of the time taken field of Apache logs, see `parser.set_time_taken_format`
+    :param options: Dictionary of options given to all the StatProducer instances
+    :return: States by producer name, as returned by `StatProducer.get_state`
+    :rtype: dict
+    """
+    # Imported here as the SQLite backend imports the parser
+    from apache_logs_parser.sqlite_backend import is_sqlite_file
+
+    stats_classes = [get_stat_classes_by_name(name) for name in stat_classes_names]
+    if is_sqlite_file(file_name) or is_json_file(file_name):
+        stats_instances = generate_stats([file_name], stats_classes, use_rollups=True, options=options)
+    else:
+        if time_taken:
+            set_time_taken_format(time_taken)
+        with RejectedLines() as rejects:
+            data = parse_log_file(file_name, rejects=rejects)
+        stats_instances = feed_stats(create_stats_instances(stats_classes, options), data)
+    return {stat.name: stat.get_state() for stat in stats_instances}
+
+
+class Coordinator(object):
+    """
+    Queue of the files to process and merged states of the files processed
+    """
+
+    def __init__(self, input_files, stats_classes=None, options=None, time_taken=None, max_attempts=3,
+                 task_timeout=None, expected_workers=1):
+        """
+        :param input_files: File names, as seen by the workers
+        :param stats_classes: List of StatProducer subclasses, all by default
+        :param options: Dictionary of options given to all the StatProducer instances, and to the ones of the workers.
+        Values must be JSON serializable
+        :param time_taken: Format of the time taken field of Apache logs, see `parser.set_time_taken_format`
+        :param max_attempts: Number of times a file is given to a worker before giving up
+        :param task_timeout: Seconds to wait for the result of a file before considering the worker failed
+        :param expected_workers: Number of workers to wait for before giving up on the files none of the connected
+        workers could process
+        """
+        self.options = dict(options or {})
+        self.stats_instances = create_stats_instances(stats_classes, self.options)
+        self.time_taken = time_taken
+        self.max_attempts = max_attempts
+        self.task_timeout = task_timeout
+        self.expected_workers = expected_workers
+        self.pending = deque(input_files)
+        self.in_progress = dict()
+        self.tried = defaultdict(set)
+        self.attempts = Counter()
+        self.processed = []
+        self.failed = []
+        # Sampling of each file processed, None if it was not sampled
+        self.samplings = dict()
+        self.workers = Counter()
+        self.workers_seen = set()
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return not self.pending and not self.in_progress
+
+    def task(self, file_name):
+        return dict(type=TASK, file=file_name, stat_classes=[stat.name for stat in self.stats_instances],
+                    time_taken=self.time_taken, options=self.options)
+
+    def register(self, worker):
+        with self.condition:
+            self.workers[worker] += 1
+            self.workers_seen.add(worker)
+
+    def unregister(self, worker):
+        with self.condition:
+            self.workers[worker] -= 1
+            if not self.workers[worker]:
+                del self.workers[worker]
+            self._give_up_stuck_files()
+            self.condition.notify_all()
+
+    def next_file(self, worker):
+        """
+        Wait for a file the worker did not fail to process
+        :param worker: Worker name
+        :return: File name, None if there are no files left for the worker
+        """
+        with self.condition:
+            while True:
+                for file_name in self.pending:
+                    if worker not in self.tried[file_name]:
+                        self.pending.remove(file_name)
+                        self.in_progress[file_name] = worker
+                        self.attempts[file_name] += 1
+                        return file_name
+                if not self.in_progress:
+                    return None
+                # A file in progress can be queued again if its worker fails
+                self.condition.wait()
+
+    def check_states(self, states):
+        """
+        Merge the states computed by a worker in new StatProducer instances, outside of the lock
+        :raise ValueError: If states are missing or can't be merged
+        """
+        if not isinstance(states, dict):
+            raise ValueError("States must be a JSON object")
+        missing = [stat.name for stat in self.stats_instances if stat.name not in states]
+        if missing:
+            raise ValueError(f"States of {', '.join(missing)} are missing")
+        for stat in self.stats_instances:
+            try:
+                type(stat)(**stat.options).merge_state(states[stat.name])
+            except Exception as e:
+                raise ValueError(f"Invalid state of {stat.name}: {e!r}")
+
+    def complete(self, file_name, worker, states, sampling=None):
+        """
+        Merge the states computed by a worker. Invalid states are a failure of the worker, they are checked before
+        merging anything so that the merged states never contain part of a file
+        :param sampling: Sampling of the file, as returned by `sampling.read_sampling`
+        """
+        try:
+            self.check_states(states)
+        except ValueError as e:
+            self.fail(file_name, worker, e)
+            return
+        with self.condition:
+            for stat in self.stats_instances:
+                stat.merge_state(states[stat.name])
+            del self.in_progress[file_name]
+            self.processed.append(file_name)
+            self.samplings[file_name] = sampling
+            self.condition.notify_all()
+        logger.info(f"Merged the stats of {file_name}")
+
+    def fail(self, file_name, worker, reason, connection_lost=False):
+        """
+        Queue a file again after its worker failed, unless it was tried too many times
+        :param connection_lost: True when the connection to the worker was lost, the file is not marked as tried by
+        the worker as it may have been restarted, with the same name, and be able to process it
+        """
+        logger.warning(f"Worker {worker} failed to process {file_name}: {reason}")
+        with self.condition:
+            del self.in_progress[file_name]
+            if not connection_lost:
+                self.tried[file_name].add(worker)
+            if self.attempts[file_name] >= self.max_attempts:
+                logger.error(f"Giving up on {file_name} after {self.attempts[file_name]} attempts")
+                self.failed.append(file_name)
+            else:
+                self.pending.append(file_name)
+            self._give_up_stuck_files()
+            self.condition.notify_all()
+
+    def _give_up_stuck_files(self):
+        # Files all the connected workers failed to process, once the expected workers connected. Files are kept
+        # while no worker is connected, until a worker which did not try them connects
+        if len(self.workers_seen) < self.expected_workers or not self.workers:
+            return
+        for file_name in list(self.pending):
+            if self.tried[file_name] and self.tried[file_name].issuperset(self.workers):
+                logger.error(f"Giving up on {file_name}, no connected worker could process it")
+                self.pending.remove(file_name)
+                self.failed.append(file_name)
+
+    def get_sampled_stats(self):
+        """
+        Stats of the files processed, scaled according to their sampling like the ones of `stats.generate_stats`
+        :return: The StatProducer instances and the sampling of the files, see `sampling.get_sampling`
+        :rtype: (list[StatProducer], dict|None)
+        :raise ValueError: If the files were sampled differently
+        """
+        sampling = merge_samplings(self.samplings[file_name] for file_name in self.processed)
+        if sampling is None:
+            return self.stats_instances, None
+        # Producers read the sampling when they are set up, the merged states are copied in new instances
+        options = dict(self.options, scale=1 / sampling['rate'], sample_key=sampling['key'])
+        stats_instances = create_stats_instances([type(stat) for stat in self.stats_instances], options)
+        for stat, merged in zip(stats_instances, self.stats_instances):
+            stat.merge_state(merged.get_state())
+        return stats_instances, sampling
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the files are processed or given up
+        :return: True if finished, False on timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.finished, timeout)
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Connection of a worker, the coordinator is an attribute of the server
+    """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = None
+        file_name = None
+        try:
+            while True:
+                message = read_message(self.rfile)
+                if worker is None:
+                    worker = message.get('worker') or f"{self.client_address[0]}:{self.client_address[1]}"
+                    coordinator.register(worker)
+                file_name = coordinator.next_file(worker)
+                if file_name is None:
+                    send_message(self.connection, dict(type=DONE))
+                    break
+                send_message(self.connection, coordinator.task(file_name))
+                self.connection.settimeout(coordinator.task_timeout)
+                result = read_message(self.rfile)
+                self.connection.settimeout(None)
+                if result.get('type') == RESULT and result.get('file') == file_name:
+                    coordinator.complete(file_name, worker, result.get('states'), result.get('sampling'))
+                else:
+                    coordinator.fail(file_name, worker, result.get('error', 'Unexpected message'))
+                file_name = None
+        except (OSError, ValueError) as e:
+            # The worker is disconnected first, the file is queued again for the workers still connected
+            if worker is not None:
+                coordinator.unregister(worker)
+            if file_name is not None:
+                coordinator.fail(file_name, worker, e, connection_lost=True)
+            else:
+                logger.warning(f"Lost worker {worker}: {e}")
+            return
+        if worker is not None:
+            coordinator.unregister(worker)
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, coordinator):
+        self.coordinator = coordinator
+        super().__init__(server_address, CoordinatorRequestHandler)
+
+
+def coordinate(coordinator, host='0.0.0.0', port=8765, timeout=None):
+    """
+    Serve the files to the workers until they are all processed or given up
+    :param coordinator: Coordinator of the files
+    :param timeout: Maximum number of seconds to wait for the workers, None to wait forever
+    :return: True if all the files were processed, False if some were given up or not processed before the timeout
+    :rtype: bool
+    """
+    server = CoordinatorServer((host, port), coordinator)
+    logger.info(f"Waiting for workers on {host}:{server.server_address[1]}")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        if not coordinator.wait(timeout):
+            logger.error(f"Timeout, {len(coordinator.pending) + len(coordinator.in_progress)} files not processed")
+    finally:
+        server.shutdown()
+        server.server_close()
+    if coordinator.failed:
+        logger.error(f"Could not process {len(coordinator.failed)} files: {', '.join(coordinator.failed)}")
+    return coordinator.finished and not coordinator.failed
+
+
+def run_worker(host, port, name=None, connect_timeout=30):
+    """
+    Process the files given by a coordinator until there are none left
+    :param host: Coordinator host
+    :param port: Coordinator port
+    :param name: Name of the worker, files it failed to process are not given to it again. Host name and PID by default
+    :param connect_timeout: Seconds to retry connecting while the coordinator is not started
+    :return: Number of files processed
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+    processed = 0
+    with sock, sock.makefile('rb') as rfile:
+        while True:
+            send_message(sock, dict(type=READY, worker=name))
+            message = read_message(rfile)
+            if message.get('type') != TASK:
+                break
+            file_name = message['file']
+            try:
+                states = compute_file_states(file_name, message['stat_classes'], message.get('time_taken'),
+                                             message.get('options'))
+                sampling = read_sampling(file_name)
+            except Exception as e:
+                # Any error is reported to the coordinator, the worker goes on with the next files
+                logger.exception(f"Could not process {file_name}")
+                send_message(sock, dict(type=ERROR, file=file_name, error=f"{type(e).__name__}: {e}"))
+                continue
+            send_message(sock, dict(type=RESULT, file=file_name, states=states, sampling=sampling))
+            processed += 1
+            logger.info(f"Sent the stats of {file_name}")
+    logger.info(f"Worker {name} processed {processed} files")
+    return processed
@@ -0,0 +1,230 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+External memory aggregation, for the StatProducer whose number of keys can exceed the memory.
+
+A SpillableCounter aggregates counts in a dictionary until its estimated size passes a memory limit. The counts are then
+written, sorted by key, to a temporary run file and the dictionary is emptied. Reading the counts merges the runs
+and the dictionary with a k-way merge, adding the counts of the same key, so the results stay exact.
+"""
+
+import heapq
+import json
+import logging
+import os
+import sys
+import weakref
+from collections.abc import Mapping
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+
+class LazyMapping(Mapping):
+    """
+    Read only mapping whose items are generated each time they are iterated, the JSON serializers write it one item at
+    a time. Looking up a key scans all the items.
+    """
+
+    def __init__(self, items_function):
+        """
+        :param items_function: Function returning an iterable of (key, value), keys must be unique
+        """
+        self.items_function = items_function
+
+    def items(self):
+        return self.items_function()
+
+    def __iter__(self):
+        return (key for key, _ in self.items_function())
+
+    def __len__(self):
+        return sum(1 for _ in self.items_function())
+
+    def __getitem__(self, key):
+        for item_key, value in self.items_function():
+            if item_key == key:
+                return value
+        raise KeyError(key)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
+
+
+class LazySequence(object):
+    """
+    Read only sequence whose items are generated each time it is iterated, the JSON serializers write it as a list a
+    few items at a time
+    """
+
+    def __init__(self, items_function):
+        """
+        :param items_function: Function returning an iterable of the items
+        """
+        self.items_function = items_function
+
+    def __iter__(self):
+        return iter(self.items_function())
+
+    def __len__(self):
+        return sum(1 for _ in self.items_function())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+
+def materialize(value):
+    """
+    :return: The value with its LazyMapping, even nested in dictionaries, converted into dictionaries and its
+    LazySequence converted into lists
+    """
+    if isinstance(value, (LazyMapping, dict)):
+        return {k: materialize(v) for k, v in value.items()}
+    if isinstance(value, LazySequence):
+        return list(value)
+    return value
+
+
+def _encode_key(key):
+    return json.dumps(key)
+
+
+def _decode_key(encoded):
+    key = json.loads(encoded)
+    # Tuples are written as lists
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _remove_files(file_names):
+    for file_name in file_names:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
+
+
+class SpillableCounter(object):
+    """
+    Fixed number of counts per key, spilled to sorted run files when the memory limit is reached
+    """
+    # Estimated memory used by an entry, without the key: dict slot, list of counts and integers
+    ENTRY_OVERHEAD = 160
+    # Runs are merged in a single one when there are more, to limit the number of files opened by a merge
+    MAX_RUNS = 64
+
+    def __init__(self, width=1, memory_limit=None):
+        """
+        :param width: Number of counts per key
+        :param memory_limit: Approximate number of bytes used before spilling the counts to a run file,
+        None to always keep them in memory
+        :type memory_limit: int|None
+        """
+        self.width = width
+        self.memory_limit = memory_limit
+        self.data = dict()
+        self.size = 0
+        self.runs = []
+        # Run files are removed with the counter
+        self._finalizer = weakref.finalize(self, _remove_files, self.runs)
+
+    def add(self, key, *counts):
+        """
+        :param key: Key, JSON serializable, tuples are read back as tuples and lists are not allowed
+        :param counts: `width` counts to add to the counts of the key
+        """
+        values = self.data.get(key)
+        if values is None:
+            self.data[key] = list(counts)
+            if self.memory_limit is not None:
+                self.size += sys.getsizeof(key) + self.ENTRY_OVERHEAD
+                if self.size > self.memory_limit:
+                    self.spill()
+        else:
+            for i, count in enumerate(counts):
+                values[i] += count
+
+    def update(self, items):
+        """
+        Add the counts of several keys
+        :param items: Iterable of (key, counts), counts being a sequence of `width` counts
+        """
+        data = self.data
+        add = self.add
+        for key, counts in items:
+            values = data.get(key)
+            if values is None:
+                add(key, *counts)
+                # The data is replaced when spilled
+                data = self.data
+            else:
+                for i, count in enumerate(counts):
+                    values[i] += count
+
+    def _sorted_memory_items(self):
+        return sorted(((_encode_key(key), values) for key, values in self.data.items()), key=itemgetter(0))
+
+    def spill(self):
+        """
+        Write the counts kept in memory to a new run file
+        """
+        if len(self.runs) >= self.MAX_RUNS:
+            runs = list(self.runs)
+            self._write_run(self._merge([self._read_run(file_name) for file_name in runs]))
+            _remove_files(runs)
+            del self.runs[:len(runs)]
+        file_name = self._write_run(self._sorted_memory_items())
+        logger.debug(f"Spilled {len(self.data)} keys to run file {file_name}")
+        self.data = dict()
+        self.size = 0
+
+    def _write_run(self, items):
+        # Imported here as most counters are never spilled
+        import tempfile
+
+        fd, file_name = tempfile.mkstemp(prefix='apache_logs_parser-', suffix='.run')
+        self.runs.append(file_name)
+        with os.fdopen(fd, 'w') as f:
+            # JSON never contains a raw tab
+            f.writelines(f"{encoded}\t{json.dumps(values)}\n" for encoded, values in items)
+        return file_name
+
+    @staticmethod
+    def _read_run(file_name):
+        with open(file_name, 'r') as f:
+            for line in f:
+                encoded, values = line.rstrip('\n').split('\t')
+                yield encoded, json.loads(values)
+
+    def items(self):
+        """
+        :return: Generator of (key, list of counts), sorted by encoded key if counts were spilled
+        """
+        if not self.runs:
+            yield from self.data.items()
+            return
+        streams = [self._read_run(file_name) for file_name in self.runs] + [iter(self._sorted_memory_items())]
+        for encoded, values in self._merge(streams):
+            yield _decode_key(encoded), values
+
+    @staticmethod
+    def _merge(streams):
+        """
+        k-way merge of sorted streams of (encoded key, counts), adding the counts of the same key
+        """
+        current_key, current_values = None, None
+        for encoded, values in heapq.merge(*streams, key=itemgetter(0)):
+            if encoded == current_key:
+                for i, count in enumerate(values):
+                    current_values[i] += count
+                continue
+            if current_key is not None:
+                yield current_key, current_values
+            current_key, current_values = encoded, list(values)
+        if current_key is not None:
+            yield current_key, current_values
+
+    def clear(self):
+        self.data = dict()
+        self.size = 0
+        _remove_files(self.runs)
+        del self.runs[:]
@@ -8,6 +8,8 @@ import re
 from urllib.parse import urlparse
 import logging
 
+from apache_logs_parser.classify import get_classifier
+
 logger = logging.getLogger(__name__)
 
 # Regex to extract the extension of a file/URL
@@ -23,6 +25,8 @@ def get_file_extension(url):
     Defaults to `None`
     :rtype: str
     """
+    if url is None:
+        return None
     extension_match = EXTENSION_RE.search(url)
     if extension_match:
         return extension_match.group(1)
@@ -76,46 +80,14 @@ def extract_method_and_url(request):
     )
 
 
-# Regex to identify bots in UserAgent
-BOT_RE = re.compile('.*(Googlebot|bingbot|Twitterbot|YandexBot|bot)', re.IGNORECASE)
-# Regex to identify Desktop users
-DESKTOP_UA_RE = re.compile(
-    r'.*(Windows NT \d+\.?\d*|Mac OS [A-z0-9._ ]+|Linux \d+(\.\d+)*)',
-    re.IGNORECASE)
-# Regex to identify Mobile users
-MOBILE_UA_RE = re.compile(
-    r'.*(iPhone OS \d+(_\d+)*|Android \d+(\.\d+)*|iPad)',
-    re.IGNORECASE)
-
-
 def extract_client_information(user_agent):
     """
     Extract data from the user_agent field
-    Extracts more information from the user_agent provided by the browser
+    Extracts more information from the user_agent provided by the browser, using the rules of
+    `classify.get_classifier`
     :param user_agent: User agent string such as:
     >>> "Mozilla/5.0 (iPhone; CPU iPhone OS 7_0_4 like Mac OS X) AppleWebKit/537.51.1 (KHTML, like Gecko) Mobile/11B554a"
     :rtype: dict[str,bool|str]
     """
-    is_mobile = False
-    is_bot = False
-    os_string = 'Unknown'
-
-    if BOT_RE.match(user_agent):
-        is_bot = True
-
-    mobile_os_match = MOBILE_UA_RE.match(user_agent)
-    if mobile_os_match:
-        os_string = mobile_os_match.group(1)
-        is_mobile = True
-    else:
-        desktop_os_match = DESKTOP_UA_RE.match(user_agent)
-        if desktop_os_match:
-            os_string = desktop_os_match.group(1)
-        else:
-            logger.debug('OS could not be guessed for UA "{}"'.format(user_agent))
-
-    return dict(
-        is_mobile=is_mobile,
-        is_bot=is_bot,
-        system_agent=os_string,
-    )
+    # Classifications are cached, return a copy
+    return dict(get_classifier().classify(user_agent))
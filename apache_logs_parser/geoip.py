@@ -0,0 +1,168 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Offline GeoIP and ASN enrichment from a local IP ranges database.
+
+The database is a CSV file, each row being either:
+- `start_ip,end_ip,country,asn,as_name`
+- `network,country,asn,as_name` with the network in the CIDR notation
+
+Lines starting with `#` are ignored. The CSV file can be compiled into a binary file with `compile_database`, which is
+much faster to load. Ranges are kept in sorted arrays and looked up by binary search.
+"""
+
+import csv
+import json
+import logging
+import struct
+from bisect import bisect_right
+from functools import lru_cache
+
+from apache_logs_parser.ip import ip_to_int, parse_network, IP_BITS
+
+logger = logging.getLogger(__name__)
+
+BINARY_MAGIC = b'ALPGEO1\n'
+# Start and end of a range as 128 bits integers then the index of its value
+BINARY_RECORD = struct.Struct('>16s16sI')
+BINARY_HEADER_LENGTH = struct.Struct('>I')
+
+
+class IntervalIndex(object):
+    """
+    Non overlapping integer intervals, sorted, with a value for each interval
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: Iterable of (start, end, value), start and end included
+        """
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.values = [interval[2] for interval in intervals]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, value):
+        """
+        :return: The value of the interval containing `value`, None if there is none
+        """
+        index = bisect_right(self.starts, value) - 1
+        if index >= 0 and value <= self.ends[index]:
+            return self.values[index]
+        return None
+
+
+def _parse_asn(asn):
+    asn = asn.strip().upper()
+    if asn.startswith('AS'):
+        asn = asn[2:]
+    return int(asn) if asn else None
+
+
+def read_csv_ranges(file_name):
+    """
+    Read the ranges of a CSV database
+    :param file_name: CSV file name, see the module documentation for the format
+    :return: Generator of (start, end, (country, asn, as_name))
+    """
+    with open(file_name, 'r', newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                if '/' in row[0]:
+                    network, prefix_length = parse_network(row[0])
+                    start, end = network, network | ((1 << (IP_BITS - prefix_length)) - 1)
+                    fields = row[1:]
+                else:
+                    start, end = ip_to_int(row[0].strip()), ip_to_int(row[1].strip())
+                    fields = row[2:]
+                country, asn, as_name = (fields + ['', '', ''])[:3]
+                yield start, end, (country.strip() or None, _parse_asn(asn), as_name.strip() or None)
+            except (ValueError, IndexError) as e:
+                # A header line is expected to fail
+                logger.debug(f"Ignoring line {line_number} of {file_name}: {e}")
+
+
+def compile_database(csv_file_name, binary_file_name):
+    """
+    Compile a CSV database into the binary format read by `GeoIpDatabase.from_file`
+    :param csv_file_name: CSV file name
+    :param binary_file_name: Binary file name to write to
+    :return: Number of ranges written
+    """
+    values = dict()
+    records = []
+    for start, end, value in read_csv_ranges(csv_file_name):
+        records.append((start, end, values.setdefault(value, len(values))))
+    records.sort()
+    header = json.dumps(list(values.keys())).encode()
+    with open(binary_file_name, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(BINARY_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for start, end, value_index in records:
+            f.write(BINARY_RECORD.pack(start.to_bytes(16, 'big'), end.to_bytes(16, 'big'), value_index))
+    logger.info(f"Wrote {len(records)} ranges to file {binary_file_name}")
+    return len(records)
+
+
+def read_binary_ranges(file_name):
+    """
+    Read the ranges of a database compiled by `compile_database`
+    :return: Generator of (start, end, (country, asn, as_name))
+    """
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    if not content.startswith(BINARY_MAGIC):
+        raise ValueError(f"{file_name} is not a compiled GeoIP database")
+    offset = len(BINARY_MAGIC)
+    header_length, = BINARY_HEADER_LENGTH.unpack_from(content, offset)
+    offset += BINARY_HEADER_LENGTH.size
+    values = [tuple(value) for value in json.loads(content[offset:offset + header_length])]
+    offset += header_length
+    for start, end, value_index in BINARY_RECORD.iter_unpack(content[offset:]):
+        yield int.from_bytes(start, 'big'), int.from_bytes(end, 'big'), values[value_index]
+
+
+class GeoIpDatabase(object):
+    """
+    Resolve IP addresses to their country and autonomous system
+    """
+
+    def __init__(self, ranges, cache_size=65536):
+        """
+        :param ranges: Iterable of (start, end, (country, asn, as_name))
+        :param cache_size: Number of IP addresses whose result is kept, a few addresses make most of the hits
+        """
+        self.index = IntervalIndex(ranges)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_file(cls, file_name):
+        """
+        Load a CSV or compiled database, the format is detected from the content of the file
+        """
+        with open(file_name, 'rb') as f:
+            is_binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        database = cls(read_binary_ranges(file_name) if is_binary else read_csv_ranges(file_name))
+        logger.info(f"Loaded {len(database.index)} IP ranges from {file_name}")
+        return database
+
+    def _lookup(self, ip):
+        value = self.index.find(ip_to_int(ip))
+        if value is None:
+            return dict(country=None, asn=None, as_name=None)
+        country, asn, as_name = value
+        return dict(country=country, asn=asn, as_name=as_name)
+
+    def enrich(self, data_entry):
+        """
+        Add the `country`, `asn` and `as_name` fields to a log entry
+        :param data_entry: Apache log line as a dict
+        :type data_entry: dict
+        """
+        data_entry.update(self.lookup(data_entry['remote_ip']))
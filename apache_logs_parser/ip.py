@@ -0,0 +1,137 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+IP addresses as integers.
+IPv4 and IPv6 addresses share the same 128 bits space: IPv4 addresses are stored as IPv4-mapped IPv6 addresses
+(`::ffff:a.b.c.d`), so a single integer identifies any address and can be used as a compact dictionary key.
+"""
+
+import ipaddress
+from functools import lru_cache
+
+IP_BITS = 128
+IPV4_BITS = 32
+# ::ffff:0:0/96
+IPV4_MAPPED = 0xffff << IPV4_BITS
+IPV4_MAPPED_PREFIX_LENGTH = IP_BITS - IPV4_BITS
+
+
+@lru_cache(maxsize=65536)
+def ip_to_int(ip):
+    """
+    Convert an IPv4 or IPv6 address to an integer
+    :param ip: IP address such as `"83.149.9.216"` or `"2001:db8::1"`
+    :rtype: int
+    :raise ValueError: If the address is not valid
+    """
+    if ':' not in ip:
+        parts = ip.split('.')
+        if len(parts) != 4:
+            raise ValueError(f"Invalid IPv4 address {ip}")
+        value = 0
+        for part in parts:
+            byte = int(part)
+            if not 0 <= byte <= 255:
+                raise ValueError(f"Invalid IPv4 address {ip}")
+            value = (value << 8) | byte
+        return IPV4_MAPPED | value
+    try:
+        return int(ipaddress.IPv6Address(ip))
+    except ipaddress.AddressValueError as e:
+        raise ValueError(str(e))
+
+
+def is_ipv4(value):
+    """
+    :param value: IP address as an integer
+    :rtype: bool
+    """
+    return value >> IPV4_BITS == 0xffff
+
+
+def int_to_ip(value):
+    """
+    Convert an integer from `ip_to_int` back to its string representation
+    :param value: IP address as an integer
+    :rtype: str
+    """
+    if is_ipv4(value):
+        return str(ipaddress.IPv4Address(value & 0xffffffff))
+    return str(ipaddress.IPv6Address(value))
+
+
+def network_of(value, prefix_length):
+    """
+    Get the network of an IP address
+    :param value: IP address as an integer
+    :param prefix_length: Prefix length in the 128 bits space
+    :return: The network address as an integer
+    :rtype: int
+    """
+    shift = IP_BITS - prefix_length
+    return (value >> shift) << shift
+
+
+def parse_network(cidr):
+    """
+    Parse a network in the CIDR notation
+    :param cidr: Network such as `"10.0.0.0/8"` or `"2001:db8::/32"`
+    :return: Network address as an integer and prefix length in the 128 bits space
+    :rtype: tuple[int,int]
+    :raise ValueError: If the network is not valid
+    """
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version == 4:
+        return IPV4_MAPPED | int(network.network_address), IPV4_MAPPED_PREFIX_LENGTH + network.prefixlen
+    return int(network.network_address), network.prefixlen
+
+
+def network_to_str(value, prefix_length):
+    """
+    CIDR notation of a network
+    :param value: Network address as an integer
+    :param prefix_length: Prefix length in the 128 bits space
+    :rtype: str
+    """
+    if is_ipv4(value) and prefix_length >= IPV4_MAPPED_PREFIX_LENGTH:
+        return f"{int_to_ip(value)}/{prefix_length - IPV4_MAPPED_PREFIX_LENGTH}"
+    return f"{int_to_ip(value)}/{prefix_length}"
+
+
+class PrefixTrie(object):
+    """
+    Binary prefix trie of networks, to find the most specific network containing an IP address
+    """
+
+    def __init__(self):
+        # Nodes are lists: [child for bit 0, child for bit 1, value]
+        self.root = [None, None, None]
+
+    def insert(self, network, prefix_length, value):
+        """
+        :param network: Network address as an integer
+        :param prefix_length: Prefix length in the 128 bits space
+        :param value: Value returned by `longest_match` for the addresses of the network
+        """
+        node = self.root
+        for bit_index in range(IP_BITS - 1, IP_BITS - 1 - prefix_length, -1):
+            bit = (network >> bit_index) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = value
+
+    def longest_match(self, ip):
+        """
+        :param ip: IP address as an integer
+        :return: Value of the most specific network containing the address, None if there is none
+        """
+        node = self.root
+        match = node[2]
+        for bit_index in range(IP_BITS - 1, -1, -1):
+            node = node[(ip >> bit_index) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
@@ -6,7 +6,11 @@ import logging
 import json
 from datetime import datetime
 
+from apache_logs_parser.constants import TIME_TAKEN_FORMATS, DEFAULT_TIME_TAKEN_FORMAT
+from apache_logs_parser.dedup import start_file
 from apache_logs_parser.extract import extract_method_and_url, extract_client_information
+from apache_logs_parser.ip import ip_to_int
+from apache_logs_parser.rejects import NO_MATCH, INVALID_IP, INVALID_FIELD
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +19,8 @@ logger = logging.getLogger(__name__)
 
 # - %h	Remote hostname. Will log the IP address if HostnameLookups is set to Off, which is the default.
 # If it logs the hostname for only a few hosts, you probably have access control directives mentioning them by name
-REMOTE_HOSTNAME_RE = r"(?P<remote_ip>\d+\.\d+\.\d+\.\d+)"
+# IPv4 or IPv6 addresses are supported
+REMOTE_HOSTNAME_RE = r"(?P<remote_ip>\d+\.\d+\.\d+\.\d+|[0-9A-Fa-f]*:[0-9A-Fa-f:.]+)"
 # - %l Remote logname (from identd, if supplied).
 # This will return a dash unless mod_ident is present and IdentityCheck is set On.
 REMOTE_LOGNAME_RE = r"(-)"
@@ -36,6 +41,9 @@ BYTES_SIZE_RE = r"(?P<bytes>\d+|\-)"
 REFERER_RE = r'"(?P<referrer>[^\"]+)"'
 # - User-agent
 USER_AGENT_RE = r'"(?P<user_agent>[^\"]+)"'
+# - Optional time taken to serve the request, after the combined fields:
+# %D in microseconds, %T in seconds or %{ms}T in milliseconds, see `set_time_taken_format`
+TIME_TAKEN_RE = r'(?: (?P<time_taken>\d+))?'
 
 # Put the pieces in the right order as per Apache configuration
 LOG_LINE_PATTERN = " ".join([REMOTE_HOSTNAME_RE,
@@ -49,46 +57,110 @@ LOG_LINE_PATTERN = " ".join([REMOTE_HOSTNAME_RE,
                              USER_AGENT_RE
                              ])
 
-REGEX = re.compile(f"^{LOG_LINE_PATTERN}$")
+REGEX = re.compile(f"^{LOG_LINE_PATTERN}{TIME_TAKEN_RE}$")
 
+# Microseconds in the unit of the time taken field
+_time_taken_multiplier = TIME_TAKEN_FORMATS[DEFAULT_TIME_TAKEN_FORMAT]
 
-def parse_log_file(file_name):
+
+def set_time_taken_format(time_taken_format):
+    """
+    Set the format of the optional time taken field at the end of the log lines
+    :param time_taken_format: `D` for %D, `T` for %T or `ms` for %{ms}T
+    """
+    global _time_taken_multiplier
+    if time_taken_format not in TIME_TAKEN_FORMATS:
+        raise ValueError(f"Unknown time taken format {time_taken_format}")
+    _time_taken_multiplier = TIME_TAKEN_FORMATS[time_taken_format]
+
+
+def parse_log_file(file_name, enrichers=None, rejects=None, line_filters=None):
     """
     Open a file and create a list of dictionaries with each line as a dict
     :param file_name: File name as a string
+    :param enrichers: List of functions adding fields to each parsed line, like `geoip.GeoIpDatabase.enrich`
+    :param rejects: RejectedLines instance handling the lines that could not be parsed, each one is logged when None
+    :param line_filters: List of functions returning False for the lines to skip, called before parsing the lines,
+    like `sampling.Sampler.keep_line`, the ones of a Deduplicator are told that the file starts
     :rtype: [dict]
     """
+    start_file(line_filters, file_name)
     data = []
     with open(file_name, 'r') as fh:
         for line in fh:
-            line_data = parse_line(line.strip())
+            if line_filters:
+                # Lines are filtered without their surrounding spaces, like they are parsed
+                stripped = line.strip()
+                if not all(keep(stripped) for keep in line_filters):
+                    continue
+            line_data = parse_line(line, rejects)
             if line_data:
+                for enrich in enrichers or ():
+                    enrich(line_data)
                 data.append(line_data)
     logger.info(f"Read {len(data)} lines from file {file_name}")
     return data
 
 
-def parse_line(line):
+def get_line_filters(sampler=None, line_filters=None):
     """
-    Convert a string log line into a dict
-    :param line: Apache log line
-    :rtype: dict|False
+    :param sampler: Sampler keeping only a sample of the lines, or None
+    :param line_filters: List of functions returning False for the lines to skip, or None
+    :return: The line filters, lines are sampled first
+    :rtype: list
     """
-    match = REGEX.search(line)
-    if match:
-        data = match.groupdict()
+    return ([sampler.keep_line] if sampler is not None else []) + list(line_filters or ())
 
-        data['time'] = parse_date(data['time']).isoformat()
-        data['response'] = parse_int(data['response'])
-        data['bytes'] = parse_int(data['bytes'])
 
-        data.update(extract_method_and_url(data['request']))
-        data.update(extract_client_information(data['user_agent']))
+def reject_line(line, reason, rejects=None):
+    """
+    :param line: Line which could not be parsed, with its line ending
+    :param reason: Reason of the rejection, see the constants of rejects.py
+    :param rejects: RejectedLines instance handling the line, each line is logged when None
+    """
+    line = line.rstrip('\r\n')
+    if rejects is None:
+        logger.error(f'Could not understand line ({reason}) "{line}"')
+    else:
+        rejects.reject(line, reason)
+
 
-        return data
+def parse_line(line, rejects=None):
+    """
+    Convert a string log line into a dict
+    :param line: Apache log line, the spaces and line ending around it are ignored
+    :param rejects: RejectedLines instance handling the line as read if it can't be parsed,
+    the line is logged when None
+    :rtype: dict|False
+    """
+    match = REGEX.match(line.strip())
+    if not match:
+        reject_line(line, NO_MATCH, rejects)
+        return False
+    data = match.groupdict()
+
+    try:
+        # Addresses are aggregated as integers by the StatProducer
+        ip_to_int(data['remote_ip'])
+    except ValueError:
+        reject_line(line, INVALID_IP, rejects)
+        return False
+
+    try:
+        data['time'] = parse_date(data['time']).isoformat()
+    except ValueError:
+        reject_line(line, INVALID_FIELD, rejects)
+        return False
+    data['response'] = parse_int(data['response'])
+    data['bytes'] = parse_int(data['bytes'])
+    time_taken = data.pop('time_taken')
+    if time_taken is not None:
+        data['response_time_us'] = int(time_taken) * _time_taken_multiplier
+
+    data.update(extract_method_and_url(data['request']))
+    data.update(extract_client_information(data['user_agent']))
 
-    logger.error(f'Could not understand line "{line}"')
-    return False
+    return data
 
 
 def parse_int(int_string):
@@ -114,30 +186,48 @@ def parse_date(date_string):
     return datetime.strptime(date_string, "%d/%b/%Y:%H:%M:%S %z")
 
 
-def generate_data_from_log(input_files):
+def generate_data_from_log(input_files, enrichers=None, rejects=None, line_filters=None):
     """
     Return a list dictionaries from one or many Apache file
     :param input_files: List of Apache log files names
     :type input_files: list|str|bytes
+    :param enrichers: List of functions adding fields to each parsed line
+    :param rejects: RejectedLines instance handling the lines that could not be parsed
+    :param line_filters: List of functions returning False for the lines to skip
     :return: List of dictionaries
     """
     if type(input_files) in frozenset([str, bytes]):
         input_files = [input_files]
     data = []
     for file in input_files:
-        data = data + parse_log_file(file)
+        data.extend(parse_log_file(file, enrichers, rejects, line_filters))
     return data
 
 
-def write_json_log(input_files, output_file):
+def write_json_log(input_files, output_file, rollup=False, enrichers=None, rejects=None, sampler=None,
+                   line_filters=None):
     """
     Create a JSON log file from a list of Apache log files name
     :param input_files: List of input files name
     :param output_file: File name to write the JSON log to
+    :param rollup: Also write the rollup snapshot of all StatProducer next to the JSON log file
+    :param enrichers: List of functions adding fields to each parsed line
+    :param rejects: RejectedLines instance handling the lines that could not be parsed
+    :param sampler: Sampler keeping only a sample of the lines, its sampling is saved next to the JSON log file
+    :param line_filters: List of functions returning False for the lines to skip, like `dedup.Deduplicator.keep_line`
     :return:
     """
+    # Imported here so that parsing lines does not import the stats producers
+    from apache_logs_parser.rollup import write_rollup, get_rollup_file_name
+    from apache_logs_parser.sampling import write_sampling
+    from apache_logs_parser.stats import get_stats
+
+    data = generate_data_from_log(input_files, enrichers, rejects, get_line_filters(sampler, line_filters))
     with open(output_file, 'w') as f:
         json.dump(
-            generate_data_from_log(input_files),
+            data,
             f, indent=4)
         logger.info(f"Wrote output to file {output_file}")
+    write_sampling(sampler, output_file)
+    if rollup:
+        write_rollup(get_stats(data), get_rollup_file_name(output_file))
@@ -0,0 +1,444 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Ad-hoc aggregation of the log entries, without writing a StatProducer.
+
+A query groups the entries by keys and computes aggregates for each group:
+- keys are fields of the entries, such as `path` or `remote_ip`, or fields derived from them: `minute`, `hour`, `day`
+  and `status_class`
+- aggregates are `count`, `sum(field)`, `avg(field)`, `min(field)`, `max(field)`, `distinct(field)` and percentiles
+  such as `p95(field)`
+
+The query is compiled into a plan which reads only the fields it uses. The entries are grouped batch by batch in a
+hash table, and each aggregate updates a group with all its entries of the batch at once.
+"""
+
+import heapq
+import json
+import logging
+import re
+from collections import defaultdict
+from itertools import islice
+from operator import itemgetter
+
+from apache_logs_parser.colors import Colors
+from apache_logs_parser.display import write_lines
+from apache_logs_parser.serializers import AUTO, get_serializer, write_json_object
+from apache_logs_parser.sketch import DDSketch
+
+logger = logging.getLogger(__name__)
+
+# Number of entries grouped at once
+BATCH_SIZE = 4096
+
+# Short names of the fields
+FIELD_ALIASES = {
+    'ip': 'remote_ip',
+    'status': 'response',
+}
+
+# Fields derived from a field of the entries: (source field, function computing the value from the source value)
+DERIVED_FIELDS = {
+    'minute': ('time', lambda time: time[:16]),
+    'hour': ('time', lambda time: time[:13]),
+    'day': ('time', lambda time: time[:10]),
+    'status_class': ('response', lambda response: f"{response // 100}xx"),
+}
+
+# Fields accepted by the aggregates computing on numbers, sum, avg and percentiles
+NUMERIC_FIELDS = ['response', 'bytes', 'response_time_us', 'asn']
+
+AGGREGATE_RE = re.compile(r"^(?P<function>\w+)(?:\((?P<field>\w+)\))?$")
+PERCENTILE_RE = re.compile(r"^p(?P<percentile>\d+(?:\.\d+)?)$")
+
+
+def resolve_field(name):
+    """
+    :param name: Field name or alias
+    :return: Name of the field in the entries
+    :raise ValueError: If the field is unknown
+    """
+    # Imported here as the SQLite backend imports the parser and the stats
+    from apache_logs_parser.sqlite_backend import COLUMN_NAMES
+
+    field = FIELD_ALIASES.get(name, name)
+    if field not in COLUMN_NAMES:
+        raise ValueError(f"Unknown field {name}, fields are {', '.join(COLUMN_NAMES + list(FIELD_ALIASES))}")
+    return field
+
+
+def field_getter(field):
+    """
+    :return: Function returning the value of a field of an entry, None if the entry does not have it
+    """
+    from apache_logs_parser.sqlite_backend import OPTIONAL_COLUMNS
+
+    if field in OPTIONAL_COLUMNS:
+        return lambda data_entry: data_entry.get(field)
+    return itemgetter(field)
+
+
+def _values(get_value, data_entries):
+    return [value for value in map(get_value, data_entries) if value is not None]
+
+
+class Aggregate(object):
+    """
+    Aggregate computed for each group, its state is created by `new` and updated with the entries of the group
+    """
+    # True for the aggregates only accepting the NUMERIC_FIELDS
+    numeric = False
+
+    def __init__(self, name, field=None):
+        """
+        :param name: Name of the aggregate in the rows, such as `sum(bytes)`
+        :param field: Field aggregated, None for `count`
+        """
+        self.name = name
+        self.field = field
+        self.get_value = field_getter(field) if field else None
+
+    def new(self):
+        raise NotImplementedError()
+
+    def update(self, state, data_entries):
+        """
+        :param state: State of a group
+        :param data_entries: Entries of the group
+        :return: The updated state
+        """
+        raise NotImplementedError()
+
+    def result(self, state):
+        raise NotImplementedError()
+
+
+class Count(Aggregate):
+
+    def new(self):
+        return 0
+
+    def update(self, state, data_entries):
+        return state + len(data_entries)
+
+    def result(self, state):
+        return state
+
+
+class Sum(Aggregate):
+    numeric = True
+
+    def new(self):
+        return 0
+
+    def update(self, state, data_entries):
+        return state + sum(_values(self.get_value, data_entries))
+
+    def result(self, state):
+        return state
+
+
+class Average(Aggregate):
+    numeric = True
+
+    def new(self):
+        return 0, 0
+
+    def update(self, state, data_entries):
+        values = _values(self.get_value, data_entries)
+        return state[0] + sum(values), state[1] + len(values)
+
+    def result(self, state):
+        total, count = state
+        return total / count if count else None
+
+
+class Minimum(Aggregate):
+
+    def new(self):
+        return None
+
+    def update(self, state, data_entries):
+        values = _values(self.get_value, data_entries)
+        if state is not None:
+            values.append(state)
+        return min(values) if values else None
+
+    def result(self, state):
+        return state
+
+
+class Maximum(Aggregate):
+
+    def new(self):
+        return None
+
+    def update(self, state, data_entries):
+        values = _values(self.get_value, data_entries)
+        if state is not None:
+            values.append(state)
+        return max(values) if values else None
+
+    def result(self, state):
+        return state
+
+
+class Distinct(Aggregate):
+
+    def new(self):
+        return set()
+
+    def update(self, state, data_entries):
+        state.update(_values(self.get_value, data_entries))
+        return state
+
+    def result(self, state):
+        return len(state)
+
+
+class Percentile(Aggregate):
+    numeric = True
+
+    def __init__(self, name, field, percentile):
+        super().__init__(name, field)
+        if not 0 <= percentile <= 100:
+            raise ValueError(f"Percentile of {name} must be between 0 and 100")
+        self.quantile = percentile / 100
+
+    def new(self):
+        return DDSketch()
+
+    def update(self, state, data_entries):
+        for value in _values(self.get_value, data_entries):
+            state.add(value)
+        return state
+
+    def result(self, state):
+        return state.quantile(self.quantile)
+
+
+# Aggregate classes by function name, percentiles are named pNN
+AGGREGATES = {
+    'count': Count,
+    'sum': Sum,
+    'avg': Average,
+    'min': Minimum,
+    'max': Maximum,
+    'distinct': Distinct,
+}
+
+
+def parse_aggregate(expression):
+    """
+    :param expression: Aggregate such as `count`, `sum(bytes)` or `p95(response_time_us)`
+    :rtype: Aggregate
+    :raise ValueError: If the aggregate is invalid
+    """
+    match = AGGREGATE_RE.match(expression.strip())
+    if not match:
+        raise ValueError(f"Invalid aggregate {expression}, expected a function such as count or sum(bytes)")
+    function, field = match.group('function'), match.group('field')
+    if function == 'count':
+        if field is not None:
+            raise ValueError("count does not take a field")
+        return Count('count')
+    if field is None:
+        raise ValueError(f"{function} requires a field, such as {function}(bytes)")
+    name = f"{function}({field})"
+    field = resolve_field(field)
+    percentile = PERCENTILE_RE.match(function)
+    if not percentile and function not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {function}, aggregates are {', '.join(AGGREGATES)} and pNN")
+    aggregate_class = Percentile if percentile else AGGREGATES[function]
+    if aggregate_class.numeric and field not in NUMERIC_FIELDS:
+        raise ValueError(f"{function} requires a numeric field: {', '.join(NUMERIC_FIELDS)}")
+    if percentile:
+        return Percentile(name, field, float(percentile.group('percentile')))
+    return aggregate_class(name, field)
+
+
+def _ascending_key(item):
+    # Groups without value are last
+    _, value, _ = item
+    return value is None, value
+
+
+def _descending_key(item):
+    _, value, _ = item
+    return value is not None, value
+
+
+class QueryPlan(object):
+    """
+    Hash aggregation of the entries by group keys
+    """
+
+    def __init__(self, group_by, aggregates, order_by=None, ascending=False):
+        """
+        :param group_by: Names of the fields, or derived fields, grouping the entries
+        :param aggregates: Aggregates expressions, see `parse_aggregate`
+        :param order_by: Aggregate expression sorting the rows, the first aggregate by default
+        :param ascending: Smallest values first
+        :raise ValueError: If a field or an aggregate is invalid
+        """
+        if not aggregates:
+            raise ValueError("At least one aggregate is required")
+        self.group_by = list(group_by or ())
+        self.aggregates = [parse_aggregate(expression) for expression in aggregates]
+        names = [aggregate.name for aggregate in self.aggregates]
+        if len(set(names)) < len(names):
+            raise ValueError("Aggregates must be different")
+        if order_by is not None and order_by not in names:
+            raise ValueError(f"Can't order by {order_by}, it is not one of the aggregates: {', '.join(names)}")
+        self.order_index = names.index(order_by) if order_by is not None else 0
+        self.ascending = ascending
+        getters = []
+        self.fields = set()
+        for name in self.group_by:
+            if name in DERIVED_FIELDS:
+                field, derive = DERIVED_FIELDS[name]
+                get_field = field_getter(field)
+                getters.append(lambda data_entry, get_field=get_field, derive=derive: derive(get_field(data_entry)))
+            else:
+                field = resolve_field(name)
+                getters.append(field_getter(field))
+            self.fields.add(field)
+        self.fields.update(aggregate.field for aggregate in self.aggregates if aggregate.field)
+        self.get_key = self._compile_key(getters)
+        self.groups = dict()
+
+    @staticmethod
+    def _compile_key(getters):
+        if not getters:
+            return lambda data_entry: ()
+        if len(getters) == 1:
+            get_value, = getters
+            return lambda data_entry: (get_value(data_entry),)
+        return lambda data_entry: tuple(get_value(data_entry) for get_value in getters)
+
+    def process_batch(self, data_entries):
+        """
+        :param data_entries: List of Apache log lines as dicts
+        """
+        batch_groups = defaultdict(list)
+        for key, data_entry in zip(map(self.get_key, data_entries), data_entries):
+            batch_groups[key].append(data_entry)
+        groups, aggregates = self.groups, self.aggregates
+        for key, group_entries in batch_groups.items():
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = [aggregate.new() for aggregate in aggregates]
+            for index, aggregate in enumerate(aggregates):
+                states[index] = aggregate.update(states[index], group_entries)
+
+    def feed(self, data_entries):
+        """
+        :param data_entries: Iterable of Apache log lines as dicts
+        """
+        data_entries = iter(data_entries)
+        while True:
+            batch = list(islice(data_entries, BATCH_SIZE))
+            if not batch:
+                break
+            self.process_batch(batch)
+
+    @property
+    def columns(self):
+        """
+        Names of the group keys then of the aggregates
+        """
+        return self.group_by + [aggregate.name for aggregate in self.aggregates]
+
+    def get_rows(self, top=None):
+        """
+        :param top: Maximum number of rows, None for all, the rows are selected without sorting all the groups
+        :return: Rows as dicts of the group keys and the aggregates, sorted by the `order_by` aggregate
+        :rtype: list[dict]
+        """
+        index = self.order_index
+        aggregate = self.aggregates[index]
+        results = ((key, aggregate.result(states[index]), states) for key, states in self.groups.items())
+        if self.ascending:
+            selected = sorted(results, key=_ascending_key) if top is None \
+                else heapq.nsmallest(top, results, key=_ascending_key)
+        else:
+            selected = sorted(results, key=_descending_key, reverse=True) if top is None \
+                else heapq.nlargest(top, results, key=_descending_key)
+        rows = []
+        for key, _, states in selected:
+            row = dict(zip(self.group_by, key))
+            row.update((aggregate.name, aggregate.result(state)) for aggregate, state in zip(self.aggregates, states))
+            rows.append(row)
+        return rows
+
+
+def iter_file_entries(file_name, fields=None):
+    """
+    :param file_name: JSON log file or SQLite database
+    :param fields: Fields read from SQLite databases, all by default
+    :return: Iterable of the entries of the file
+    """
+    import sqlite3
+    from apache_logs_parser.sqlite_backend import is_sqlite_file, iter_entries
+
+    if is_sqlite_file(file_name):
+        connection = sqlite3.connect(file_name)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield from iter_entries(connection, columns=fields)
+        finally:
+            connection.close()
+    else:
+        with open(file_name, 'r') as f:
+            yield from json.load(f)
+
+
+def run_query(input_files, plan):
+    """
+    Aggregate the entries of JSON log files or SQLite databases
+    :param input_files: List of JSON or SQLite file names
+    :param plan: QueryPlan
+    :return: The plan, with the groups aggregated
+    """
+    for file_name in input_files:
+        plan.feed(data_entry for data_entry in iter_file_entries(file_name, sorted(plan.fields)) if data_entry)
+        logger.info(f"Aggregated the entries of {file_name}")
+    return plan
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def display_rows(rows, columns):
+    """
+    Print the rows of a query as a table
+    :param rows: Rows returned by `QueryPlan.get_rows`
+    :param columns: Names of the columns, see `QueryPlan.columns`
+    """
+    cells = [[format_value(row[column]) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(line[index]) for line in cells]) for index, column in enumerate(columns)]
+    lines = [Colors.BOLD + "  ".join(column.ljust(width) for column, width in zip(columns, widths)) + Colors.ENDC]
+    for line in cells:
+        lines.append("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+    write_lines(lines)
+
+
+def write_json_rows(plan, rows, file_name, compact=False, serializer=AUTO):
+    """
+    Write the rows of a query to a JSON file, with the query
+    :param plan: QueryPlan of the rows
+    :param rows: Rows returned by `QueryPlan.get_rows`
+    :param file_name: Name of the file to write to
+    :param compact: Write the JSON without indentation and spaces
+    :param serializer: Name of the JSON serializer to use, see `serializers.get_serializer`
+    """
+    query = dict(group_by=plan.group_by, aggregates=[aggregate.name for aggregate in plan.aggregates],
+                 order_by=plan.aggregates[plan.order_index].name, ascending=plan.ascending)
+    with open(file_name, 'wb') as f:
+        write_json_object([('query', query), ('rows', rows)], f, get_serializer(serializer, compact=compact))
+    logger.info(f"Wrote {len(rows)} rows to file {file_name}")
@@ -0,0 +1,87 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Handling of the log lines that could not be parsed.
+Lines are counted by reason, only a few of them are logged, and they can be saved in a reject file.
+"""
+
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Reasons for rejecting a line
+NO_MATCH = 'no_match'
+INVALID_IP = 'invalid_ip'
+INVALID_FIELD = 'invalid_field'
+
+
+class RejectedLines(object):
+    """
+    Count, log and save rejected lines
+    """
+
+    def __init__(self, reject_file=None, max_logged=10, log_interval=10.0, buffer_size=1000):
+        """
+        :param reject_file: File name to write the rejected lines to, None to not save them
+        :param max_logged: Number of rejected lines logged, after that only a count is logged
+        :param log_interval: Minimum number of seconds between two logs of the count of rejected lines
+        :param buffer_size: Number of lines written at once to the reject file
+        """
+        self.counts = Counter()
+        self.max_logged = max_logged
+        self.log_interval = log_interval
+        self.buffer_size = buffer_size
+        self.logged = 0
+        self.last_log = time.monotonic()
+        self.buffer = []
+        self.reject_file = open(reject_file, 'w') if reject_file else None
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def reject(self, line, reason):
+        """
+        :param line: Rejected line
+        :param reason: Reason of the rejection, see the constants of this module
+        """
+        self.counts[reason] += 1
+        if self.reject_file is not None:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+        if self.logged < self.max_logged:
+            self.logged += 1
+            logger.error(f'Could not understand line ({reason}) "{line}"')
+            if self.logged == self.max_logged:
+                logger.error("Next rejected lines won't be logged, only counted")
+        else:
+            now = time.monotonic()
+            if now - self.last_log >= self.log_interval:
+                self.last_log = now
+                logger.warning(f"{self.total} lines rejected so far")
+
+    def flush(self):
+        if self.reject_file is not None and self.buffer:
+            self.reject_file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+
+    def close(self):
+        """
+        Write the remaining lines to the reject file and log a summary of the rejections
+        """
+        self.flush()
+        if self.reject_file is not None:
+            self.reject_file.close()
+            self.reject_file = None
+        if self.counts:
+            details = ', '.join(f"{reason}: {count}" for reason, count in self.counts.most_common())
+            logger.warning(f"Rejected {self.total} lines ({details})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
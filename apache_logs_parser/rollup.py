@@ -0,0 +1,89 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Rollup snapshots: the aggregated state of every StatProducer for a JSON log file,
+saved next to it so stats can be produced without reading the log entries again.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Increase when the state of a StatProducer changes in an incompatible way
+ROLLUP_VERSION = 2
+ROLLUP_SUFFIX = '.rollup.json'
+
+
+def get_rollup_file_name(file_name):
+    """
+    Name of the rollup snapshot of a JSON log file
+    :param file_name: JSON log file name
+    :rtype: str
+    """
+    return f"{file_name}{ROLLUP_SUFFIX}"
+
+
+def write_rollup(stats_instances, file_name):
+    """
+    Save the state of StatProducer instances in a rollup snapshot
+    :param stats_instances: List of StatProducer subclasses instances. Data must have been fed in the instances.
+    :param file_name: Name of the rollup file to write to
+    """
+    rollup = dict(
+        version=ROLLUP_VERSION,
+        producers={stat.name: stat.get_state() for stat in stats_instances},
+    )
+    with open(file_name, 'w') as f:
+        json.dump(rollup, f)
+    logger.info(f"Wrote rollup snapshot to file {file_name}")
+
+
+def read_rollup(file_name, producer_names):
+    """
+    Read the states of a rollup snapshot written by `write_rollup`.
+    :param file_name: Name of the rollup file
+    :param producer_names: Names of the StatProducer whose state is required
+    :return: Dictionary of the states by StatProducer name or None if the rollup can't provide all the states
+    :rtype: dict|None
+    """
+    try:
+        with open(file_name, 'r') as f:
+            rollup = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read rollup snapshot {file_name}: {e}")
+        return None
+    if rollup.get('version') != ROLLUP_VERSION:
+        logger.info(f"Ignoring rollup snapshot {file_name} with version {rollup.get('version')}")
+        return None
+    producers = rollup.get('producers', {})
+    missing = [name for name in producer_names if name not in producers]
+    if missing:
+        logger.info(f"Ignoring rollup snapshot {file_name}, missing producers: {', '.join(missing)}")
+        return None
+    return producers
+
+
+def merge_rollup(stats_instances, file_name):
+    """
+    Merge the rollup snapshot of a JSON log file into StatProducer instances, if it is usable.
+    A snapshot older than its JSON log file is considered outdated and is not used.
+    :param stats_instances: List of StatProducer subclasses instances
+    :param file_name: JSON log file name
+    :return: True if the rollup snapshot was merged, False if the log entries must be read instead
+    :rtype: bool
+    """
+    rollup_file_name = get_rollup_file_name(file_name)
+    if not os.path.exists(rollup_file_name):
+        return False
+    if os.path.getmtime(rollup_file_name) < os.path.getmtime(file_name):
+        logger.info(f"Ignoring outdated rollup snapshot {rollup_file_name}")
+        return False
+    states = read_rollup(rollup_file_name, [stat.name for stat in stats_instances])
+    if states is None:
+        return False
+    for stat in stats_instances:
+        stat.merge_state(states[stat.name])
+    logger.info(f"Merged rollup snapshot {rollup_file_name}")
+    return True
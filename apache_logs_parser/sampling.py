@@ -0,0 +1,241 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Hash based sampling of the log lines.
+
+A line is kept when the CRC32 of its sample key is below a threshold, so the decision is taken before the line is
+parsed and the same key always gets the same decision. The key can be:
+- `line`: the whole line, lines are sampled independently
+- `ip`: the remote IP, all the lines of a kept IP are kept, so per IP metrics are exact for the IPs of the sample
+- `session`: the remote IP and the user agent
+
+The sampling of a converted file is saved next to it, see `write_sampling`, so the stats can be scaled.
+"""
+
+import json
+import logging
+import math
+import os
+import zlib
+
+from apache_logs_parser.colors import format_header
+from apache_logs_parser.constants import IP_KEY, SESSION_KEY, LINE_KEY, SAMPLE_KEYS
+from apache_logs_parser.display import write_lines
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_SUFFIX = '.sampling.json'
+# Normal quantile of a 95% confidence interval
+Z_95 = 1.96
+
+
+def line_sample_key(line, key):
+    """
+    :param line: Apache log line
+    :param key: One of SAMPLE_KEYS
+    :rtype: str
+    """
+    if key == IP_KEY:
+        return line.split(' ', 1)[0]
+    if key == SESSION_KEY:
+        # User agent is the last quoted field, only the time taken can follow it
+        fields = line.rsplit('"', 2)
+        user_agent = fields[1] if len(fields) == 3 else ''
+        return f"{line.split(' ', 1)[0]} {user_agent}"
+    return line
+
+
+def entry_sample_key(data_entry, key):
+    """
+    :param data_entry: Apache log line as a dict
+    :param key: One of SAMPLE_KEYS
+    :rtype: str
+    """
+    if key == IP_KEY:
+        return data_entry['remote_ip']
+    if key == SESSION_KEY:
+        return f"{data_entry['remote_ip']} {data_entry['user_agent']}"
+    return f"{data_entry['remote_ip']} {data_entry['time']} {data_entry['request']} {data_entry['user_agent']}"
+
+
+class Sampler(object):
+    """
+    Keep a fraction of the lines, or of the entries, based on the hash of their sample key
+    """
+
+    def __init__(self, rate, key=LINE_KEY):
+        """
+        :param rate: Fraction of the lines to keep, between 0 excluded and 1
+        :param key: One of SAMPLE_KEYS
+        """
+        if not 0 < rate <= 1:
+            raise ValueError("Sample rate must be between 0 excluded and 1")
+        if key not in SAMPLE_KEYS:
+            raise ValueError(f"Unknown sample key {key}")
+        self.rate = rate
+        self.key = key
+        self.threshold = int(rate * (1 << 32))
+        self.seen = 0
+        self.kept = 0
+
+    def keep(self, sample_key):
+        """
+        :param sample_key: Sample key of a line
+        :return: True if the line is in the sample
+        :rtype: bool
+        """
+        self.seen += 1
+        if zlib.crc32(sample_key.encode('utf-8', 'surrogateescape')) < self.threshold:
+            self.kept += 1
+            return True
+        return False
+
+    def keep_line(self, line):
+        return self.keep(line_sample_key(line, self.key))
+
+    def keep_entry(self, data_entry):
+        return self.keep(entry_sample_key(data_entry, self.key))
+
+    def to_dict(self):
+        return dict(rate=self.rate, key=self.key, seen=self.seen, kept=self.kept)
+
+
+def get_sampling_file_name(file_name):
+    """
+    Name of the file describing the sampling of a converted file
+    :rtype: str
+    """
+    return f"{file_name}{SAMPLING_SUFFIX}"
+
+
+def write_sampling(sampler, file_name):
+    """
+    Save the sampling of a converted file, or remove the sampling of a previous conversion if it was not sampled
+    :param sampler: Sampler used to convert the file, or None
+    :param file_name: Converted file name
+    """
+    sampling_file_name = get_sampling_file_name(file_name)
+    if sampler is None:
+        if os.path.exists(sampling_file_name):
+            os.remove(sampling_file_name)
+        return
+    with open(sampling_file_name, 'w') as f:
+        json.dump(sampler.to_dict(), f)
+    logger.info(f"Kept {sampler.kept} of {sampler.seen} lines, sample rate {sampler.rate} by {sampler.key}")
+
+
+def read_sampling(file_name):
+    """
+    :param file_name: Converted file name
+    :return: Sampling of the file, as returned by `Sampler.to_dict`, None if it was not sampled
+    :rtype: dict|None
+    """
+    sampling_file_name = get_sampling_file_name(file_name)
+    if not os.path.exists(sampling_file_name):
+        return None
+    with open(sampling_file_name, 'r') as f:
+        return json.load(f)
+
+
+def combine_sampling(rate, key, other_rate, other_key):
+    """
+    Sampling of entries sampled twice
+    :return: Rate and key of the resulting sampling
+    :rtype: (float, str)
+    """
+    if rate == 1 or other_rate == 1:
+        return (other_rate, other_key) if rate == 1 else (rate, key)
+    if key == other_key and key != LINE_KEY:
+        # The same hash decides, the entries kept by the lowest rate are the ones kept by both
+        return min(rate, other_rate), key
+    # Line keys of lines and entries are different, the decisions are independent
+    return rate * other_rate, max(key, other_key, key=SAMPLE_KEYS.index)
+
+
+def get_sampling(input_files, sampler=None):
+    """
+    Sampling of the entries of converted files, when they are sampled again by `sampler`
+    :param input_files: List of converted file names
+    :param sampler: Sampler of the entries read from the files, or None
+    :return: Dictionary with the `rate` and `key` of the sampling and the number of lines `kept` by the conversion,
+    None if the entries are not sampled
+    :rtype: dict|None
+    :raise ValueError: If the files were sampled differently
+    """
+    return merge_samplings(map(read_sampling, input_files), sampler)
+
+
+def merge_samplings(recorded_samplings, sampler=None):
+    """
+    Sampling of the entries of several files, see `get_sampling`
+    :param recorded_samplings: Iterable of the samplings of the files, as returned by `read_sampling`
+    :param sampler: Sampler of the entries read from the files, or None
+    :rtype: dict|None
+    :raise ValueError: If the files were sampled differently
+    """
+    samplings = set()
+    kept = 0
+    for recorded in recorded_samplings:
+        recorded = recorded or dict(rate=1, key=LINE_KEY, kept=0)
+        rate, key = recorded['rate'], recorded['key']
+        kept += recorded['kept']
+        if sampler is not None:
+            rate, key = combine_sampling(rate, key, sampler.rate, sampler.key)
+        samplings.add((rate, key))
+    if len(samplings) > 1:
+        raise ValueError("Files sampled at different rates or with different keys can't be combined")
+    if not samplings:
+        return None
+    rate, key = samplings.pop()
+    if rate == 1:
+        return None
+    return dict(rate=rate, key=key, kept=kept)
+
+
+def confidence_interval(sampled_count, rate, z=Z_95):
+    """
+    Confidence interval of a count estimated from a sample, lines being sampled independently.
+    When lines are sampled by IP or session, they are sampled by groups and the actual interval is wider.
+    :param sampled_count: Count in the sample
+    :param rate: Sample rate
+    :param z: Normal quantile of the confidence level
+    :return: Estimated count, low and high bounds of the interval
+    :rtype: (int, int, int)
+    """
+    estimate = sampled_count / rate
+    margin = z * math.sqrt(sampled_count * (1 - rate)) / rate
+    return round(estimate), max(sampled_count, math.floor(estimate - margin)), math.ceil(estimate + margin)
+
+
+def sampling_metrics(rate, key, sampled_hits):
+    """
+    Description of the sampling of the stats, with the 95% confidence interval of the number of hits
+    :param rate: Sample rate
+    :param key: Sample key
+    :param sampled_hits: Number of entries in the sample
+    :rtype: dict
+    """
+    estimate, low, high = confidence_interval(sampled_hits, rate)
+    return dict(
+        rate=rate,
+        key=key,
+        scale=1 / rate,
+        sampled_hits=sampled_hits,
+        estimated_hits=estimate,
+        confidence_level=0.95,
+        estimated_hits_interval=[low, high],
+    )
+
+
+def display_sampling(sampling):
+    """
+    Print the description of the sampling of the stats
+    :param sampling: Dictionary returned by `sampling_metrics`
+    """
+    low, high = sampling['estimated_hits_interval']
+    write_lines([
+        format_header("Sampling"),
+        f"    Stats are estimated from {sampling['rate']:.2%} of the lines, sampled by {sampling['key']}",
+        f"    Hits in the sample : {sampling['sampled_hits']}",
+        f"    Estimated hits : {sampling['estimated_hits']}, 95% confidence interval [{low}, {high}]",
+    ])
@@ -0,0 +1,197 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+JSON serializers used to write the stats.
+The stats are written one member at a time so the whole document never has to be held in memory.
+A faster encoder than the standard library one can be used when installed, see `get_serializer`.
+"""
+
+import json
+import logging
+from collections import deque
+from itertools import islice
+
+from apache_logs_parser.constants import AUTO
+from apache_logs_parser.external import LazyMapping, LazySequence
+
+logger = logging.getLogger(__name__)
+
+# Number of items of a LazySequence encoded at once
+SEQUENCE_BATCH_SIZE = 4096
+
+
+def _encode_default(value):
+    # Sets are used by some StatProducer, they are written as lists
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, LazyMapping):
+        return dict(value.items())
+    if isinstance(value, LazySequence):
+        return list(value)
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+class JsonSerializer(object):
+    """
+    Serializer using the standard library `json` module, the output is encoded chunk by chunk
+    """
+    name = 'json'
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        # Indentation of a level of nesting
+        self.indent = b'' if compact else b'    '
+        if compact:
+            self.encoder = json.JSONEncoder(separators=(',', ':'), default=_encode_default)
+        else:
+            self.encoder = json.JSONEncoder(indent=4, default=_encode_default)
+
+    def iter_member(self, key, value):
+        """
+        Encode a single member of a JSON object, without the braces of the object.
+        :param key: Member name
+        :param value: Member value
+        :return: Generator of bytes
+        """
+        chunks = self.encoder.iterencode({key: value})
+        # Skip the opening brace and hold the last chunks back: closing brace and, when indented, line return
+        next(chunks)
+        held_back = 1 if self.compact else 2
+        pending = deque()
+        for chunk in chunks:
+            pending.append(chunk)
+            if len(pending) > held_back:
+                yield pending.popleft().encode()
+
+    def close(self):
+        return b'}' if self.compact else b'\n}'
+
+
+class OrjsonSerializer(object):
+    """
+    Serializer using `orjson` if installed, each member is encoded at once
+    """
+    name = 'orjson'
+
+    def __init__(self, compact=False):
+        import orjson
+        self.orjson = orjson
+        self.compact = compact
+        self.indent = b'' if compact else b'  '
+        self.option = orjson.OPT_NON_STR_KEYS
+        if not compact:
+            self.option |= orjson.OPT_INDENT_2
+
+    def iter_member(self, key, value):
+        encoded = self.orjson.dumps({key: value}, default=_encode_default, option=self.option)
+        yield encoded[1:-1] if self.compact else encoded[1:-2]
+
+    def close(self):
+        return b'}' if self.compact else b'\n}'
+
+
+# Serializers available by name, the first ones are preferred by `get_serializer(AUTO)`
+SERIALIZERS = {
+    OrjsonSerializer.name: OrjsonSerializer,
+    JsonSerializer.name: JsonSerializer,
+}
+
+
+def register_serializer(serializer_class):
+    """
+    Make a serializer available to `get_serializer`, it must implement the same methods and `indent` attribute as
+    JsonSerializer
+    :param serializer_class: Serializer class with a `name` attribute
+    """
+    SERIALIZERS[serializer_class.name] = serializer_class
+
+
+def get_serializers_names():
+    return [AUTO] + list(SERIALIZERS.keys())
+
+
+def get_serializer(name=AUTO, compact=False):
+    """
+    Instanciate a serializer
+    :param name: Name of the serializer, `auto` uses the first one that can be imported
+    :param compact: No indentation or spaces in the output
+    :raise ValueError: If the serializer does not exist
+    :raise ImportError: If the serializer was explicitly requested but its module is not installed
+    """
+    if name != AUTO:
+        if name not in SERIALIZERS:
+            raise ValueError(f"Could not find serializer {name}, serializers are {', '.join(get_serializers_names())}")
+        return SERIALIZERS[name](compact=compact)
+    for serializer_class in SERIALIZERS.values():
+        try:
+            return serializer_class(compact=compact)
+        except ImportError:
+            logger.debug(f"Serializer {serializer_class.name} is not available")
+    return JsonSerializer(compact=compact)
+
+
+def iter_member(serializer, key, value):
+    """
+    Encode a single member of a JSON object, values which are LazyMapping are encoded one item at a time and values
+    which are LazySequence a batch of items at a time
+    :param serializer: Serializer instance, see `get_serializer`
+    :return: Generator of bytes
+    """
+    if isinstance(value, LazySequence):
+        yield from iter_sequence_member(serializer, key, value)
+        return
+    if not isinstance(value, LazyMapping):
+        yield from serializer.iter_member(key, value)
+        return
+    # Member with an empty object, without the empty object
+    yield b''.join(serializer.iter_member(key, {}))[:-2] + b'{'
+    first = True
+    for item_key, item_value in value.items():
+        if not first:
+            yield b','
+        first = False
+        for chunk in iter_member(serializer, item_key, item_value):
+            # One more level of indentation, line returns are escaped in JSON strings
+            yield chunk.replace(b'\n', b'\n' + serializer.indent)
+    yield b'}' if first else serializer.close().replace(b'\n', b'\n' + serializer.indent)
+
+
+def iter_sequence_member(serializer, key, value):
+    """
+    Encode a member of a JSON object whose value is a LazySequence, the output is the same as for a list
+    :param serializer: Serializer instance, see `get_serializer`
+    :return: Generator of bytes
+    """
+    empty = b''.join(serializer.iter_member(key, []))
+    # Member up to the opening bracket, and what follows the last item: closing bracket, indented like the member
+    prefix = empty[:-1]
+    single = b''.join(serializer.iter_member(key, [None]))
+    suffix = single[single.rindex(b'null') + len(b'null'):]
+    items = iter(value)
+    first = True
+    while True:
+        batch = list(islice(items, SEQUENCE_BATCH_SIZE))
+        if not batch:
+            break
+        encoded = b''.join(serializer.iter_member(key, batch))
+        yield (prefix if first else b',') + encoded[len(prefix):-len(suffix)]
+        first = False
+    yield empty if first else suffix
+
+
+def write_json_object(members, fh, serializer):
+    """
+    Stream a JSON object into a binary file, one member at a time
+    :param members: Iterable of (key, value) pairs
+    :param fh: File opened in binary mode
+    :param serializer: Serializer instance, see `get_serializer`
+    """
+    fh.write(b'{')
+    first = True
+    for key, value in members:
+        if not first:
+            fh.write(b',')
+        first = False
+        for chunk in iter_member(serializer, key, value):
+            fh.write(chunk)
+    fh.write(serializer.close() if not first else b'}')
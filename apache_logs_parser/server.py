@@ -0,0 +1,263 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Long running stats server.
+Logs are parsed once, the StatProducer instances are kept in memory and updated when new lines are ingested.
+Answers are cached until new lines are ingested.
+
+HTTP API:
+- `GET /stats?producers=StatCount,ResponseCount&compact=1`: metrics as JSON, all producers by default
+- `GET /report?producers=StatCount&top=10`: the same text report as the `stats` command
+- `GET /health`: number of entries ingested and of lines rejected
+- `POST /ingest`: ingest the Apache log lines of the body, or the JSON entries with `?format=json`
+"""
+
+import io
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from apache_logs_parser.parser import parse_line
+from apache_logs_parser.rejects import RejectedLines
+from apache_logs_parser.serializers import get_serializer, write_json_object
+from apache_logs_parser.stats import create_stats_instances, feed_stats, iter_metrics, display_stats
+
+logger = logging.getLogger(__name__)
+
+# Fields of the entries used by the built-in StatProducer, the others are optional
+REQUIRED_FIELDS = frozenset(['remote_ip', 'time', 'response', 'bytes', 'url', 'path', 'extension', 'is_mobile',
+                             'is_bot', 'system_agent'])
+
+
+def validate_entries(entries):
+    """
+    Check entries received as JSON before feeding them to the producers, so that invalid entries are not partly
+    ingested
+    :param entries: Deserialized JSON entries, false values are ignored like the lines which could not be parsed
+    :raise ValueError: If the entries are not a list of log entries
+    """
+    if not isinstance(entries, list):
+        raise ValueError("Entries must be a JSON list of log entries")
+    for index, entry in enumerate(entries):
+        if not entry:
+            continue
+        if not isinstance(entry, dict):
+            raise ValueError(f"Entry {index} is not a JSON object")
+        missing = REQUIRED_FIELDS.difference(entry)
+        if missing:
+            raise ValueError(f"Entry {index} is missing the fields {', '.join(sorted(missing))}")
+        for field in ('response', 'bytes'):
+            # Booleans are integers in Python, not in the entries
+            if not isinstance(entry[field], int) or isinstance(entry[field], bool):
+                raise ValueError(f"Field {field} of entry {index} is not an integer")
+
+
+class StatsService(object):
+    """
+    StatProducer instances kept in memory, with a cache of the answers
+    """
+
+    def __init__(self, stats_classes=None, options=None):
+        self.stats_instances = create_stats_instances(stats_classes, options)
+        self.entries = 0
+        # Incremented when new entries are ingested
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.cache = dict()
+        # Lines of all the ingestions which could not be parsed, summarized by `close`
+        self.rejects = RejectedLines()
+
+    def ingest_entries(self, entries):
+        """
+        :param entries: List of dicts extracted from apache logs
+        :return: Number of entries ingested
+        """
+        with self.lock:
+            return self._feed(entries)
+
+    def ingest_lines(self, lines):
+        """
+        :param lines: Apache log lines
+        :return: Number of lines ingested
+        """
+        # Lines are parsed under the lock as the rejected lines of all the requests are counted together
+        with self.lock:
+            return self._feed([parse_line(line, self.rejects) for line in lines if line.strip()])
+
+    def _feed(self, entries):
+        # Called with the lock held
+        entries = [entry for entry in entries if entry]
+        feed_stats(self.stats_instances, entries)
+        self.entries += len(entries)
+        self.generation += 1
+        self.cache.clear()
+        return len(entries)
+
+    def close(self):
+        """
+        Log the summary of the rejected lines
+        """
+        with self.lock:
+            self.rejects.close()
+
+    def load_json_files(self, file_names):
+        for file_name in file_names:
+            with open(file_name, 'r') as f:
+                self.ingest_entries(json.load(f))
+            logger.info(f"Loaded JSON log file {file_name}")
+
+    def select(self, producers=None):
+        """
+        :param producers: Names of the StatProducer, None for all
+        :raise ValueError: If a name is not known
+        """
+        if not producers:
+            return self.stats_instances
+        by_name = {stat.name: stat for stat in self.stats_instances}
+        unknown = [name for name in producers if name not in by_name]
+        if unknown:
+            raise ValueError(f"Unknown stats producers: {', '.join(unknown)}")
+        return [by_name[name] for name in producers]
+
+    def _cached(self, key, compute):
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = compute()
+            return self.cache[key]
+
+    def get_stats_json(self, producers=None, compact=True):
+        """
+        :return: Metrics of the producers as JSON
+        :rtype: bytes
+        """
+        def compute():
+            output = io.BytesIO()
+            write_json_object(iter_metrics(self.select(producers)), output, get_serializer(compact=compact))
+            return output.getvalue()
+
+        return self._cached(('stats', tuple(producers or ()), compact), compute)
+
+    def get_report(self, producers=None, top=None):
+        """
+        :return: Text report of the producers, like the `stats` command displays
+        :rtype: bytes
+        """
+        def compute():
+            output = io.StringIO()
+            display_stats(self.select(producers), top=top, output=output)
+            return output.getvalue().encode()
+
+        return self._cached(('report', tuple(producers or ()), top), compute)
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of a StatsService, the service is an attribute of the server
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        producers = [name for value in query.get('producers', []) for name in value.split(',') if name]
+        service = self.server.service
+        try:
+            if url.path == '/stats':
+                compact = query.get('compact', ['1'])[0] not in ('0', 'false')
+                self.send_body(service.get_stats_json(producers, compact=compact), 'application/json')
+            elif url.path == '/report':
+                top = int(query['top'][0]) if 'top' in query else None
+                self.send_body(service.get_report(producers, top=top), 'text/plain; charset=utf-8')
+            elif url.path == '/health':
+                self.send_json(dict(entries=service.entries, generation=service.generation,
+                                    rejected=service.rejects.total))
+            else:
+                self.send_json(dict(error=f"Unknown path {url.path}"), status=404)
+        except ValueError as e:
+            self.send_json(dict(error=str(e)), status=400)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/ingest':
+            self.send_json(dict(error=f"Unknown path {url.path}"), status=404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            # UnicodeDecodeError is a ValueError, answered with a 400 like the invalid entries
+            body = body.decode()
+            if parse_qs(url.query).get('format', ['log'])[0] == 'json':
+                entries = json.loads(body)
+                validate_entries(entries)
+                ingested = self.server.service.ingest_entries(entries)
+            else:
+                ingested = self.server.service.ingest_lines(body.splitlines())
+        except ValueError as e:
+            self.send_json(dict(error=str(e)), status=400)
+            return
+        self.send_json(dict(ingested=ingested, entries=self.server.service.entries))
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data).encode(), 'application/json', status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return str(self.client_address[0]) if self.client_address else 'unix-socket'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class StatsHTTPServer(ThreadingHTTPServer):
+    def __init__(self, server_address, service):
+        self.service = service
+        super().__init__(server_address, StatsRequestHandler)
+
+
+class StatsUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        super().__init__(socket_path, StatsRequestHandler)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        # Attributes used by BaseHTTPRequestHandler
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def create_server(service, host='127.0.0.1', port=8080, socket_path=None):
+    """
+    Create the HTTP server of a StatsService, on a Unix socket if `socket_path` is set
+    """
+    if socket_path:
+        return StatsUnixHTTPServer(socket_path, service)
+    return StatsHTTPServer((host, port), service)
+
+
+def serve(service, host='127.0.0.1', port=8080, socket_path=None):
+    """
+    Answer the requests until interrupted
+    """
+    server = create_server(service, host, port, socket_path)
+    logger.info(f"Serving stats on {socket_path or f'http://{host}:{server.server_address[1]}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
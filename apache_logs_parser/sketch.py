@@ -0,0 +1,141 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+Mergeable quantile sketch, to compute percentiles of a distribution with a bounded memory.
+This is an implementation of DDSketch: values are counted in logarithmic buckets, which guarantees a relative error
+on the quantiles, and sketches using the same accuracy can be merged by adding their buckets.
+"""
+
+import math
+
+
+class DDSketch(object):
+    """
+    Quantile sketch for positive values
+    """
+    # Values smaller than that are counted as zeros
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        """
+        :param relative_accuracy: Maximum relative error of the quantiles
+        :param max_buckets: Maximum number of buckets, the lowest buckets are merged when there are more.
+        2048 buckets at 1% of accuracy cover values from 1 to more than 10^17.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Relative accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = dict()
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        """
+        :param value: Value to add to the distribution
+        :param count: Number of times the value is added
+        """
+        if value <= self.MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _collapse(self):
+        # Merge the lowest buckets, the accuracy of the highest quantiles, the interesting ones, is kept
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def merge(self, other):
+        """
+        Add the values of another sketch
+        :param other: Sketch with the same relative accuracy
+        :type other: DDSketch
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        :param q: Quantile between 0 and 1, for example 0.95 for the 95th percentile
+        :return: Estimated value of the quantile, None if the sketch is empty
+        :rtype: float|None
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("Quantile must be between 0 and 1")
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                # The estimation can't be outside of the values seen
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def to_dict(self):
+        """
+        JSON serializable state of the sketch, see `from_dict`
+        :rtype: dict
+        """
+        return dict(
+            relative_accuracy=self.relative_accuracy,
+            max_buckets=self.max_buckets,
+            # JSON objects only have string keys
+            buckets=[[index, count] for index, count in self.buckets.items()],
+            zero_count=self.zero_count,
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+        )
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        :param state: State returned by `to_dict`
+        :rtype: DDSketch
+        """
+        sketch = cls(state['relative_accuracy'], state['max_buckets'])
+        sketch.buckets = {index: count for index, count in state['buckets']}
+        sketch.zero_count = state['zero_count']
+        sketch.count = state['count']
+        sketch.sum = state['sum']
+        sketch.min = state['min']
+        sketch.max = state['max']
+        return sketch
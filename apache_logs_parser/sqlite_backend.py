@@ -0,0 +1,303 @@
+# (c) 2021 Martin DENIZET
+# GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+SQLite backend: log entries are bulk loaded in an indexed `entries` table,
+and the stats of the built-in StatProducer are computed with SQL aggregates.
+"""
+
+import logging
+import os
+import sqlite3
+from itertools import islice
+
+from apache_logs_parser.ip import ip_to_int
+from apache_logs_parser.parser import parse_log_file, get_line_filters
+from apache_logs_parser.rollup import write_rollup, get_rollup_file_name
+from apache_logs_parser.sampling import write_sampling
+from apache_logs_parser.stats import create_stats_instances, feed_stats
+
+logger = logging.getLogger(__name__)
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+# Column name and type, in the order of the JSON entries
+COLUMNS = [
+    ('remote_ip', 'TEXT'),
+    ('time', 'TEXT'),
+    ('request', 'TEXT'),
+    ('response', 'INTEGER'),
+    ('bytes', 'INTEGER'),
+    ('referrer', 'TEXT'),
+    ('user_agent', 'TEXT'),
+    ('method', 'TEXT'),
+    ('url', 'TEXT'),
+    ('protocol', 'TEXT'),
+    ('extension', 'TEXT'),
+    ('path', 'TEXT'),
+    ('query', 'TEXT'),
+    ('is_mobile', 'INTEGER'),
+    ('is_bot', 'INTEGER'),
+    ('system_agent', 'TEXT'),
+    ('response_time_us', 'INTEGER'),
+    ('country', 'TEXT'),
+    ('asn', 'INTEGER'),
+    ('as_name', 'TEXT'),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+# Columns which are only in some entries, they are left out of the entries read when NULL
+OPTIONAL_COLUMNS = {'response_time_us', 'country', 'asn', 'as_name'}
+# Columns added by the GeoIP enricher, NULL in an enriched entry when the IP address is not in the GeoIP database
+GEOIP_COLUMNS = {'country', 'asn', 'as_name'}
+# Column set for the entries enriched with a GeoIP database, it is not a field of the entries.
+# Databases written by older versions do not have it.
+ENRICHED_COLUMN = 'enriched'
+BOOLEAN_COLUMNS = {'is_mobile', 'is_bot'}
+INDEXED_COLUMNS = ['time', 'response', 'path', 'remote_ip']
+
+TABLE_COLUMNS = COLUMNS + [(ENRICHED_COLUMN, 'INTEGER')]
+
+INSERT_SQL = f"INSERT INTO entries ({', '.join(name for name, _ in TABLE_COLUMNS)})" \
+             f" VALUES ({', '.join('?' * len(TABLE_COLUMNS))})"
+
+
+def is_sqlite_file(file_name):
+    """
+    :param file_name: Name of a file
+    :return: True if the file is a SQLite database
+    :rtype: bool
+    """
+    with open(file_name, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def create_schema(connection):
+    columns = ', '.join(f"{name} {column_type}" for name, column_type in TABLE_COLUMNS)
+    connection.execute(f"CREATE TABLE IF NOT EXISTS entries ({columns})")
+
+
+def has_enriched_column(connection):
+    """
+    :param connection: SQLite connection
+    :return: True if the entries table records which entries were enriched with a GeoIP database
+    :rtype: bool
+    """
+    return any(row[1] == ENRICHED_COLUMN for row in connection.execute("PRAGMA table_info(entries)"))
+
+
+def create_indexes(connection):
+    for column in INDEXED_COLUMNS:
+        connection.execute(f"CREATE INDEX IF NOT EXISTS entries_{column} ON entries ({column})")
+
+
+def insert_entries(connection, entries, batch_size=10000):
+    """
+    Bulk load log entries, in a single transaction
+    :param connection: SQLite connection
+    :param entries: Iterable of dicts extracted from apache logs
+    :param batch_size: Number of entries sent to SQLite at once
+    :return: Number of entries inserted
+    """
+    rows = (tuple(entry.get(name) for name in COLUMN_NAMES) + ('country' in entry,) for entry in entries)
+    inserted = 0
+    with connection:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            connection.executemany(INSERT_SQL, batch)
+            inserted += len(batch)
+    return inserted
+
+
+def write_sqlite_log(input_files, output_file, rollup=False, enrichers=None, rejects=None, sampler=None,
+                     line_filters=None):
+    """
+    Create a SQLite log database from a list of Apache log files name
+    :param input_files: List of input files name
+    :param output_file: File name of the SQLite database, replaced if it exists
+    :param rollup: Also write the rollup snapshot of all StatProducer next to the database
+    :param enrichers: List of functions adding fields to each parsed line
+    :param rejects: RejectedLines instance handling the lines that could not be parsed
+    :param sampler: Sampler keeping only a sample of the lines, its sampling is saved next to the database
+    :param line_filters: List of functions returning False for the lines to skip, like `dedup.Deduplicator.keep_line`
+    """
+    if type(input_files) in frozenset([str, bytes]):
+        input_files = [input_files]
+    stats_instances = create_stats_instances() if rollup else []
+    line_filters = get_line_filters(sampler, line_filters)
+    # Like the JSON files, the database only holds the entries of the input files
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    connection = sqlite3.connect(output_file)
+    try:
+        # The database can be rebuilt from the logs, durability is not needed while loading it
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        create_schema(connection)
+        for file in input_files:
+            data = parse_log_file(file, enrichers, rejects, line_filters)
+            insert_entries(connection, data)
+            feed_stats(stats_instances, data)
+        # Indexes are faster to build once the data is loaded
+        create_indexes(connection)
+        connection.commit()
+    finally:
+        connection.close()
+    logger.info(f"Wrote output to SQLite database {output_file}")
+    write_sampling(sampler, output_file)
+    if rollup:
+        write_rollup(stats_instances, get_rollup_file_name(output_file))
+
+
+def row_to_entry(row):
+    """
+    Convert a row of the entries table into a dict like the ones extracted from apache logs
+    :type row: sqlite3.Row
+    :rtype: dict
+    """
+    entry = dict()
+    names = row.keys()
+    # The GeoIP fields of an enriched entry are kept even when NULL, they count as 'Unknown' in the stats
+    enriched = ENRICHED_COLUMN in names and row[ENRICHED_COLUMN]
+    for name in names:
+        value = row[name]
+        if name == ENRICHED_COLUMN or (value is None and name in OPTIONAL_COLUMNS
+                                       and not (enriched and name in GEOIP_COLUMNS)):
+            continue
+        entry[name] = bool(value) if name in BOOLEAN_COLUMNS else value
+    return entry
+
+
+def iter_entries(connection, batch_size=10000, enrichers=None, columns=None):
+    """
+    :param enrichers: List of functions adding fields to each entry
+    :param columns: Names of the columns read, all by default
+    :return: Generator of the log entries of the database
+    """
+    columns = list(columns or COLUMN_NAMES)
+    if has_enriched_column(connection):
+        columns.append(ENRICHED_COLUMN)
+    cursor = connection.execute(f"SELECT {', '.join(columns)} FROM entries")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            entry = row_to_entry(row)
+            for enrich in enrichers or ():
+                enrich(entry)
+            yield entry
+
+
+def _state_count(connection):
+    hits, bot_hits, mobile_hits = connection.execute(
+        "SELECT COUNT(*), TOTAL(is_bot), TOTAL(is_mobile) FROM entries").fetchone()
+    return dict(hits=hits, bot_hits=int(bot_hits), mobile_hits=int(mobile_hits),
+                desktop_hits=hits - int(mobile_hits))
+
+
+def _state_response_count(connection):
+    return {str(response): hits for response, hits in connection.execute(
+        "SELECT response, COUNT(*) FROM entries GROUP BY response")}
+
+
+def _state_hit_per_system_agent(connection):
+    return dict(connection.execute("SELECT system_agent, COUNT(*) FROM entries GROUP BY system_agent").fetchall())
+
+
+def _state_page_issues(connection):
+    return dict(urls_per_response_code=[list(row) for row in connection.execute(
+        "SELECT response, url, COUNT(*) FROM entries WHERE response >= 400 GROUP BY response, url")])
+
+
+def _state_hit_per_page(connection):
+    return dict(connection.execute(
+        "SELECT path, COUNT(*) FROM entries WHERE extension IS NULL GROUP BY path").fetchall())
+
+
+def _state_per_extension(connection):
+    return dict(per_extension=[[extension, hits, int(size)] for extension, hits, size in connection.execute(
+        "SELECT extension, COUNT(*), TOTAL(bytes) FROM entries GROUP BY extension")])
+
+
+def _state_per_ip(connection):
+    return dict(per_ip=[[ip_to_int(ip), hits, int(size)] for ip, hits, size in connection.execute(
+        "SELECT remote_ip, COUNT(*), TOTAL(bytes) FROM entries GROUP BY remote_ip")])
+
+
+def _state_totals(connection):
+    total_size, total_hits = connection.execute("SELECT TOTAL(bytes), COUNT(*) FROM entries").fetchone()
+    pages_visited, = connection.execute(
+        "SELECT COUNT(*) FROM entries WHERE extension IS NULL OR extension = 'html'").fetchone()
+    different_visitors = [ip_to_int(ip) for ip, in connection.execute(
+        "SELECT DISTINCT remote_ip FROM entries WHERE extension IS NULL OR extension = 'html'")]
+    return dict(total_size=int(total_size), total_hits=total_hits,
+                different_visitors=different_visitors, pages_visited=pages_visited)
+
+
+def _enriched_condition(connection):
+    # Older databases do not record the enriched entries, only the ones found in the GeoIP database are known
+    return ENRICHED_COLUMN if has_enriched_column(connection) else "country IS NOT NULL OR asn IS NOT NULL"
+
+
+def _state_per_country(connection):
+    return {country or 'Unknown': dict(hits=hits, bytes=int(size)) for country, hits, size in connection.execute(
+        f"SELECT country, COUNT(*), TOTAL(bytes) FROM entries WHERE {_enriched_condition(connection)}"
+        " GROUP BY country")}
+
+
+def _state_per_asn(connection):
+    state = dict()
+    for asn, as_name, hits, size in connection.execute(
+            f"SELECT asn, as_name, COUNT(*), TOTAL(bytes) FROM entries WHERE {_enriched_condition(connection)}"
+            " GROUP BY asn, as_name"):
+        key = f"AS{asn} {as_name or ''}".strip() if asn is not None else 'Unknown'
+        state.setdefault(key, dict(hits=0, bytes=0))
+        state[key]['hits'] += hits
+        state[key]['bytes'] += int(size)
+    return state
+
+
+# Functions computing the state of StatProducer, as returned by their `get_state` method, with SQL aggregates
+SQL_STATES = {
+    'StatCount': _state_count,
+    'ResponseCount': _state_response_count,
+    'StatHitPerSystemAgent': _state_hit_per_system_agent,
+    'StatPageIssues': _state_page_issues,
+    'StatHitPerPage': _state_hit_per_page,
+    'StatPerExtension': _state_per_extension,
+    'StatPerIp': _state_per_ip,
+    'StatPerSubnet': _state_per_ip,
+    'StatPerCountry': _state_per_country,
+    'StatPerAsn': _state_per_asn,
+    'StatTotals': _state_totals,
+}
+
+
+def merge_sqlite_stats(stats_instances, file_name, enrichers=None, entry_filter=None):
+    """
+    Compute the stats of a SQLite log database.
+    The state of the producers known by `SQL_STATES` is computed by SQLite, the entries are read for the others.
+    :param stats_instances: List of StatProducer subclasses instances
+    :param file_name: SQLite database file name
+    :param enrichers: List of functions adding fields to each entry, if set all the entries are read
+    :param entry_filter: Function returning False for the entries to skip, like `sampling.Sampler.keep_entry`,
+    if set all the entries are read
+    """
+    connection = sqlite3.connect(file_name)
+    connection.row_factory = sqlite3.Row
+    try:
+        scanned = []
+        for stat in stats_instances:
+            if stat.name in SQL_STATES and not enrichers and entry_filter is None:
+                stat.merge_state(SQL_STATES[stat.name](connection))
+            else:
+                scanned.append(stat)
+        if scanned:
+            entries = iter_entries(connection, enrichers=enrichers)
+            if entry_filter is not None:
+                entries = filter(entry_filter, entries)
+            feed_stats(scanned, entries)
+    finally:
+        connection.close()
+    logger.info(f"Read stats from SQLite database {file_name}")
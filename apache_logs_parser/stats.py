@@ -3,83 +3,189 @@
 
 import json
 import logging
+from itertools import chain, islice
 
+from apache_logs_parser.dedup import start_file
+from apache_logs_parser.external import materialize
+from apache_logs_parser.rollup import merge_rollup
+from apache_logs_parser.sampling import get_sampling
+from apache_logs_parser.serializers import AUTO, get_serializer, write_json_object
 from apache_logs_parser.stats_producers import get_stats_classes
 
 logger = logging.getLogger(__name__)
 
+# Number of entries given at once to the `process_batch` method of the producers
+BATCH_SIZE = 4096
 
-def get_stats(data, stats_classes=None):
+
+def get_stats(data, stats_classes=None, options=None):
     """
     Create StatProducer instances from StatProducer classes and
     produce statistics from the data in argument.
     :param data: List of dicts extracted from apache logs
     :param stats_classes: List of stats_instances classes to use to produce stats_instances on the data.
     if left empty, all classes will be used
+    :param options: Dictionary of options given to all the StatProducer instances
     :return: dictionary of statistics
     :rtype: dict
     """
+    return feed_stats(create_stats_instances(stats_classes, options), data)
+
+
+def create_stats_instances(stats_classes=None, options=None):
+    """
+    Instanciate StatProducer classes
+    :param stats_classes: List of StatProducer subclasses, if left empty, all classes will be used
+    :param options: Dictionary of options given to all the StatProducer instances
+    :return: A list of StatProducer instances
+    """
     if stats_classes is None:
         stats_classes = get_stats_classes()
+    return [c(**(options or {})) for c in stats_classes]
 
-    # Instanciate all classes
-    stats_instances = [c() for c in stats_classes]
-    # For each entry in the data log
-    for data_entry in data:
-        if not data_entry:
-            # Log line was not parsed correctly
-            continue
+
+def feed_stats(stats_instances, data):
+    """
+    Produce statistics from the data in argument with existing StatProducer instances.
+    Entries are given to the producers in batches of `BATCH_SIZE` entries.
+    :param stats_instances: List of StatProducer instances
+    :param data: Iterable of dicts extracted from apache logs
+    :return: The StatProducer instances
+    """
+    data = iter(data)
+    while True:
+        chunk = list(islice(data, BATCH_SIZE))
+        if not chunk:
+            break
+        # Log lines which were not parsed correctly are skipped
+        batch = [data_entry for data_entry in chunk if data_entry]
         # Generate stats for all StatProducer instances
         for stat in stats_instances:
-            stat.process_entry(data_entry)
+            stat.process_batch(batch)
 
     return stats_instances
 
 
-def generate_stats(input_files, stats_classes=None):
+def combine_filters(filters):
+    """
+    :param filters: List of functions returning False for the entries to skip
+    :return: A function returning False if one of the filters does, None if there are no filters
+    """
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return lambda data_entry: all(keep(data_entry) for keep in filters)
+
+
+def generate_stats(input_files, stats_classes=None, use_rollups=False, options=None, enrichers=None, sampler=None,
+                   entry_filters=None):
     """
-    Read log data from JSON files and compute the statistics from the data.
-    :param input_files: List of JSON file names
+    Read log data from JSON files, or SQLite databases, and compute the statistics from the data.
+    :param input_files: List of JSON or SQLite file names
     :param stats_classes: List of StatProducer subclasses to instanciate to produce stats or None,
     if set to None, it all StatProducer subclasses will be used
+    :param use_rollups: Merge the rollup snapshots of the JSON files when available instead of reading the entries
+    :param options: Dictionary of options given to all the StatProducer instances
+    :param enrichers: List of functions adding fields to each entry, rollup snapshots are not used
+    when entries must be enriched
+    :param sampler: Sampler keeping only a sample of the entries, rollup snapshots are not used when set.
+    The metrics of the producers are scaled according to the sampling of the entries, see `sampling.get_sampling`
+    :param entry_filters: List of functions returning False for the entries to skip, like
+    `dedup.Deduplicator.keep_entry`, rollup snapshots are not used when set
     :return: A list of StatProducer with data computed
+    :raise ValueError: If the files were sampled differently
     """
+    # Imported here as the SQLite backend uses this module
+    from apache_logs_parser.sqlite_backend import is_sqlite_file, merge_sqlite_stats
+
     if type(input_files) in frozenset([str, bytes]):
         input_files = [input_files]
-    data = []
+    options = dict(options or {})
+    sampling = get_sampling(input_files, sampler)
+    if sampling is not None:
+        options.update(scale=1 / sampling['rate'], sample_key=sampling['key'])
+    stats_instances = create_stats_instances(stats_classes, options)
+    entry_filter = combine_filters(([sampler.keep_entry] if sampler is not None else []) + list(entry_filters or ()))
     for file in input_files:
+        if use_rollups and not enrichers and entry_filter is None and merge_rollup(stats_instances, file):
+            continue
+        start_file(entry_filters, file)
+        if is_sqlite_file(file):
+            merge_sqlite_stats(stats_instances, file, enrichers, entry_filter)
+            continue
         with open(file, 'r') as f:
-            data = data + json.load(f)
-    return get_stats(data, stats_classes)
+            data = json.load(f)
+        if entry_filter is not None:
+            data = [data_entry for data_entry in data if entry_filter(data_entry)]
+        for enrich in enrichers or ():
+            for data_entry in data:
+                enrich(data_entry)
+        feed_stats(stats_instances, data)
+    return stats_instances
 
 
 def generate_json_stats(stats_instances):
     """
     Generate a dictionary of statistics from StatProducers subclasses instances.
     This presumes that the instances have been fed data.
+    The metrics generated lazily by the producers are converted into dictionaries, see `write_json_stats` to stream
+    them instead.
     """
     stats = dict()
     for stat in stats_instances:
-        stats.update(stat.get_metrics())
+        stats.update(materialize(stat.get_metrics()))
     return stats
 
 
-def display_stats(stats_instances):
+def display_stats(stats_instances, top=None, output=None):
+    """
+    Print the statistics of StatProducer instances
+    :param stats_instances: List of StatProducer subclasses instances. Data must have been fed in the instances.
+    :param top: Maximum number of entries to display per chart or list, None for the producers default
+    :param output: Text stream written to, the standard output by default
+    """
     for stat in stats_instances:
-        stat.display()
+        stat.display(top=top, output=output)
 
 
-def write_json_stats(stats_instances, stats_json_file_name):
+def iter_metrics(stats_instances):
+    """
+    Iterate over the metrics of StatProducer instances, one producer at a time.
+    Like `generate_json_stats`, when several producers use the same metric name, the last one is kept.
+    The metrics of each producer are computed once, their large values are lazy and generated while they are written.
+    :param stats_instances: List of StatProducer subclasses instances. Data must have been fed in the instances.
+    :return: Generator of (metric name, value) pairs
+    """
+    all_metrics = [stat.get_metrics() for stat in stats_instances]
+    # Find the producer providing the last value of each metric name
+    owners = dict()
+    for index, metrics in enumerate(all_metrics):
+        for key in metrics.keys():
+            owners[key] = index
+    for index, metrics in enumerate(all_metrics):
+        for key, value in metrics.items():
+            if owners[key] == index:
+                yield key, value
+
+
+def write_json_stats(stats_instances, stats_json_file_name, compact=False, serializer=AUTO, sampling=None):
     """
     Write stats to JSON file for processing by a 3rd party software like a BI solution.
+    The metrics are streamed to the file instead of being merged in a single dictionary first.
     :param stats_instances: List of StatProducer subclasses instances. Data must have been fed in the instances.
     :param stats_json_file_name: Name of the file to write to
+    :param compact: Write the JSON without indentation and spaces
+    :param serializer: Name of the JSON serializer to use, see `serializers.get_serializer`
+    :param sampling: Description of the sampling of the entries, see `sampling.sampling_metrics`,
+    written as the `sampling` member
     """
-    output_data = dict()
-    for stat in stats_instances:
-        output_data.update(stat.get_metrics())
-    with open(stats_json_file_name, 'w') as stats_json_file:
-        json.dump(
-            output_data,
-            stats_json_file, indent=4)
+    members = iter_metrics(stats_instances)
+    if sampling is not None:
+        members = chain(members, [('sampling', sampling)])
+    with open(stats_json_file_name, 'wb') as stats_json_file:
+        write_json_object(
+            members,
+            stats_json_file,
+            get_serializer(serializer, compact=compact))
         logger.info(f"Wrote stats_instances to file {stats_json_file_name}")
@@ -1,24 +1,86 @@
 # (c) 2021 Martin DENIZET
 # GNU General Public License v3.0 (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
-import http.client
-from collections import defaultdict
-
-from apache_logs_parser.colors import header, Colors
-from apache_logs_parser.display import Graph, TopList, size_format
+import logging
+from collections import defaultdict, Counter, deque
+from functools import lru_cache
+from operator import itemgetter
+
+from apache_logs_parser.anomaly import AnomalyDetector, DIMENSIONS, write_alert
+from apache_logs_parser.colors import format_header, Colors
+from apache_logs_parser.external import LazyMapping, LazySequence, SpillableCounter
+from apache_logs_parser.display import Graph, TopList, size_format, select_top, write_lines
+from apache_logs_parser.ip import ip_to_int, int_to_ip, is_ipv4, network_of, network_to_str, parse_network, \
+    PrefixTrie, IPV4_MAPPED_PREFIX_LENGTH
+from apache_logs_parser.sampling import IP_KEY
+from apache_logs_parser.sketch import DDSketch
+
+logger = logging.getLogger(__name__)
+
+# Entry point group of the StatProducer subclasses provided by other packages
+PLUGINS_ENTRY_POINT_GROUP = 'apache_logs_parser.stat_producers'
+# Percentiles of the response times
+PERCENTILES = (50, 95, 99)
+# Response codes below that are counted in an array during a batch
+STATUS_CODES = 1000
+# Number of alerts kept in the metrics of the anomalies
+RECENT_ALERTS = 100
+
+
+def scale_counts(value, scale):
+    """
+    Estimate counts of all the entries from counts of a sample of the entries
+    :param value: Count, or dictionary of counts possibly nested, other values are kept as is
+    :param scale: Inverse of the sample rate
+    :return: A copy of the value with the counts multiplied by the scale
+    """
+    if scale == 1:
+        return value
+    if isinstance(value, LazyMapping):
+        return LazyMapping(lambda: ((k, scale_counts(v, scale)) for k, v in value.items()))
+    if isinstance(value, dict):
+        return {k: scale_counts(v, scale) for k, v in value.items()}
+    if isinstance(value, int) and not isinstance(value, bool):
+        return round(value * scale)
+    return value
 
 
 class StatProducer(object):
     """
     Base class for classes producing statistics.
     """
+    # False for the producers the `stats` command only computes when they are selected, see
+    # `get_default_stats_classes`
+    default = True
 
     @property
     def name(self):
         return self.__class__.__name__
 
-    def __init__(self):
+    def __init__(self, **options):
+        """
+        :param options: Options of the producers, see the `set_up` method of each producer for the options it uses.
+        Unknown options are ignored so the same options can be given to all the producers.
+        """
+        self.options = options
+        # More than 1 when the entries are a sample, see sampling.py, counts are scaled in the metrics and displays
+        self.scale = options.get('scale') or 1
         self.set_up()
 
+    def new_counter(self, width=1):
+        """
+        Counter for keys which can be too many to fit in memory, limited by the `memory_limit` option
+        :param width: Number of counts per key
+        :rtype: SpillableCounter
+        """
+        return SpillableCounter(width, self.options.get('memory_limit'))
+
+    def scaled(self, value):
+        """
+        :param value: Count, or dictionary of counts, of the entries fed to the producer
+        :return: Estimate of the count, or counts, of all the entries if they are a sample
+        """
+        return scale_counts(value, self.scale)
+
     def set_up(self):
         """
         Initialize the producer, variables can be declarer
@@ -32,6 +94,17 @@ class StatProducer(object):
         """
         raise NotImplementedError()
 
+    def process_batch(self, data_entries):
+        """
+        Process several entries, the engine calls it with batches of thousands of entries.
+        It calls `process_entry` for each entry, producers can override it to aggregate a batch at once.
+        :param data_entries: List of Apache log lines as dicts
+        :type data_entries: list[dict]
+        """
+        process_entry = self.process_entry
+        for data_entry in data_entries:
+            process_entry(data_entry)
+
     def get_metrics(self):
         """
         Returns as a dict the statistics produced
@@ -39,9 +112,66 @@ class StatProducer(object):
         """
         raise NotImplementedError()
 
-    def display(self):
+    def get_state(self):
+        """
+        Returns the aggregated state of the producer so it can be saved in a rollup snapshot.
+        The state must be JSON serializable and accepted by `merge_state`
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    def merge_state(self, state):
+        """
+        Add an aggregated state, as returned by `get_state`, to the state of the producer
+        :param state: State returned by `get_state`, possibly by another instance
+        :type state: dict
+        """
         raise NotImplementedError()
 
+    def display(self, top=None, output=None):
+        """
+        Print the statistics produced
+        :param top: Maximum number of entries to display per chart or list, None for the producer default
+        :type top: int|None
+        :param output: Text stream written to, the standard output by default
+        """
+        raise NotImplementedError()
+
+
+def _ip_key(data_entry):
+    return ip_to_int(data_entry['remote_ip'])
+
+
+def _hits_and_bytes(data_entries, get_key):
+    """
+    Aggregate a batch of entries by key
+    :param data_entries: List of Apache log lines as dicts
+    :param get_key: Function returning the key of an entry
+    :return: Items of (key, [hits, bytes])
+    """
+    keys = list(map(get_key, data_entries))
+    hits = Counter(keys)
+    sizes = defaultdict(int)
+    for key, size in zip(keys, map(itemgetter('bytes'), data_entries)):
+        sizes[key] += size
+    return ((key, (count, sizes[key])) for key, count in hits.items())
+
+
+def _asn_key(data_entry):
+    asn = data_entry['asn']
+    return f"AS{asn} {data_entry.get('as_name') or ''}".strip() if asn is not None else 'Unknown'
+
+
+def _response_times(data_entries, get_key):
+    """
+    Count the response times of a batch of entries by key, they are integers and repeat a lot
+    :param data_entries: List of Apache log lines as dicts
+    :param get_key: Function returning the key of an entry
+    :return: Items of ((key, response time), count), for the entries with a response time
+    """
+    return Counter((get_key(data_entry), data_entry['response_time_us']) for data_entry in data_entries
+                   if data_entry.get('response_time_us') is not None).items()
+
 
 class StatCount(StatProducer):
     """
@@ -65,11 +195,28 @@ class StatCount(StatProducer):
         if not data_entry['is_mobile']:
             self.counts['desktop_hits'] += 1
 
+    def process_batch(self, data_entries):
+        hits = len(data_entries)
+        mobile_hits = sum(map(itemgetter('is_mobile'), data_entries))
+        counts = self.counts
+        counts['hits'] += hits
+        counts['bot_hits'] += sum(map(itemgetter('is_bot'), data_entries))
+        counts['mobile_hits'] += mobile_hits
+        counts['desktop_hits'] += hits - mobile_hits
+
     def get_metrics(self):
-        return self.counts
+        return self.scaled(self.counts)
+
+    def get_state(self):
+        return dict(self.counts)
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.counts[k] += v
 
-    def display(self):
-        Graph.display(self.counts, 'Hit types', show_percents=False)
+    def display(self, top=None, output=None):
+        Graph.display(self.scaled(self.counts), 'Hit types', show_percents=False, top=top or Graph.DEFAULT_TOP,
+                      output=output)
 
 
 class ResponseCount(StatProducer):
@@ -83,13 +230,32 @@ class ResponseCount(StatProducer):
     def process_entry(self, data_entry):
         self.response_code[str(data_entry['response'])] += 1
 
+    def process_batch(self, data_entries):
+        counts = [0] * STATUS_CODES
+        response_code = self.response_code
+        for response in map(itemgetter('response'), data_entries):
+            if 0 <= response < STATUS_CODES:
+                counts[response] += 1
+            else:
+                response_code[str(response)] += 1
+        for response, hits in enumerate(counts):
+            if hits:
+                response_code[str(response)] += hits
+
     def get_metrics(self):
         return dict(
-            responde_codes=self.response_code
+            responde_codes=self.scaled(self.response_code)
         )
 
-    def display(self):
-        Graph.display(self.response_code, 'Response codes')
+    def get_state(self):
+        return dict(self.response_code)
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.response_code[k] += v
+
+    def display(self, top=None, output=None):
+        Graph.display(self.scaled(self.response_code), 'Response codes', top=top or Graph.DEFAULT_TOP, output=output)
 
 
 class StatHitPerSystemAgent(StatProducer):
@@ -98,51 +264,97 @@ class StatHitPerSystemAgent(StatProducer):
     """
 
     def set_up(self):
-        # Dictionary with a default value of 0 for each new key
-        self.hits_per_system_agent = defaultdict(lambda: 0)
+        self.hits_per_system_agent = Counter()
 
     def process_entry(self, data_entry):
         self.hits_per_system_agent[data_entry['system_agent']] += 1
 
+    def process_batch(self, data_entries):
+        self.hits_per_system_agent.update(map(itemgetter('system_agent'), data_entries))
+
     def get_metrics(self):
         return dict(
-            hits_per_page=self.hits_per_system_agent
+            hits_per_page=self.scaled(self.hits_per_system_agent)
         )
 
-    def display(self):
-        Graph.display(self.hits_per_system_agent, "Hits per OS")
+    def get_state(self):
+        return dict(self.hits_per_system_agent)
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.hits_per_system_agent[k] += v
+
+    def display(self, top=None, output=None):
+        Graph.display(self.scaled(self.hits_per_system_agent), "Hits per OS", top=top or Graph.DEFAULT_TOP,
+                      output=output)
 
 
 class StatPageIssues(StatProducer):
     """
     identifies URLs with response codes >= 400
     """
+    # Number of URLs displayed per response code when no limit is requested
+    DEFAULT_TOP = 20
 
     def set_up(self):
-        self.urls_per_response_code = defaultdict(lambda: defaultdict(lambda: 0))
+        # Hits per URL, for each response code
+        self.urls_per_response_code = defaultdict(self.new_counter)
 
     def process_entry(self, data_entry):
         response = data_entry['response']
         if response >= 400:
-            self.urls_per_response_code[response][data_entry['url']] += 1
+            self.urls_per_response_code[response].add(data_entry['url'], 1)
+
+    def process_batch(self, data_entries):
+        hits = Counter((data_entry['response'], data_entry['url'])
+                       for data_entry in data_entries if data_entry['response'] >= 400)
+        urls_per_response_code = self.urls_per_response_code
+        for (response, url), count in hits.items():
+            urls_per_response_code[response].add(url, count)
+
+    def get_hits_per_url(self, response):
+        urls = self.urls_per_response_code[response]
+        return self.scaled(LazyMapping(lambda: ((url, hits) for url, (hits,) in urls.items())))
 
     def get_metrics(self):
         return dict(
-            hits_per_page=self.urls_per_response_code
+            hits_per_page={response: self.get_hits_per_url(response) for response in self.urls_per_response_code}
+        )
+
+    def get_state(self):
+        # JSON objects only have string keys, we keep the response codes as integers using a list
+        return dict(
+            urls_per_response_code=[[response, url, hits]
+                                    for response, urls in self.urls_per_response_code.items()
+                                    for url, (hits,) in urls.items()]
         )
 
-    def display(self):
-        header("Pages giving response codes >= 400")
+    def merge_state(self, state):
+        for response, url, hits in state['urls_per_response_code']:
+            self.urls_per_response_code[response].add(url, hits)
+
+    def display(self, top=None, output=None):
+        # Imported here as it is only needed for the names of the response codes
+        import http.client
+
+        top = top or self.DEFAULT_TOP
+        lines = [format_header("Pages giving response codes >= 400")]
 
-        self.urls_per_response_code = dict(sorted(self.urls_per_response_code.items(), key=lambda x: x[0]))
-        for k, v in self.urls_per_response_code.items():
+        for k in sorted(self.urls_per_response_code):
+            v = self.get_hits_per_url(k)
             response_string = http.client.responses.get(k, 'Unknown')
-            print(
+            total, urls = 0, 0
+            for hits in v.values():
+                total += hits
+                urls += 1
+            lines.append(
                 f"    {Colors.UNDERLINE + Colors.OKCYAN}Responde code {k} \"{response_string}\","
-                f" total: {sum(v.values())}{Colors.ENDC}")
-            v = dict(sorted(v.items(), key=lambda x: x[1], reverse=True))
-            for url, counts in v.items():
-                print(f"        {Colors.OKGREEN}{counts} hits{Colors.ENDC}: {url}")
+                f" total: {total}{Colors.ENDC}")
+            for url, counts in select_top(v, top):
+                lines.append(f"        {Colors.OKGREEN}{counts} hits{Colors.ENDC}: {url}")
+            if urls > top:
+                lines.append(f"        ... {urls - top} more URLs")
+        write_lines(lines, output)
 
 
 class StatHitPerPage(StatProducer):
@@ -151,20 +363,33 @@ class StatHitPerPage(StatProducer):
     """
 
     def set_up(self):
-        # Dictionary with a default value of 0 for each new key
-        self.hits_per_page = defaultdict(lambda: 0)
+        self.hits_per_page = self.new_counter()
 
     def process_entry(self, data_entry):
         if data_entry['extension'] is None:
-            self.hits_per_page[data_entry['path']] += 1
+            self.hits_per_page.add(data_entry['path'], 1)
+
+    def process_batch(self, data_entries):
+        hits = Counter(data_entry['path'] for data_entry in data_entries if data_entry['extension'] is None)
+        self.hits_per_page.update((path, (count,)) for path, count in hits.items())
+
+    def get_hits_per_page(self):
+        return self.scaled(LazyMapping(lambda: ((path, hits) for path, (hits,) in self.hits_per_page.items())))
 
     def get_metrics(self):
         return dict(
-            hits_per_page=self.hits_per_page
+            hits_per_page=self.get_hits_per_page()
         )
 
-    def display(self):
-        TopList.display(self.hits_per_page, "Most visited pages")
+    def get_state(self):
+        return {path: hits for path, (hits,) in self.hits_per_page.items()}
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.hits_per_page.add(k, v)
+
+    def display(self, top=None, output=None):
+        TopList.display(self.get_hits_per_page(), "Most visited pages", top=top or TopList.DEFAULT_TOP, output=output)
 
 
 class StatPerExtension(StatProducer):
@@ -173,20 +398,36 @@ class StatPerExtension(StatProducer):
     """
 
     def set_up(self):
-        self.per_extension = defaultdict(lambda: defaultdict(lambda: 0))
+        # Hits and bytes per extension
+        self.per_extension = self.new_counter(2)
 
     def process_entry(self, data_entry):
-        self.per_extension[data_entry['extension']]['bytes'] += data_entry['bytes']
-        self.per_extension[data_entry['extension']]['hits'] += 1
+        self.per_extension.add(data_entry['extension'], 1, data_entry['bytes'])
+
+    def process_batch(self, data_entries):
+        self.per_extension.update(_hits_and_bytes(data_entries, itemgetter('extension')))
 
     def get_metrics(self):
         return dict(
-            per_extension=self.per_extension
+            per_extension=self.scaled(LazyMapping(lambda: (
+                (extension, dict(bytes=size, hits=hits)) for extension, (hits, size) in self.per_extension.items())))
         )
 
-    def display(self):
-        size_by_extension = {k: v['bytes'] for k, v in self.per_extension.items()}
-        TopList.display(size_by_extension, "Traffic size by extension", unit='bytes')
+    def get_state(self):
+        # Extension can be None, which can't be a JSON key
+        return dict(
+            per_extension=[[extension, hits, size] for extension, (hits, size) in self.per_extension.items()]
+        )
+
+    def merge_state(self, state):
+        for extension, hits, size in state['per_extension']:
+            self.per_extension.add(extension, hits, size)
+
+    def display(self, top=None, output=None):
+        size_by_extension = self.scaled(LazyMapping(lambda: (
+            (extension, size) for extension, (_, size) in self.per_extension.items())))
+        TopList.display(size_by_extension, "Traffic size by extension", unit='bytes', top=top or TopList.DEFAULT_TOP,
+                        output=output)
 
 
 class StatPerIp(StatProducer):
@@ -195,21 +436,315 @@ class StatPerIp(StatProducer):
     """
 
     def set_up(self):
-        # Create a dictionary of dictionaries containing integers
-        self.per_ip = defaultdict(lambda: defaultdict(lambda: 0))
+        # Hits and bytes per IP address, stored as an integer, see ip.ip_to_int
+        self.per_ip = self.new_counter(2)
+        if self.options.get('sample_key') == IP_KEY:
+            # All the entries of the IPs in the sample are kept, their counts are exact
+            self.scale = 1
+
+    def process_entry(self, data_entry):
+        self.per_ip.add(ip_to_int(data_entry['remote_ip']), 1, data_entry['bytes'])
+
+    def process_batch(self, data_entries):
+        self.per_ip.update(_hits_and_bytes(data_entries, _ip_key))
+
+    def get_metrics(self):
+        return dict(
+            per_ip=self.scaled(LazyMapping(lambda: (
+                (int_to_ip(ip), dict(bytes=size, hits=hits)) for ip, (hits, size) in self.per_ip.items())))
+        )
+
+    def get_state(self):
+        return dict(
+            per_ip=[[ip, hits, size] for ip, (hits, size) in self.per_ip.items()]
+        )
+
+    def merge_state(self, state):
+        for ip, hits, size in state['per_ip']:
+            self.per_ip.add(ip, hits, size)
+
+    def display(self, top=None, output=None):
+        size_per_ip = LazyMapping(lambda: ((ip, size) for ip, (_, size) in self.per_ip.items()))
+        TopList.display(self.scaled(size_per_ip), "Traffic size by IP", unit='bytes', top=top or TopList.DEFAULT_TOP,
+                        key_format=int_to_ip, output=output)
+
+
+class StatPerSubnet(StatProducer):
+    """
+    Count number of hits and total byte size by subnet.
+    Addresses are grouped by prefix length, 24 bits for IPv4 and 48 bits for IPv6 by default, and by the networks
+    provided in the `subnets` option.
+    """
+    DEFAULT_IPV4_PREFIXES = (24,)
+    DEFAULT_IPV6_PREFIXES = (48,)
+
+    def set_up(self):
+        self.ipv4_prefixes = self.options.get('subnet_prefixes') or self.DEFAULT_IPV4_PREFIXES
+        self.ipv6_prefixes = self.options.get('subnet_prefixes_v6') or self.DEFAULT_IPV6_PREFIXES
+        self.subnets = self.options.get('subnets') or []
+        self.networks = PrefixTrie()
+        for cidr in self.subnets:
+            network, prefix_length = parse_network(cidr)
+            self.networks.insert(network, prefix_length, network_to_str(network, prefix_length))
+        # Counting per IP is cheap, traffic is rolled up by subnet when the metrics are requested.
+        # Hits and bytes per IP address, stored as an integer, see ip.ip_to_int
+        self.per_ip = self.new_counter(2)
+
+    def process_entry(self, data_entry):
+        self.per_ip.add(ip_to_int(data_entry['remote_ip']), 1, data_entry['bytes'])
+
+    def process_batch(self, data_entries):
+        self.per_ip.update(_hits_and_bytes(data_entries, _ip_key))
+
+    def get_per_subnet(self):
+        """
+        Roll up the traffic by subnet
+        :return: Dictionary of {"hits": int, "bytes": int} by group name then by subnet in the CIDR notation
+        :rtype: dict[str,LazyMapping]
+        """
+        # Subnets can be as many as the IPs with long prefixes, they are counted like the IPs
+        groups = defaultdict(lambda: self.new_counter(2))
+        for ip, (hits, size) in self.per_ip.items():
+            if is_ipv4(ip):
+                prefixes = [(f"/{p}", IPV4_MAPPED_PREFIX_LENGTH + p) for p in self.ipv4_prefixes]
+            else:
+                prefixes = [(f"/{p} IPv6", p) for p in self.ipv6_prefixes]
+            keys = [(group, network_to_str(network_of(ip, length), length)) for group, length in prefixes]
+            network = self.networks.longest_match(ip)
+            if network is not None:
+                keys.append(('networks', network))
+            for group, key in keys:
+                groups[group].add(key, hits, size)
+        return self.scaled({group: LazyMapping(lambda subnets=subnets: (
+            (subnet, dict(hits=hits, bytes=size)) for subnet, (hits, size) in subnets.items()))
+            for group, subnets in groups.items()})
+
+    def get_metrics(self):
+        return dict(
+            per_subnet=self.get_per_subnet()
+        )
+
+    def get_state(self):
+        return dict(
+            per_ip=[[ip, hits, size] for ip, (hits, size) in self.per_ip.items()]
+        )
+
+    def merge_state(self, state):
+        for ip, hits, size in state['per_ip']:
+            self.per_ip.add(ip, hits, size)
+
+    def display(self, top=None, output=None):
+        for group, subnets in self.get_per_subnet().items():
+            hits_per_subnet = LazyMapping(lambda subnets=subnets: ((k, v['hits']) for k, v in subnets.items()))
+            TopList.display(hits_per_subnet, f"Hits per subnet {group}", top=top or TopList.DEFAULT_TOP, output=output)
+
+
+class StatPerCountry(StatProducer):
+    """
+    Count number of hits and total byte size by country, for entries enriched with a GeoIP database
+    """
+
+    def set_up(self):
+        self.per_country = defaultdict(lambda: dict(hits=0, bytes=0))
+
+    def process_entry(self, data_entry):
+        if 'country' not in data_entry:
+            # Entry was not enriched
+            return
+        country = self.per_country[data_entry['country'] or 'Unknown']
+        country['bytes'] += data_entry['bytes']
+        country['hits'] += 1
+
+    def process_batch(self, data_entries):
+        enriched = [data_entry for data_entry in data_entries if 'country' in data_entry]
+        per_country = self.per_country
+        for key, (hits, size) in _hits_and_bytes(enriched, lambda data_entry: data_entry['country'] or 'Unknown'):
+            per_country[key]['bytes'] += size
+            per_country[key]['hits'] += hits
+
+    def get_metrics(self):
+        return dict(
+            per_country=self.scaled(self.per_country)
+        )
+
+    def get_state(self):
+        return {k: dict(v) for k, v in self.per_country.items()}
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.per_country[k]['bytes'] += v['bytes']
+            self.per_country[k]['hits'] += v['hits']
+
+    def display(self, top=None, output=None):
+        hits_per_country = {k: self.scaled(v['hits']) for k, v in self.per_country.items()}
+        Graph.display(hits_per_country, "Hits per country", top=top or TopList.DEFAULT_TOP, output=output)
+
+
+class StatPerAsn(StatProducer):
+    """
+    Count number of hits and total byte size by autonomous system, for entries enriched with a GeoIP database
+    """
+
+    def set_up(self):
+        self.per_asn = defaultdict(lambda: dict(hits=0, bytes=0))
 
     def process_entry(self, data_entry):
-        self.per_ip[data_entry['remote_ip']]['bytes'] += data_entry['bytes']
-        self.per_ip[data_entry['remote_ip']]['hits'] += 1
+        if 'asn' not in data_entry:
+            # Entry was not enriched
+            return
+        per_asn = self.per_asn[_asn_key(data_entry)]
+        per_asn['bytes'] += data_entry['bytes']
+        per_asn['hits'] += 1
+
+    def process_batch(self, data_entries):
+        enriched = [data_entry for data_entry in data_entries if 'asn' in data_entry]
+        per_asn = self.per_asn
+        for key, (hits, size) in _hits_and_bytes(enriched, _asn_key):
+            per_asn[key]['bytes'] += size
+            per_asn[key]['hits'] += hits
 
     def get_metrics(self):
         return dict(
-            per_ip=self.per_ip
+            per_asn=self.scaled(self.per_asn)
         )
 
-    def display(self):
-        size_by_extension = {k: v['bytes'] for k, v in self.per_ip.items()}
-        TopList.display(size_by_extension, "Traffic size by IP", unit='bytes')
+    def get_state(self):
+        return {k: dict(v) for k, v in self.per_asn.items()}
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.per_asn[k]['bytes'] += v['bytes']
+            self.per_asn[k]['hits'] += v['hits']
+
+    def display(self, top=None, output=None):
+        size_per_asn = {k: self.scaled(v['bytes']) for k, v in self.per_asn.items()}
+        TopList.display(size_per_asn, "Traffic size by autonomous system", unit='bytes',
+                        top=top or TopList.DEFAULT_TOP, output=output)
+
+
+def latency_metrics(sketch, scale=1):
+    """
+    Summary of a response time distribution
+    :type sketch: DDSketch
+    :param scale: Inverse of the sample rate of the response times, the distribution itself is not scaled
+    :return: Count, mean, min, max and percentiles of the response times in microseconds
+    :rtype: dict
+    """
+    metrics = dict(count=scale_counts(sketch.count, scale), mean=sketch.mean, min=sketch.min, max=sketch.max)
+    for percentile in PERCENTILES:
+        metrics[f"p{percentile}"] = sketch.quantile(percentile / 100)
+    return metrics
+
+
+def format_duration(microseconds):
+    if microseconds is None:
+        return "-"
+    return f"{microseconds / 1000:.1f}ms"
+
+
+class StatLatency(StatProducer):
+    """
+    Response time percentiles, for logs with the time taken to serve the requests
+    """
+
+    def set_up(self):
+        self.sketch = DDSketch()
+
+    def process_entry(self, data_entry):
+        response_time = data_entry.get('response_time_us')
+        if response_time is not None:
+            self.sketch.add(response_time)
+
+    def process_batch(self, data_entries):
+        for (_, response_time), count in _response_times(data_entries, lambda data_entry: None):
+            self.sketch.add(response_time, count)
+
+    def get_metrics(self):
+        return dict(
+            latency_us=latency_metrics(self.sketch, self.scale)
+        )
+
+    def get_state(self):
+        return self.sketch.to_dict()
+
+    def merge_state(self, state):
+        self.sketch.merge(DDSketch.from_dict(state))
+
+    def display(self, top=None, output=None):
+        metrics = latency_metrics(self.sketch, self.scale)
+        write_lines([format_header("Response times")] + [
+            f"    {k}: {format_duration(v) if k != 'count' else v}" for k, v in metrics.items()
+        ], output)
+
+
+class StatLatencyPerStatusClass(StatProducer):
+    """
+    Response time percentiles by class of response code: 2xx, 3xx...
+    """
+
+    def set_up(self):
+        self.sketches = defaultdict(DDSketch)
+
+    def process_entry(self, data_entry):
+        response_time = data_entry.get('response_time_us')
+        if response_time is not None:
+            self.sketches[f"{data_entry['response'] // 100}xx"].add(response_time)
+
+    def process_batch(self, data_entries):
+        for (response, response_time), count in _response_times(data_entries, itemgetter('response')):
+            self.sketches[f"{response // 100}xx"].add(response_time, count)
+
+    def get_metrics(self):
+        return dict(
+            latency_per_status_class_us={k: latency_metrics(v, self.scale) for k, v in self.sketches.items()}
+        )
+
+    def get_state(self):
+        return {k: v.to_dict() for k, v in self.sketches.items()}
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.sketches[k].merge(DDSketch.from_dict(v))
+
+    def display(self, top=None, output=None):
+        p95 = {k: round(v.quantile(0.95) / 1000, 1) for k, v in self.sketches.items()}
+        Graph.display(p95, "95th percentile response time per response code class", unit='ms',
+                      show_percents=False, top=top or Graph.DEFAULT_TOP, output=output)
+
+
+class StatLatencyPerPath(StatProducer):
+    """
+    Response time percentiles by path
+    """
+
+    def set_up(self):
+        self.sketches = defaultdict(DDSketch)
+
+    def process_entry(self, data_entry):
+        response_time = data_entry.get('response_time_us')
+        if response_time is not None:
+            self.sketches[data_entry['path']].add(response_time)
+
+    def process_batch(self, data_entries):
+        sketches = self.sketches
+        for (path, response_time), count in _response_times(data_entries, itemgetter('path')):
+            sketches[path].add(response_time, count)
+
+    def get_metrics(self):
+        return dict(
+            latency_per_path_us={k: latency_metrics(v, self.scale) for k, v in self.sketches.items()}
+        )
+
+    def get_state(self):
+        return {k: v.to_dict() for k, v in self.sketches.items()}
+
+    def merge_state(self, state):
+        for k, v in state.items():
+            self.sketches[k].merge(DDSketch.from_dict(v))
+
+    def display(self, top=None, output=None):
+        p95 = {k: round(v.quantile(0.95) / 1000, 1) for k, v in self.sketches.items()}
+        TopList.display(p95, "Slowest paths, 95th percentile", unit='ms', top=top or TopList.DEFAULT_TOP, output=output)
 
 
 class StatTotals(StatProducer):
@@ -228,10 +763,35 @@ class StatTotals(StatProducer):
         self.total_size += data_entry['bytes']
         self.total_hits += 1
         if data_entry['extension'] in {None, 'html'}:
-            self.different_visitors.add(data_entry['remote_ip'])
+            self.different_visitors.add(ip_to_int(data_entry['remote_ip']))
             self.pages_visited += 1
 
+    def process_batch(self, data_entries):
+        self.total_size += sum(map(itemgetter('bytes'), data_entries))
+        self.total_hits += len(data_entries)
+        pages = [data_entry['remote_ip'] for data_entry in data_entries if data_entry['extension'] in {None, 'html'}]
+        self.different_visitors.update(map(ip_to_int, pages))
+        self.pages_visited += len(pages)
+
     def get_metrics(self):
+        # Visitors are the ones of the sample when the entries are sampled
+        return dict(
+            total_size=self.scaled(self.total_size),
+            total_hits=self.scaled(self.total_hits),
+            different_visitors=LazySequence(lambda: map(int_to_ip, self.different_visitors)),
+            pages_visited=self.scaled(self.pages_visited),
+        )
+
+    def count_visitors(self):
+        """
+        :return: Number of different visitors, estimated when the entries are sampled by IP
+        :rtype: int
+        """
+        if self.options.get('sample_key') == IP_KEY:
+            return self.scaled(len(self.different_visitors))
+        return len(self.different_visitors)
+
+    def get_state(self):
         return dict(
             total_size=self.total_size,
             total_hits=self.total_hits,
@@ -239,17 +799,176 @@ class StatTotals(StatProducer):
             pages_visited=self.pages_visited,
         )
 
-    def display(self):
-        header("Totals")
-        print(f"    Total log entries: {self.total_hits}")
-        print(f"    Total : {size_format(self.total_size)}")
-        print(f"    Number of different visitors : {len(self.different_visitors)}")
-        print(f"    Number of pages visited : {self.pages_visited}")
-        print(f"    Average pages visited per visitor : {self.pages_visited / len(self.different_visitors):.2f}")
+    def merge_state(self, state):
+        self.total_size += state['total_size']
+        self.total_hits += state['total_hits']
+        self.different_visitors.update(state['different_visitors'])
+        self.pages_visited += state['pages_visited']
+
+    def display(self, top=None, output=None):
+        visitors = self.count_visitors()
+        pages_visited = self.scaled(self.pages_visited)
+        write_lines([
+            format_header("Totals"),
+            f"    Total log entries: {self.scaled(self.total_hits)}",
+            f"    Total : {size_format(self.scaled(self.total_size))}",
+            f"    Number of different visitors : {visitors}",
+            f"    Number of pages visited : {pages_visited}",
+            f"    Average pages visited per visitor : {pages_visited / visitors if visitors else 0:.2f}",
+        ], output)
+
+
+class StatAnomalies(StatProducer):
+    """
+    Alerts on sudden rises of the hits per response code class, path and IP, see anomaly.py.
+    Alerts are written as JSON lines to the `alerts` option file while the entries are fed.
+    """
+    # Its sliding windows are only useful for logs in time order, the `stats` command needs `--alerts-file`
+    default = False
+
+    def set_up(self):
+        self.alerts_file = self.options.get('alerts')
+        self.detector = AnomalyDetector(
+            bucket_seconds=self.options.get('anomaly_bucket'),
+            window_buckets=self.options.get('anomaly_window'),
+            factor=self.options.get('anomaly_factor'),
+            min_hits=self.options.get('anomaly_min_hits'),
+            half_life=self.options.get('anomaly_half_life'),
+            on_alert=self.on_alert,
+        )
+        self.alert_counts = Counter({name: 0 for name in DIMENSIONS})
+        self.recent_alerts = deque(maxlen=RECENT_ALERTS)
+        # Entries skipped by the detectors of the states merged, as they were not in time order
+        self.merged_late_entries = 0
+
+    def on_alert(self, alert):
+        self.alert_counts[alert['dimension']] += 1
+        self.recent_alerts.append(alert)
+        if self.alerts_file is not None:
+            write_alert(self.alerts_file, alert)
+
+    def process_entry(self, data_entry):
+        self.detector.add_entries([data_entry])
+
+    def process_batch(self, data_entries):
+        self.detector.add_entries(data_entries)
+
+    def flush(self):
+        """
+        Check the last bucket of the entries fed for anomalies, at the end of the entries
+        """
+        self.detector.flush()
+
+    @property
+    def late_entries(self):
+        return self.merged_late_entries + self.detector.late_entries
+
+    def get_alerts(self):
+        """
+        The alerts of the bucket being filled are included without closing it, so that getting the metrics, such as
+        at each request of the stats server, does not change the detection
+        :return: Number of alerts per dimension, and the last alerts
+        :rtype: (dict, list)
+        """
+        pending = self.detector.pending_alerts()
+        counts = Counter(self.alert_counts)
+        counts.update(alert['dimension'] for alert in pending)
+        return dict(counts), (list(self.recent_alerts) + pending)[-RECENT_ALERTS:]
+
+    def get_metrics(self):
+        counts, recent = self.get_alerts()
+        # Alerts are about the entries fed, they are not scaled when the entries are a sample
+        return dict(
+            anomalies=dict(alerts=counts, recent=recent, late_entries=self.late_entries)
+        )
+
+    def get_state(self):
+        counts, recent = self.get_alerts()
+        return dict(alerts=counts, recent=recent, late_entries=self.late_entries)
+
+    def merge_state(self, state):
+        # The sliding windows are not merged, anomalies are found file by file
+        self.alert_counts.update(state['alerts'])
+        self.recent_alerts.extend(state['recent'])
+        # Missing from the states of older versions
+        self.merged_late_entries += state.get('late_entries', 0)
+
+    def display(self, top=None, output=None):
+        _, recent = self.get_alerts()
+        lines = [format_header("Anomalies")]
+        for alert in recent[-top:] if top else recent:
+            lines.append(f"    {Colors.WARNING}{alert['time']}{Colors.ENDC} {alert['dimension']} {alert['key']}:"
+                         f" {alert['hits']} hits in {alert['window_seconds']}s, expected {alert['expected']}")
+        if not recent:
+            lines.append("    No anomaly detected")
+        if self.late_entries:
+            lines.append(f"    {self.late_entries} entries out of time order were skipped")
+        write_lines(lines, output)
+
+
+def iter_entry_points(group):
+    """
+    :param group: Entry point group
+    :return: The entry points of the group, with a `name` attribute and a `load` method
+    """
+    # Imported here as reading the metadata of the installed packages is slow
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python 3.7, with the importlib_metadata backport or setuptools
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            try:
+                import pkg_resources
+            except ImportError:
+                logger.debug(f"Could not read the entry points of {group}, importlib_metadata is not installed")
+                return []
+            return list(pkg_resources.iter_entry_points(group))
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        return list(all_entry_points.select(group=group))
+    return list(all_entry_points.get(group, []))
+
+
+@lru_cache(maxsize=None)
+def load_plugins():
+    """
+    Import the StatProducer subclasses registered by other packages in the `apache_logs_parser.stat_producers` entry
+    point group, such as `my_stats = my_package.stats:MyStatProducer`.
+    Entry points are only read the first time the producers are listed, not when the tool starts.
+    :return: The classes loaded
+    :rtype: tuple
+    """
+    classes = []
+    for plugin in iter_entry_points(PLUGINS_ENTRY_POINT_GROUP):
+        try:
+            classes.append(plugin.load())
+        except (ImportError, AttributeError) as e:
+            logger.warning(f"Could not load the stats producer plugin {plugin.name}: {e}")
+    return tuple(classes)
 
 
 def get_stats_classes():
-    return StatProducer.__subclasses__()
+    """
+    :return: The StatProducer subclasses, including the subclasses of subclasses and the plugins
+    """
+    load_plugins()
+    classes = []
+    pending = StatProducer.__subclasses__()
+    while pending:
+        stat_class = pending.pop(0)
+        if stat_class not in classes:
+            classes.append(stat_class)
+            pending.extend(stat_class.__subclasses__())
+    return classes
+
+
+def get_default_stats_classes():
+    """
+    :return: The StatProducer subclasses, without the ones computed only when they are selected
+    """
+    return [c for c in get_stats_classes() if c.default]
 
 
 def get_stats_classes_names():
@@ -260,4 +979,4 @@ def get_stat_classes_by_name(name):
     for c in get_stats_classes():
         if name == c.__name__:
             return c
-    raise ValueError(f"Could not find stats class {name}")
+    raise ValueError(f"Could not find stats class {name}, stats classes are {', '.join(get_stats_classes_names())}")
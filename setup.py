@@ -26,6 +26,7 @@ setup(
     author_email='martin.denizet@gmail.com',
     url='https://github.com/martin-denizet/',
     packages=find_packages(exclude=['tests']),
+    package_data={'apache_logs_parser': ['ua_rules.txt']},
     license_files=('LICENSE',),
     license=read("LICENSE"),
     classifiers=[
@@ -38,6 +39,10 @@ setup(
     ],
     python_requires='>=3.7',
     install_requires=[],
+    extras_require={
+        # Faster encoding of the stats JSON files
+        'fast-json': ['orjson'],
+    },
     setup_requires=[],
     tests_require=[],
     entry_points={
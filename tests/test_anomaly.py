@@ -0,0 +1,189 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from apache_logs_parser.__main__ import main
+from apache_logs_parser.anomaly import AnomalyDetector, SlidingWindow, STATUS_CLASS, PATH, IP
+from apache_logs_parser.parser import write_json_log
+from apache_logs_parser.stats import get_stats
+from apache_logs_parser.stats_producers import StatAnomalies
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+start = datetime(2015, 5, 17, 10, 0, tzinfo=timezone.utc)
+
+
+def generate_entries(seconds, spike=None, errors=None):
+    """
+    5 hits per second over 20 IPs, plus 10 hits per second of 6.6.6.6 during the `spike` range of seconds,
+    and 3 errors per second during the `errors` range of seconds
+    """
+    entries = []
+    for second in range(seconds):
+        time = (start + timedelta(seconds=second)).isoformat()
+        for i in range(5):
+            response = 500 if errors and second in errors and i < 3 else 200
+            entries.append(dict(time=time, response=response, path=f"/page{i}", remote_ip=f"10.0.0.{second % 20}"))
+        if spike and second in spike:
+            entries.extend(dict(time=time, response=200, path="/page0", remote_ip="6.6.6.6") for _ in range(10))
+    return entries
+
+
+class TestSlidingWindow(unittest.TestCase):
+
+    def test_window(self):
+        window = SlidingWindow(3, 0.5)
+        for bucket in range(7):
+            window.push(bucket, Counter(a=bucket + 1))
+        # Buckets 4, 5 and 6 are in the window
+        self.assertEqual(18, window.totals['a'])
+        # Baseline of the buckets 0 to 3, the weight of a bucket is halved at each bucket
+        weights = [0.125, 0.25, 0.5, 1]
+        self.assertAlmostEqual(sum(w * hits for w, hits in zip(weights, [1, 2, 3, 4])) / sum(weights) * 3,
+                               window.expected('a'))
+        self.assertAlmostEqual(0, window.expected('b'))
+
+    def test_warm_up(self):
+        window = SlidingWindow(3, 0.5)
+        for bucket in range(3):
+            window.push(bucket, Counter(a=1))
+        self.assertIsNone(window.expected('a'))
+
+    def test_max_keys(self):
+        window = SlidingWindow(2, 0.9, max_keys=10)
+        for bucket in range(100):
+            window.push(bucket, Counter({f"key {bucket}": bucket + 1}))
+        self.assertLessEqual(len(window.sums), 10)
+        self.assertEqual(2, len(window.totals))
+
+
+class TestAnomalyDetector(unittest.TestCase):
+
+    def detect(self, entries):
+        alerts = []
+        detector = AnomalyDetector(on_alert=alerts.append)
+        detector.add_entries(entries)
+        detector.flush()
+        return alerts
+
+    def test_no_anomaly(self):
+        self.assertEqual([], self.detect(generate_entries(1800)))
+
+    def test_ip_spike(self):
+        alerts = self.detect(generate_entries(1800, spike=range(1200, 1300)))
+        self.assertEqual([(IP, '6.6.6.6'), (PATH, '/page0')], [(alert['dimension'], alert['key']) for alert in alerts])
+        self.assertEqual('2015-05-17T10:20:10+00:00', alerts[0]['time'])
+
+    def test_errors(self):
+        alerts = self.detect(generate_entries(1800, errors=range(1200, 1300)))
+        self.assertEqual([(STATUS_CLASS, '5xx')], [(alert['dimension'], alert['key']) for alert in alerts])
+
+    def test_late_entries(self):
+        entries = generate_entries(1800)
+        # Entries of a spike found after the spike are not counted in the bucket being filled
+        late = [entry for entry in generate_entries(1300, spike=range(1200, 1300)) if entry['remote_ip'] == '6.6.6.6']
+        alerts = []
+        detector = AnomalyDetector(on_alert=alerts.append)
+        detector.add_entries(entries[:1400 * 5] + late + entries[1400 * 5:])
+        detector.flush()
+        self.assertEqual([], alerts)
+        self.assertEqual(len(late), detector.late_entries)
+
+    def test_pending_alerts(self):
+        # The spike is in the last bucket
+        entries = generate_entries(1205, spike=range(1200, 1205))
+        alerts = []
+        detector = AnomalyDetector(on_alert=alerts.append, min_hits=10)
+        detector.add_entries(entries)
+        pending = detector.pending_alerts()
+        self.assertEqual([(IP, '6.6.6.6')], [(alert['dimension'], alert['key']) for alert in pending])
+        self.assertEqual([], alerts)
+        self.assertEqual(pending, detector.pending_alerts())
+        detector.flush()
+        self.assertEqual(pending, alerts)
+
+    def test_gap(self):
+        # An hour without entries then the same traffic
+        entries = generate_entries(600)
+        entries += [dict(entry, time=(datetime.fromisoformat(entry['time']) + timedelta(hours=1)).isoformat())
+                    for entry in generate_entries(600)]
+        self.assertEqual([], self.detect(entries))
+
+
+def generate_lines(entries):
+    for entry in entries:
+        time = datetime.fromisoformat(entry['time']).strftime('%d/%b/%Y:%H:%M:%S %z')
+        yield f'{entry["remote_ip"]} - - [{time}] "GET {entry["path"]} HTTP/1.1" {entry["response"]} 10 "-" "curl/7.0"\n'
+
+
+class TestStatAnomalies(unittest.TestCase):
+
+    def test_alerts_file(self):
+        alerts_file = io.StringIO()
+        stat, = get_stats(generate_entries(1800, spike=range(1200, 1300)), [StatAnomalies],
+                          options=dict(alerts=alerts_file))
+        stat.flush()
+        alerts = [json.loads(line) for line in alerts_file.getvalue().splitlines()]
+        self.assertEqual(['6.6.6.6', '/page0'], [alert['key'] for alert in alerts])
+        metrics = stat.get_metrics()['anomalies']
+        self.assertEqual(1, metrics['alerts'][IP])
+        self.assertEqual(alerts, metrics['recent'])
+
+    def test_getters_do_not_flush(self):
+        entries = generate_entries(1800, spike=range(1200, 1300))
+        expected, = get_stats(entries, [StatAnomalies])
+        stat = StatAnomalies()
+        # Like the stats server answering requests while entries are ingested
+        for index in range(0, len(entries), 1000):
+            stat.process_batch(entries[index:index + 1000])
+            stat.get_metrics()
+            stat.get_state()
+            stat.display(output=io.StringIO())
+        self.assertEqual(expected.get_metrics(), stat.get_metrics())
+        self.assertEqual(expected.detector.bucket, stat.detector.bucket)
+        self.assertEqual(0, stat.get_metrics()['anomalies']['late_entries'])
+
+    def test_merge_state(self):
+        stat, = get_stats(generate_entries(1800, errors=range(1200, 1300)), [StatAnomalies])
+        merged = StatAnomalies()
+        merged.merge_state(stat.get_state())
+        merged.merge_state(stat.get_state())
+        self.assertEqual(2, merged.get_metrics()['anomalies']['alerts'][STATUS_CLASS])
+
+    def test_stats_command_opt_in(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_log, output = os.path.join(tmp_dir, 'log.json'), os.path.join(tmp_dir, 'stats.json')
+            write_json_log(os.path.join(current_dir, 'access.log'), json_log)
+            for options, computed in ([], False), (['--alerts-file', os.path.join(tmp_dir, 'alerts.jsonl')], True):
+                with mock.patch('sys.argv', ['apache_logs_parser', 'stats', json_log, '--no-display', '-o', output]
+                                + options):
+                    main()
+                with open(output) as f:
+                    self.assertEqual(computed, 'anomalies' in json.load(f))
+
+    def test_watch_command(self):
+        lines = ''.join(generate_lines(generate_entries(1800, spike=range(1200, 1300))))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            alerts_file = os.path.join(tmp_dir, 'alerts.jsonl')
+            for options in [], ['--alerts-file', alerts_file]:
+                output = io.StringIO()
+                with mock.patch('sys.argv', ['apache_logs_parser', 'watch'] + options), \
+                        mock.patch('sys.stdin', io.StringIO(lines)), redirect_stdout(output):
+                    main()
+                if options:
+                    self.assertIn('Anomalies', output.getvalue())
+                    with open(alerts_file) as f:
+                        alerts = f.read()
+                else:
+                    alerts = output.getvalue()
+                # Only the alerts are written to the standard output when it receives them
+                self.assertEqual(['6.6.6.6', '/page0'], [json.loads(line)['key'] for line in alerts.splitlines()])
+
+
+if __name__ == '__main__':
+    unittest.main()
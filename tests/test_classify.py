@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from apache_logs_parser.classify import MultiPatternMatcher, UserAgentClassifier, Rule, read_rules
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestMultiPatternMatcher(unittest.TestCase):
+    def test_overlapping_patterns(self):
+        matcher = MultiPatternMatcher(['he', 'she', 'his', 'hers'])
+        self.assertEqual(
+            [(1, 1), (2, 0), (2, 3)],
+            list(matcher.iter_matches('ushers'))
+        )
+
+    def test_no_match(self):
+        self.assertEqual([], list(MultiPatternMatcher(['bot']).iter_matches('Maui Browser')))
+
+
+class TestUserAgentClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = UserAgentClassifier.from_file()
+
+    def test_android(self):
+        self.assertEqual(
+            {'is_bot': False, 'is_mobile': True, 'system_agent': 'Android 4.4.2'},
+            self.classifier.classify("Mozilla/5.0 (Linux; Android 4.4.2; Nexus 5 Build/KOT49H) AppleWebKit/537.36")
+        )
+
+    def test_rightmost_desktop_match(self):
+        self.assertEqual(
+            'Mac OS X 10.5',
+            self.classifier.classify("Windows NT 6.1 Mac OS X 10.5")['system_agent']
+        )
+
+    def test_case_insensitive_bot(self):
+        self.assertTrue(self.classifier.classify("Mozilla/5.0 (compatible; YANDEXBOT/3.0)")['is_bot'])
+
+    def test_version_required(self):
+        self.assertEqual(
+            'Unknown',
+            self.classifier.classify("Mozilla/5.0 (X11; Linux x86_64; rv:25.0) Gecko/20100101 Firefox/25.0")['system_agent']
+        )
+
+    def test_custom_rules(self):
+        classifier = UserAgentClassifier([Rule('bot', 'Maui'), Rule('mobile', 'KaiOS/', 'dotted')])
+        self.assertEqual(
+            {'is_bot': True, 'is_mobile': True, 'system_agent': 'KaiOS/2.5'},
+            classifier.classify("Maui Browser KaiOS/2.5")
+        )
+
+
+class TestRulesFile(unittest.TestCase):
+    def test_invalid_rule(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('# comment\n\nbot googlebot\nrobot "R2 D2"\n')
+        try:
+            with self.assertRaises(ValueError):
+                read_rules(f.name)
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from apache_logs_parser.dedup import BloomFilter, Deduplicator, fingerprint
+from apache_logs_parser.parser import generate_data_from_log, write_json_log
+from apache_logs_parser.stats import generate_stats
+from apache_logs_parser.stats_producers import StatCount
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+access_log = os.path.join(current_dir, 'access.log')
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_add(self):
+        bloom = BloomFilter(1000, 0.01)
+        self.assertFalse(bloom.add(fingerprint('a')))
+        self.assertTrue(bloom.add(fingerprint('a')))
+        self.assertIn(fingerprint('a'), bloom)
+        self.assertEqual(1, len(bloom))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add(fingerprint(f"line {i}"))
+        false_positives = sum(fingerprint(f"other {i}") in bloom for i in range(10000))
+        self.assertLess(false_positives, 200)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            BloomFilter(0)
+        with self.assertRaises(ValueError):
+            BloomFilter(10, 1)
+
+
+class TestDeduplicator(unittest.TestCase):
+
+    def test_duplicate_files(self):
+        deduplicator = Deduplicator(1000)
+        data = generate_data_from_log([access_log, access_log], line_filters=[deduplicator.keep_line])
+        self.assertEqual(30, len(data))
+        self.assertEqual(30, deduplicator.duplicates)
+
+    def test_repeated_lines_of_a_file(self):
+        with open(access_log) as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_files = [os.path.join(tmp_dir, f'access{i}.log') for i in range(2)]
+            # The same request twice in the same second, then the end of the file copied to the next file
+            with open(log_files[0], 'w') as f:
+                f.writelines(lines[:20] + lines[:1])
+            with open(log_files[1], 'w') as f:
+                f.writelines(lines[10:])
+            deduplicator = Deduplicator(1000)
+            data = generate_data_from_log(log_files, line_filters=[deduplicator.keep_line])
+        self.assertEqual(31, len(data))
+        self.assertEqual(10, deduplicator.duplicates)
+        self.assertEqual(30, len(deduplicator))
+
+    def test_capacity_exceeded(self):
+        deduplicator = Deduplicator(10)
+        with self.assertLogs('apache_logs_parser.dedup', level='WARNING') as logs:
+            # Lines of a single file are all kept
+            self.assertTrue(all(deduplicator.keep_line(f"line {i}") for i in range(20)))
+            deduplicator.log_summary()
+        self.assertEqual(2, len(logs.output))
+        self.assertIn('different lines for a capacity of 10', logs.output[-1])
+
+    def test_duplicate_entries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_files = [os.path.join(tmp_dir, f'{name}.json') for name in ('a', 'b')]
+            for json_file in json_files:
+                write_json_log(access_log, json_file)
+            count, = generate_stats(json_files, [StatCount])
+            self.assertEqual(60, count.get_metrics()['hits'])
+            count, = generate_stats(json_files, [StatCount], entry_filters=[Deduplicator(1000).keep_entry])
+            self.assertEqual(30, count.get_metrics()['hits'])
+
+
+if __name__ == '__main__':
+    unittest.main()
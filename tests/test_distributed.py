@@ -0,0 +1,185 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from apache_logs_parser.distributed import Coordinator, CoordinatorServer, READY, DONE, RESULT, ERROR, \
+    read_message, send_message, compute_file_states, run_worker
+from apache_logs_parser.parser import parse_log_file, write_json_log
+from apache_logs_parser.sampling import Sampler, IP_KEY
+from apache_logs_parser.stats import generate_json_stats, generate_stats, get_stats
+from apache_logs_parser.stats_producers import StatCount, ResponseCount, StatPerIp, StatHitPerPage, StatLatency, \
+    StatPerSubnet, StatTotals
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+access_log = os.path.join(current_dir, 'access.log')
+stats_classes = [StatCount, ResponseCount, StatPerIp, StatHitPerPage, StatLatency]
+
+
+class TestDistributedStats(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_files = []
+        for i in range(4):
+            log_file = os.path.join(self.tmp_dir, f'access-{i}.log')
+            shutil.copy(access_log, log_file)
+            self.log_files.append(log_file)
+        json_file = os.path.join(self.tmp_dir, 'access.json')
+        write_json_log(access_log, json_file)
+        self.log_files.append(json_file)
+        self.expected = generate_json_stats(get_stats(parse_log_file(access_log) * 5, stats_classes))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def start(self, coordinator):
+        server = CoordinatorServer(('127.0.0.1', 0), coordinator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def test_compute_file_states(self):
+        states = compute_file_states(self.log_files[0], [stat.__name__ for stat in stats_classes])
+        self.assertEqual(states, compute_file_states(self.log_files[-1], [stat.__name__ for stat in stats_classes]))
+        self.assertEqual(30, states['StatCount']['hits'])
+
+    def test_worker_processes(self):
+        coordinator = Coordinator(self.log_files, stats_classes, expected_workers=2)
+        port = self.start(coordinator)
+        workers = [subprocess.Popen([sys.executable, '-m', 'apache_logs_parser', 'worker',
+                                     '--coordinator', f'127.0.0.1:{port}', '--name', f'worker-{i}'],
+                                    stderr=subprocess.DEVNULL)
+                   for i in range(2)]
+        self.assertTrue(coordinator.wait(60))
+        for worker in workers:
+            self.assertEqual(0, worker.wait(60))
+        self.assertEqual(sorted(self.log_files), sorted(coordinator.processed))
+        self.assertEqual(self.expected, generate_json_stats(coordinator.stats_instances))
+
+    def test_failed_worker(self):
+        coordinator = Coordinator(self.log_files, stats_classes)
+        port = self.start(coordinator)
+        # Worker crashing after receiving a file
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='crashing'))
+            lost_file = read_message(rfile)['file']
+        self.assertEqual(5, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        self.assertIn(lost_file, coordinator.processed)
+        self.assertEqual(2, coordinator.attempts[lost_file])
+        self.assertEqual(self.expected, generate_json_stats(coordinator.stats_instances))
+
+    def test_restarted_worker(self):
+        coordinator = Coordinator(self.log_files[:1], stats_classes)
+        port = self.start(coordinator)
+        # Connection lost, the worker restarted with the same name is given the file again
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='worker'))
+            read_message(rfile)
+        self.assertEqual(1, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        self.assertEqual(self.log_files[:1], coordinator.processed)
+
+    def test_invalid_states(self):
+        coordinator = Coordinator(self.log_files[:1], stats_classes, expected_workers=2)
+        port = self.start(coordinator)
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='invalid'))
+            file_name = read_message(rfile)['file']
+            states = compute_file_states(file_name, [stat.__name__ for stat in stats_classes])
+            states['StatLatency'] = dict(count='invalid')
+            send_message(sock, dict(type=RESULT, file=file_name, states=states))
+            # The file is not given again to a worker which sent invalid states
+            send_message(sock, dict(type=READY, worker='invalid'))
+            self.assertEqual(DONE, read_message(rfile)['type'])
+        self.assertEqual(1, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        self.assertEqual(self.log_files[:1], coordinator.processed)
+        # Nothing was merged from the invalid states
+        expected = generate_json_stats(get_stats(parse_log_file(access_log), stats_classes))
+        self.assertEqual(expected, generate_json_stats(coordinator.stats_instances))
+
+    def test_error_gives_up(self):
+        coordinator = Coordinator(self.log_files[:1], stats_classes)
+        port = self.start(coordinator)
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='worker'))
+            file_name = read_message(rfile)['file']
+            send_message(sock, dict(type=ERROR, file=file_name, error='Failed'))
+            send_message(sock, dict(type=READY, worker='worker'))
+            self.assertEqual(DONE, read_message(rfile)['type'])
+        self.assertTrue(coordinator.wait(10))
+        self.assertEqual(self.log_files[:1], coordinator.failed)
+
+    def test_missing_file(self):
+        missing_file = os.path.join(self.tmp_dir, 'missing.log')
+        coordinator = Coordinator(self.log_files + [missing_file], stats_classes)
+        port = self.start(coordinator)
+        self.assertEqual(5, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        self.assertEqual([missing_file], coordinator.failed)
+        self.assertEqual(self.expected, generate_json_stats(coordinator.stats_instances))
+
+    def test_unexpected_error(self):
+        coordinator = Coordinator(self.log_files[:1], stats_classes)
+        port = self.start(coordinator)
+        # Any error is reported as an error of the file, the worker keeps running
+        with mock.patch('apache_logs_parser.distributed.compute_file_states', side_effect=KeyError('response')):
+            self.assertEqual(0, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        self.assertEqual(self.log_files[:1], coordinator.failed)
+
+    def test_options(self):
+        options = dict(subnet_prefixes=[16], subnets=['83.149.0.0/18'])
+        coordinator = Coordinator(self.log_files[:1], [StatPerSubnet], options=options)
+        port = self.start(coordinator)
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='worker'))
+            self.assertEqual(options, read_message(rfile)['options'])
+        self.assertEqual(1, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        expected = generate_json_stats(get_stats(parse_log_file(access_log), [StatPerSubnet], options))
+        self.assertEqual(expected, generate_json_stats(coordinator.stats_instances))
+
+    def test_sampled_files(self):
+        json_files = []
+        for i in range(2):
+            json_file = os.path.join(self.tmp_dir, f'sampled-{i}.json')
+            write_json_log(access_log, json_file, sampler=Sampler(0.5, IP_KEY))
+            json_files.append(json_file)
+        sampled_classes = [StatCount, StatPerIp, StatTotals]
+        coordinator = Coordinator(json_files, sampled_classes)
+        port = self.start(coordinator)
+        self.assertEqual(2, run_worker('127.0.0.1', port, 'worker'))
+        self.assertTrue(coordinator.wait(10))
+        stats_instances, sampling = coordinator.get_sampled_stats()
+        self.assertEqual((0.5, IP_KEY), (sampling['rate'], sampling['key']))
+        self.assertEqual(generate_json_stats(generate_stats(json_files, sampled_classes)),
+                         generate_json_stats(stats_instances))
+
+    def test_incomplete_command(self):
+        # The command fails when files were not processed, unless partial stats are allowed
+        command = [sys.executable, '-m', 'apache_logs_parser', 'coordinate', access_log, '--host', '127.0.0.1',
+                   '--port', '0', '--timeout', '1', '--no-display']
+        result = subprocess.run(command, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(2, result.returncode)
+        self.assertIn('--allow-partial', result.stderr)
+        self.assertEqual(0, subprocess.run(command + ['--allow-partial'], stderr=subprocess.DEVNULL).returncode)
+
+    def test_no_files_left(self):
+        coordinator = Coordinator([], stats_classes)
+        port = self.start(coordinator)
+        with socket.create_connection(('127.0.0.1', port)) as sock, sock.makefile('rb') as rfile:
+            send_message(sock, dict(type=READY, worker='worker'))
+            message = read_message(rfile)
+        self.assertEqual(DONE, message['type'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import random
+import unittest
+
+from apache_logs_parser.external import LazyMapping, LazySequence, SpillableCounter, materialize
+from apache_logs_parser.parser import parse_log_file
+from apache_logs_parser.serializers import JsonSerializer, SERIALIZERS, SEQUENCE_BATCH_SIZE, write_json_object
+from apache_logs_parser.stats import create_stats_instances, feed_stats, generate_json_stats, iter_metrics
+from apache_logs_parser.stats_producers import StatPerIp, StatHitPerPage, StatPageIssues, StatPerExtension, StatTotals
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestSpillableCounter(unittest.TestCase):
+
+    def test_spill_and_merge(self):
+        random.seed(0)
+        expected = dict()
+        counter = SpillableCounter(2, memory_limit=2000)
+        for _ in range(5000):
+            key = random.randint(0, 300)
+            size = random.randint(0, 1000)
+            counter.add(key, 1, size)
+            hits, total = expected.get(key, (0, 0))
+            expected[key] = (hits + 1, total + size)
+        self.assertTrue(counter.runs)
+        items = list(counter.items())
+        self.assertEqual(len(expected), len(items))
+        self.assertEqual(expected, {key: tuple(values) for key, values in items})
+
+    def test_run_files_are_removed(self):
+        counter = SpillableCounter(1, memory_limit=1)
+        counter.add((404, '/a'), 1)
+        counter.add((404, '/a'), 2)
+        self.assertEqual([((404, '/a'), [3])], list(counter.items()))
+        runs = list(counter.runs)
+        del counter
+        self.assertFalse(any(os.path.exists(run) for run in runs))
+
+    def test_many_runs(self):
+        counter = SpillableCounter(1, memory_limit=1)
+        counter.MAX_RUNS = 4
+        for i in range(20):
+            counter.add(f"/page{i % 7}", 1)
+        self.assertLessEqual(len(counter.runs), 5)
+        self.assertEqual({f"/page{i}": [3 if i < 6 else 2] for i in range(7)}, dict(counter.items()))
+
+
+class TestLazyMapping(unittest.TestCase):
+
+    def test_write_json(self):
+        lazy = LazyMapping(lambda: iter([('a', 1), ('b', LazyMapping(lambda: iter([(None, [1])])))]))
+        self.assertEqual({'a': 1, 'b': {None: [1]}}, lazy)
+        fh = io.BytesIO()
+        write_json_object([('lazy', lazy)], fh, JsonSerializer())
+        self.assertEqual(json.dumps({'lazy': {'a': 1, 'b': {'null': [1]}}}, indent=4).encode(), fh.getvalue())
+
+
+class TestLazySequence(unittest.TestCase):
+
+    def test_write_json(self):
+        for items in [], ['1.2.3.4'], [str(i) for i in range(SEQUENCE_BATCH_SIZE + 1)]:
+            lazy = LazySequence(lambda: iter(items))
+            self.assertEqual(items, materialize(lazy))
+            for serializer_class in SERIALIZERS.values():
+                for compact in False, True:
+                    try:
+                        serializer = serializer_class(compact=compact)
+                    except ImportError:
+                        continue
+                    expected, fh = io.BytesIO(), io.BytesIO()
+                    write_json_object([('list', items), ('nested', {'list': items})], expected, serializer)
+                    write_json_object([('list', lazy), ('nested', LazyMapping(lambda: iter([('list', lazy)])))], fh,
+                                      serializer)
+                    self.assertEqual(expected.getvalue(), fh.getvalue())
+
+    def test_metrics_computed_once(self):
+        stat = StatTotals()
+        calls = []
+        get_metrics = stat.get_metrics
+        stat.get_metrics = lambda: calls.append(1) or get_metrics()
+        self.assertIsInstance(dict(iter_metrics([stat]))['different_visitors'], LazySequence)
+        self.assertEqual(1, len(calls))
+
+
+class TestMemoryLimit(unittest.TestCase):
+
+    def test_same_stats(self):
+        data = parse_log_file(os.path.join(current_dir, 'access.log'))
+        stats_classes = [StatPerIp, StatHitPerPage, StatPageIssues, StatPerExtension]
+        limited = feed_stats(create_stats_instances(stats_classes, dict(memory_limit=1)), data)
+        self.assertTrue(limited[0].per_ip.runs)
+        self.assertEqual(
+            generate_json_stats(feed_stats(create_stats_instances(stats_classes), data)),
+            generate_json_stats(limited))
+
+
+if __name__ == '__main__':
+    unittest.main()
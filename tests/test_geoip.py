@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from apache_logs_parser.geoip import GeoIpDatabase, IntervalIndex, compile_database
+from apache_logs_parser.parser import parse_log_file
+from apache_logs_parser.stats import get_stats
+from apache_logs_parser.stats_producers import StatPerCountry, StatPerAsn
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+CSV_DATABASE = """start_ip,end_ip,country,asn,as_name
+83.149.0.0,83.149.63.255,RU,AS12389,Rostelecom
+93.114.40.0,93.114.47.255,RO,39743,Voxility
+2001:db8::,2001:db8:ffff:ffff:ffff:ffff:ffff:ffff,ZZ,,
+# Networks can be used instead of ranges
+24.236.252.0/24,US,7922,Comcast
+"""
+
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_find(self):
+        index = IntervalIndex([(10, 19, 'b'), (0, 5, 'a')])
+        self.assertEqual('a', index.find(0))
+        self.assertEqual('a', index.find(5))
+        self.assertIsNone(index.find(6))
+        self.assertEqual('b', index.find(19))
+        self.assertIsNone(index.find(20))
+
+
+class TestGeoIpDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.tmp_dir.name, 'geoip.csv')
+        with open(self.csv_file, 'w') as f:
+            f.write(CSV_DATABASE)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertDatabase(self, database):
+        self.assertEqual(dict(country='RU', asn=12389, as_name='Rostelecom'), database.lookup('83.149.9.216'))
+        self.assertEqual(dict(country='US', asn=7922, as_name='Comcast'), database.lookup('24.236.252.67'))
+        self.assertEqual(dict(country='ZZ', asn=None, as_name=None), database.lookup('2001:db8::1'))
+        self.assertEqual(dict(country=None, asn=None, as_name=None), database.lookup('1.1.1.1'))
+
+    def test_csv(self):
+        self.assertDatabase(GeoIpDatabase.from_file(self.csv_file))
+
+    def test_compiled(self):
+        binary_file = os.path.join(self.tmp_dir.name, 'geoip.bin')
+        self.assertEqual(4, compile_database(self.csv_file, binary_file))
+        self.assertDatabase(GeoIpDatabase.from_file(binary_file))
+
+    def test_stats(self):
+        database = GeoIpDatabase.from_file(self.csv_file)
+        data = parse_log_file(os.path.join(current_dir, 'access.log'), enrichers=[database.enrich])
+        per_country, per_asn = get_stats(data, [StatPerCountry, StatPerAsn])
+        self.assertEqual(23, per_country.get_metrics()['per_country']['RU']['hits'])
+        self.assertEqual(6, per_asn.get_metrics()['per_asn']['AS39743 Voxility']['hits'])
+        self.assertEqual(30, sum(v['hits'] for v in per_country.get_metrics()['per_country'].values()))
+
+    def test_not_enriched(self):
+        data = parse_log_file(os.path.join(current_dir, 'access.log'))
+        per_country, = get_stats(data, [StatPerCountry])
+        self.assertEqual({}, per_country.get_metrics()['per_country'])
+
+
+if __name__ == '__main__':
+    unittest.main()
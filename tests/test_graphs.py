@@ -1,7 +1,7 @@
 import os
 import unittest
 
-from apache_logs_parser.display import Graph
+from apache_logs_parser.display import Graph, TopList, select_top
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -36,6 +36,30 @@ class TestGraphs(unittest.TestCase):
             '█▌'
         )
 
+    def test_graph_top(self):
+        lines = Graph.render({'a': 1, 'b': 3, 'c': 2}, top=2, show_percents=False)
+        self.assertEqual(2, len(lines))
+        self.assertIn('b', lines[0])
+        self.assertIn('c', lines[1])
+
+    def test_graph_empty(self):
+        self.assertEqual([], Graph.render({}))
+
+
+class TestTopList(unittest.TestCase):
+    def test_select_top(self):
+        data = {str(i): i for i in range(100)}
+        self.assertEqual([('99', 99), ('98', 98), ('97', 97)], select_top(data, 3))
+        self.assertEqual([('0', 0), ('1', 1)], select_top(data, 2, descending_sort=False))
+        self.assertEqual(100, len(select_top(data)))
+
+    def test_top_list_render(self):
+        lines = TopList.render({'/a': 5, '/b': 7, '/c': 1}, 'Pages', top=2)
+        self.assertEqual(3, len(lines))
+        self.assertIn('Pages Top 2', lines[0])
+        self.assertIn('#1: /b', lines[1])
+        self.assertIn('#2: /a', lines[2])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from apache_logs_parser.external import materialize
+from apache_logs_parser.ip import ip_to_int, int_to_ip, parse_network, network_to_str, network_of, PrefixTrie
+from apache_logs_parser.parser import parse_line
+from apache_logs_parser.stats import get_stats
+from apache_logs_parser.stats_producers import StatPerSubnet, StatPerIp
+
+
+class TestIpConversion(unittest.TestCase):
+    def test_ipv4_round_trip(self):
+        self.assertEqual('83.149.9.216', int_to_ip(ip_to_int('83.149.9.216')))
+
+    def test_ipv6_round_trip(self):
+        self.assertEqual('2001:db8::1', int_to_ip(ip_to_int('2001:DB8:0::1')))
+
+    def test_ipv4_and_ipv6_distinct(self):
+        self.assertNotEqual(ip_to_int('0.0.0.1'), ip_to_int('::1'))
+
+    def test_invalid(self):
+        for ip in ('256.1.1.1', '1.2.3', 'fe80::1::2'):
+            with self.assertRaises(ValueError):
+                ip_to_int(ip)
+
+    def test_network(self):
+        network, prefix_length = parse_network('10.1.2.3/16')
+        self.assertEqual('10.1.0.0/16', network_to_str(network, prefix_length))
+        self.assertEqual(network, network_of(ip_to_int('10.1.200.1'), prefix_length))
+
+
+class TestPrefixTrie(unittest.TestCase):
+    def test_longest_match(self):
+        trie = PrefixTrie()
+        for cidr in ('10.0.0.0/8', '10.1.0.0/16', '2001:db8::/32'):
+            trie.insert(*parse_network(cidr), cidr)
+        self.assertEqual('10.1.0.0/16', trie.longest_match(ip_to_int('10.1.2.3')))
+        self.assertEqual('10.0.0.0/8', trie.longest_match(ip_to_int('10.2.2.3')))
+        self.assertEqual('2001:db8::/32', trie.longest_match(ip_to_int('2001:db8:1::5')))
+        self.assertIsNone(trie.longest_match(ip_to_int('192.168.1.1')))
+
+
+class TestSubnetStats(unittest.TestCase):
+    def setUp(self):
+        line = '{} - - [17/May/2015:10:05:03 +0000] "GET /a HTTP/1.1" 200 10 "-" "curl/7.0"'
+        self.data = [parse_line(line.format(ip)) for ip in ('10.1.2.3', '10.1.2.4', '10.1.3.1', '2001:db8:1:2::1')]
+
+    def test_ipv6_line(self):
+        self.assertEqual('2001:db8:1:2::1', self.data[3]['remote_ip'])
+
+    def test_per_ip(self):
+        stat, = get_stats(self.data, [StatPerIp])
+        self.assertEqual({'hits': 1, 'bytes': 10}, stat.get_metrics()['per_ip']['2001:db8:1:2::1'])
+
+    def test_per_subnet(self):
+        stat, = get_stats(self.data, [StatPerSubnet], options=dict(subnet_prefixes=[24, 16], subnets=['10.1.2.0/23']))
+        per_subnet = stat.get_metrics()['per_subnet']
+        self.assertEqual(2, per_subnet['/24']['10.1.2.0/24']['hits'])
+        self.assertEqual(3, per_subnet['/16']['10.1.0.0/16']['hits'])
+        self.assertEqual(3, per_subnet['networks']['10.1.2.0/23']['hits'])
+        self.assertEqual(30, per_subnet['/16']['10.1.0.0/16']['bytes'])
+        self.assertEqual(1, per_subnet['/48 IPv6']['2001:db8:1::/48']['hits'])
+
+    def test_per_subnet_memory_limit(self):
+        options = dict(subnet_prefixes=[24, 32])
+        expected, = get_stats(self.data * 50, [StatPerSubnet], options=options)
+        # A limit of a single key spills the counts of each IP and subnet to run files
+        spilled, = get_stats(self.data * 50, [StatPerSubnet], options=dict(options, memory_limit=1))
+        self.assertTrue(spilled.per_ip.runs)
+        self.assertEqual(materialize(expected.get_metrics()), materialize(spilled.get_metrics()))
+
+
+if __name__ == '__main__':
+    unittest.main()
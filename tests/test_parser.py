@@ -1,7 +1,9 @@
 import os
+import tempfile
 import unittest
 from datetime import datetime, timezone
 from apache_logs_parser.parser import parse_line, parse_date, parse_log_file
+from apache_logs_parser.rejects import RejectedLines, NO_MATCH, INVALID_IP, INVALID_FIELD
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -78,6 +80,13 @@ class TestApacheParser(unittest.TestCase):
                 '''112.110.247.238 - - [17/May/2015:12:05:27 +0000] "GET /images/googledotcom.png HTTP/1.1" 304 - "-" "Maui Browser"'''
             ))
 
+    def test_no_request(self):
+        # Apache logs "-" as the request of the connections closed before a request was received
+        data = parse_line('1.2.3.4 - - [17/May/2015:10:05:03 +0000] "-" 408 0 "-" "-"')
+        self.assertEqual(408, data['response'])
+        self.assertEqual(dict(method=None, url=None, protocol=None, extension=None, path=None, query=None),
+                         {k: data[k] for k in ['method', 'url', 'protocol', 'extension', 'path', 'query']})
+
 
 class TestSupportParsers(unittest.TestCase):
     def test_datetime(self):
@@ -95,5 +104,45 @@ class TestParseFile(unittest.TestCase):
         )
 
 
+class TestRejectedLines(unittest.TestCase):
+
+    def test_reject_reasons(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reject_file = os.path.join(tmp_dir, 'rejected.log')
+            rejects = RejectedLines(reject_file, max_logged=1, buffer_size=2)
+            with self.assertLogs('apache_logs_parser.rejects', level='WARNING') as logs:
+                self.assertFalse(parse_line('not an apache log line', rejects))
+                self.assertFalse(parse_line(
+                    '''999.1.1.1 - - [17/May/2015:12:05:27 +0000] "GET / HTTP/1.1" 200 - "-" "Maui Browser"''',
+                    rejects))
+                self.assertFalse(parse_line(
+                    '''1.1.1.1 - - [17/Moy/2015:12:05:27 +0000] "GET / HTTP/1.1" 200 - "-" "Maui Browser"''',
+                    rejects))
+                rejects.close()
+            self.assertEqual({NO_MATCH: 1, INVALID_IP: 1, INVALID_FIELD: 1}, rejects.counts)
+            # The first line, the end of the logging of lines, then the summary
+            self.assertEqual(3, len(logs.output))
+            self.assertIn('Rejected 3 lines', logs.output[-1])
+            with open(reject_file) as f:
+                self.assertEqual(3, len(f.readlines()))
+
+    def test_raw_line_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = os.path.join(tmp_dir, 'access.log')
+            reject_file = os.path.join(tmp_dir, 'rejected.log')
+            with open(log_file, 'w') as f:
+                f.write("  not an apache log line\t\n")
+            with RejectedLines(reject_file) as rejects:
+                self.assertEqual([], parse_log_file(log_file, rejects=rejects))
+            with open(reject_file) as f:
+                self.assertEqual("  not an apache log line\t\n", f.read())
+
+    def test_without_rejected_lines(self):
+        with self.assertLogs('apache_logs_parser.parser', level='ERROR') as logs:
+            for _ in range(20):
+                self.assertFalse(parse_line('not an apache log line'))
+        self.assertEqual(20, len(logs.output))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+import io
+import os
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import redirect_stderr
+from unittest import mock
+
+from apache_logs_parser.__main__ import main
+from apache_logs_parser.parser import parse_log_file, write_json_log
+from apache_logs_parser.query import QueryPlan, parse_aggregate, run_query
+from apache_logs_parser.sqlite_backend import write_sqlite_log
+from apache_logs_parser.stats import get_stats
+from apache_logs_parser.stats_producers import StatPerIp
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+access_log = os.path.join(current_dir, 'access.log')
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.data = parse_log_file(access_log)
+
+    def test_group_by_ip(self):
+        plan = QueryPlan(['ip'], ['count', 'sum(bytes)'])
+        plan.feed(self.data)
+        per_ip, = get_stats(self.data, [StatPerIp])
+        expected = {ip: [value['hits'], value['bytes']] for ip, value in per_ip.get_metrics()['per_ip'].items()}
+        self.assertEqual(expected, {row['ip']: [row['count'], row['sum(bytes)']] for row in plan.get_rows()})
+
+    def test_derived_fields(self):
+        plan = QueryPlan(['hour', 'status_class'], ['count', 'distinct(remote_ip)', 'min(bytes)', 'max(bytes)'])
+        plan.feed(self.data)
+        row, = plan.get_rows()
+        self.assertEqual(dict(hour='2015-05-17T10', status_class='2xx', count=30),
+                         {k: row[k] for k in ('hour', 'status_class', 'count')})
+        self.assertEqual(len({entry['remote_ip'] for entry in self.data}), row['distinct(remote_ip)'])
+        self.assertEqual(min(entry['bytes'] for entry in self.data), row['min(bytes)'])
+        self.assertEqual(max(entry['bytes'] for entry in self.data), row['max(bytes)'])
+
+    def test_top(self):
+        plan = QueryPlan(['path'], ['count'], order_by='count')
+        plan.feed(self.data)
+        hits = Counter(entry['path'] for entry in self.data)
+        rows = plan.get_rows(top=3)
+        self.assertEqual([count for _, count in hits.most_common(3)], [row['count'] for row in rows])
+        ascending = QueryPlan(['path'], ['count'], ascending=True)
+        ascending.feed(self.data)
+        self.assertEqual(min(hits.values()), ascending.get_rows(top=1)[0]['count'])
+
+    def test_missing_values(self):
+        plan = QueryPlan([], ['count', 'avg(response_time_us)', 'p95(response_time_us)'])
+        plan.feed(self.data + [dict(self.data[0], response_time_us=1000)])
+        row, = plan.get_rows()
+        self.assertEqual(31, row['count'])
+        self.assertEqual(1000, row['avg(response_time_us)'])
+        self.assertAlmostEqual(1000, row['p95(response_time_us)'], delta=20)
+
+    def test_invalid(self):
+        for expression in ['sum', 'count(bytes)', 'median(bytes)', 'sum(unknown)', 'p101(bytes)', 'sum(path)',
+                           'avg(ip)', 'p95(time)']:
+            with self.assertRaises(ValueError):
+                parse_aggregate(expression)
+        with self.assertRaises(ValueError):
+            QueryPlan(['unknown'], ['count'])
+        with self.assertRaises(ValueError):
+            QueryPlan(['path'], ['count'], order_by='sum(bytes)')
+
+    def test_numeric_fields(self):
+        self.assertEqual('response', parse_aggregate('avg(status)').field)
+        self.assertEqual('path', parse_aggregate('max(path)').field)
+        self.assertEqual('remote_ip', parse_aggregate('distinct(ip)').field)
+
+    def test_invalid_command(self):
+        for arguments, error in (['-a', 'sum(path)'], "sum requires a numeric field"), \
+                                (['--order-by', 'sum(bytes)'], "Can't order by sum(bytes)"):
+            errors = io.StringIO()
+            with mock.patch('sys.argv', ['apache_logs_parser', 'query', access_log] + arguments), \
+                    redirect_stderr(errors), self.assertRaises(SystemExit) as context:
+                main()
+            self.assertEqual(2, context.exception.code)
+            self.assertIn(error, errors.getvalue())
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file = os.path.join(tmp_dir, 'log.json')
+            sqlite_file = os.path.join(tmp_dir, 'log.sqlite')
+            write_json_log(access_log, json_file)
+            write_sqlite_log(access_log, sqlite_file)
+            plan = run_query([json_file, sqlite_file], QueryPlan(['method'], ['count', 'sum(bytes)']))
+            row, = plan.get_rows()
+            self.assertEqual(dict(method='GET', count=60, **{'sum(bytes)': 2 * sum(e['bytes'] for e in self.data)}),
+                             row)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+
+from apache_logs_parser.parser import write_json_log
+from apache_logs_parser.rollup import get_rollup_file_name, merge_rollup
+from apache_logs_parser.stats import generate_stats, generate_json_stats, create_stats_instances
+from apache_logs_parser.stats_producers import get_default_stats_classes
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.json_log = os.path.join(self.tmp_dir.name, 'log.json')
+        write_json_log([os.path.join(current_dir, 'access.log')], self.json_log, rollup=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def normalize(stats_instances):
+        # Round trip in JSON to compare defaultdict and dict the same way
+        stats = generate_json_stats(stats_instances)
+        stats['different_visitors'] = sorted(stats['different_visitors'])
+        return json.loads(json.dumps(stats))
+
+    def test_rollup_written(self):
+        self.assertTrue(os.path.exists(get_rollup_file_name(self.json_log)))
+
+    def test_rollup_same_stats(self):
+        self.assertEqual(
+            self.normalize(generate_stats(self.json_log)),
+            self.normalize(generate_stats(self.json_log, use_rollups=True))
+        )
+
+    def test_merge_several_rollups(self):
+        # The sliding windows of StatAnomalies are not merged, the entries of the second file are late when read
+        # after the first one
+        stats_classes = get_default_stats_classes()
+        from_rows = generate_stats([self.json_log, self.json_log], stats_classes)
+        from_rollups = generate_stats([self.json_log, self.json_log], stats_classes, use_rollups=True)
+        self.assertEqual(self.normalize(from_rows), self.normalize(from_rollups))
+        self.assertEqual(60, generate_json_stats(from_rollups)['total_hits'])
+
+    def test_outdated_rollup_ignored(self):
+        rollup_file_name = get_rollup_file_name(self.json_log)
+        os.utime(rollup_file_name, (0, 0))
+        self.assertFalse(merge_rollup(create_stats_instances(), self.json_log))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from unittest import mock
+
+from apache_logs_parser.__main__ import main
+
+from apache_logs_parser.parser import parse_log_file, write_json_log
+from apache_logs_parser.sampling import Sampler, LINE_KEY, IP_KEY, SESSION_KEY, combine_sampling, \
+    confidence_interval, get_sampling, line_sample_key, entry_sample_key
+from apache_logs_parser.stats import generate_stats, get_stats
+from apache_logs_parser.stats_producers import StatCount, StatPerIp
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+access_log = os.path.join(current_dir, 'access.log')
+
+
+class TestSampler(unittest.TestCase):
+
+    def test_line_and_entry_keys(self):
+        with open(access_log) as f:
+            lines = [line.strip() for line in f]
+        entries = parse_log_file(access_log)
+        for line, entry in zip(lines, entries):
+            for key in (IP_KEY, SESSION_KEY):
+                self.assertEqual(line_sample_key(line, key), entry_sample_key(entry, key))
+
+    def test_keep_is_deterministic(self):
+        sampler = Sampler(0.5, IP_KEY)
+        decisions = [sampler.keep('10.0.0.%d' % i) for i in range(200)]
+        self.assertEqual(decisions, [sampler.keep('10.0.0.%d' % i) for i in range(200)])
+        self.assertEqual(400, sampler.seen)
+        self.assertTrue(0 < sampler.kept < 400)
+        self.assertTrue(all(Sampler(1).keep('10.0.0.%d' % i) for i in range(200)))
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            Sampler(0)
+        with self.assertRaises(ValueError):
+            Sampler(0.5, 'url')
+
+    def test_combine_sampling(self):
+        self.assertEqual((0.1, IP_KEY), combine_sampling(1, LINE_KEY, 0.1, IP_KEY))
+        self.assertEqual((0.1, IP_KEY), combine_sampling(0.5, IP_KEY, 0.1, IP_KEY))
+        self.assertEqual((0.05, LINE_KEY), combine_sampling(0.5, IP_KEY, 0.1, LINE_KEY))
+
+    def test_confidence_interval(self):
+        self.assertEqual((100, 100, 100), confidence_interval(100, 1))
+        estimate, low, high = confidence_interval(100, 0.01)
+        self.assertEqual(10000, estimate)
+        self.assertTrue(low < estimate < high)
+
+
+class TestSampledStats(unittest.TestCase):
+
+    def test_scaled_metrics(self):
+        entries = parse_log_file(access_log)
+        count, per_ip = get_stats(entries, [StatCount, StatPerIp], options=dict(scale=10, sample_key=IP_KEY))
+        self.assertEqual(300, count.get_metrics()['hits'])
+        # Per IP counts are exact when sampling by IP
+        self.assertEqual(get_stats(entries, [StatPerIp])[0].get_metrics(), per_ip.get_metrics())
+
+    def test_convert_and_stats(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file = os.path.join(tmp_dir, 'log.json')
+            sampler = Sampler(0.5, IP_KEY)
+            write_json_log(access_log, json_file, sampler=sampler)
+            with open(json_file) as f:
+                self.assertEqual(sampler.kept, len(json.load(f)))
+            self.assertEqual(dict(rate=0.5, key=IP_KEY, kept=sampler.kept), get_sampling([json_file]))
+            count, = generate_stats(json_file, [StatCount])
+            self.assertEqual(sampler.kept * 2, count.get_metrics()['hits'])
+
+            # Sampling again by the same key at the same rate keeps the same entries
+            count, = generate_stats(json_file, [StatCount], sampler=Sampler(0.5, IP_KEY))
+            self.assertEqual(sampler.kept * 2, count.get_metrics()['hits'])
+
+            write_json_log(access_log, json_file)
+            self.assertIsNone(get_sampling([json_file]))
+
+    def test_different_samplings_command(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_files = [os.path.join(tmp_dir, f"log{rate}.json") for rate in (0.5, 0.2)]
+            for json_file, rate in zip(json_files, (0.5, 0.2)):
+                write_json_log(access_log, json_file, sampler=Sampler(rate, LINE_KEY))
+            errors = io.StringIO()
+            with mock.patch('sys.argv', ['apache_logs_parser', 'stats'] + json_files), redirect_stderr(errors):
+                with self.assertRaises(SystemExit) as context:
+                    main()
+            self.assertEqual(2, context.exception.code)
+            self.assertIn("error: Files sampled at different rates", errors.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
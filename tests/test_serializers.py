@@ -0,0 +1,72 @@
+import argparse
+import io
+import json
+import sys
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from apache_logs_parser.__main__ import json_encoder
+
+from apache_logs_parser.serializers import JsonSerializer, get_serializer, write_json_object, SERIALIZERS
+
+MEMBERS = [
+    ('hits', 3),
+    ('per_extension', defaultdict(lambda: defaultdict(int), {None: {'hits': 1}, 'png': {'hits': 2}})),
+    ('visitors', {'1.2.3.4'}),
+    ('empty', {}),
+]
+
+
+def serialize(serializer):
+    fh = io.BytesIO()
+    write_json_object(MEMBERS, fh, serializer)
+    return fh.getvalue()
+
+
+class TestSerializers(unittest.TestCase):
+    def assertValidOutput(self, output):
+        self.assertEqual(
+            {'hits': 3, 'per_extension': {'null': {'hits': 1}, 'png': {'hits': 2}}, 'visitors': ['1.2.3.4'], 'empty': {}},
+            json.loads(output)
+        )
+
+    def test_json_indented(self):
+        output = serialize(JsonSerializer())
+        self.assertValidOutput(output)
+        self.assertEqual(json.dumps(json.loads(output), indent=4).encode(), output)
+
+    def test_json_compact(self):
+        output = serialize(JsonSerializer(compact=True))
+        self.assertValidOutput(output)
+        self.assertNotIn(b' ', output)
+
+    def test_all_available_serializers(self):
+        for name in SERIALIZERS:
+            for compact in (False, True):
+                try:
+                    serializer = get_serializer(name, compact=compact)
+                except ImportError:
+                    continue
+                self.assertValidOutput(serialize(serializer))
+
+    def test_empty_object(self):
+        fh = io.BytesIO()
+        write_json_object([], fh, JsonSerializer())
+        self.assertEqual(b'{}', fh.getvalue())
+
+    def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            get_serializer('unknown')
+
+    def test_encoder_not_installed(self):
+        # A None module makes its import fail
+        with mock.patch.dict(sys.modules, orjson=None):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                json_encoder('orjson')
+            self.assertEqual('auto', json_encoder('auto'))
+            self.assertIsInstance(get_serializer('auto'), JsonSerializer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import unittest
+from urllib.request import urlopen, Request
+
+from apache_logs_parser.parser import parse_log_file
+from apache_logs_parser.server import StatsService, create_server
+from apache_logs_parser.stats_producers import StatCount, ResponseCount
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestStatsServer(unittest.TestCase):
+    def setUp(self):
+        self.service = StatsService([StatCount, ResponseCount])
+        self.server = create_server(self.service, port=0)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        with urlopen(self.url + path) as response:
+            return response.read()
+
+    def ingest(self, body):
+        with urlopen(Request(self.url + '/ingest', data=body, method='POST')) as response:
+            return json.loads(response.read())
+
+    def test_ingest_and_query(self):
+        with open(os.path.join(current_dir, 'access.log'), 'rb') as f:
+            self.assertEqual(30, self.ingest(f.read())['ingested'])
+        stats = json.loads(self.get('/stats'))
+        self.assertEqual(30, stats['hits'])
+        self.assertEqual({'200': 30}, stats['responde_codes'])
+        self.assertIn(b'Response codes', self.get('/report?producers=ResponseCount'))
+
+    def test_cache_invalidated_by_ingestion(self):
+        self.assertEqual(0, json.loads(self.get('/stats?producers=StatCount'))['hits'])
+        line = b'83.149.9.216 - - [17/May/2015:10:05:03 +0000] "GET /a HTTP/1.1" 404 10 "-" "curl/7.0"\n'
+        self.ingest(line)
+        self.assertEqual(1, json.loads(self.get('/stats?producers=StatCount'))['hits'])
+        self.ingest(b'not an apache log line\n')
+        self.assertEqual(dict(entries=1, generation=2, rejected=1), json.loads(self.get('/health')))
+
+    def test_invalid_json_entries(self):
+        entry = parse_log_file(os.path.join(current_dir, 'access.log'))[0]
+        for body in [{'time': '2015-05-17T10:05:03+00:00'}, [{'time': '2015-05-17T10:05:03+00:00'}], [1],
+                     [dict(entry, bytes=True)]]:
+            with self.assertRaises(Exception) as context:
+                urlopen(Request(self.url + '/ingest?format=json', data=json.dumps(body).encode(), method='POST'))
+            self.assertEqual(400, context.exception.code)
+        self.assertEqual(0, json.loads(self.get('/stats?producers=StatCount'))['hits'])
+
+    def test_invalid_utf8(self):
+        for path in '/ingest', '/ingest?format=json':
+            with self.assertRaises(Exception) as context:
+                urlopen(Request(self.url + path, data=b'\xff\xfe invalid', method='POST'))
+            self.assertEqual(400, context.exception.code)
+
+    def test_concurrent_rejects(self):
+        threads = [threading.Thread(target=self.service.ingest_lines, args=(['not an apache log line'] * 500,))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, self.service.rejects.total)
+
+    def test_unknown_producer(self):
+        with self.assertRaises(Exception) as context:
+            self.get('/stats?producers=Unknown')
+        self.assertEqual(400, context.exception.code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import random
+import unittest
+
+from apache_logs_parser.parser import parse_line, set_time_taken_format
+from apache_logs_parser.sketch import DDSketch
+from apache_logs_parser.stats import get_stats
+from apache_logs_parser.stats_producers import StatLatency, StatLatencyPerStatusClass
+
+LINE = '83.149.9.216 - - [17/May/2015:10:05:03 +0000] "GET /a HTTP/1.1" {} 10 "-" "curl/7.0" {}'
+
+
+def exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+class TestDDSketch(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(42)
+        self.values = [generator.lognormvariate(10, 1) for _ in range(10000)]
+
+    def test_relative_accuracy(self):
+        sketch = DDSketch(relative_accuracy=0.01)
+        for value in self.values:
+            sketch.add(value)
+        for q in (0.5, 0.95, 0.99):
+            self.assertAlmostEqual(1, sketch.quantile(q) / exact_quantile(self.values, q), delta=0.011)
+        self.assertAlmostEqual(1, sketch.quantile(1) / max(self.values), delta=0.011)
+
+    def test_merge(self):
+        whole, first, second = DDSketch(), DDSketch(), DDSketch()
+        for index, value in enumerate(self.values):
+            whole.add(value)
+            (first if index % 2 else second).add(value)
+        first.merge(DDSketch.from_dict(second.to_dict()))
+        self.assertEqual(whole.count, first.count)
+        self.assertEqual(whole.quantile(0.99), first.quantile(0.99))
+
+    def test_bounded_buckets(self):
+        sketch = DDSketch(max_buckets=100)
+        for value in self.values:
+            sketch.add(value)
+        self.assertLessEqual(len(sketch.buckets), 100)
+        self.assertAlmostEqual(1, sketch.quantile(0.99) / exact_quantile(self.values, 0.99), delta=0.011)
+
+    def test_empty(self):
+        self.assertIsNone(DDSketch().quantile(0.5))
+
+
+class TestLatencyStats(unittest.TestCase):
+    def tearDown(self):
+        set_time_taken_format('D')
+
+    def test_parse_time_taken(self):
+        self.assertEqual(1500, parse_line(LINE.format(200, 1500))['response_time_us'])
+        set_time_taken_format('T')
+        self.assertEqual(2000000, parse_line(LINE.format(200, 2))['response_time_us'])
+
+    def test_combined_log_without_time_taken(self):
+        self.assertNotIn('response_time_us', parse_line(LINE.format(200, '').rstrip()))
+
+    def test_latency_producers(self):
+        data = [parse_line(LINE.format(200 if i % 10 else 500, i * 1000)) for i in range(1, 101)]
+        latency, per_class = get_stats(data, [StatLatency, StatLatencyPerStatusClass])
+        metrics = latency.get_metrics()['latency_us']
+        self.assertEqual(100, metrics['count'])
+        self.assertAlmostEqual(50000, metrics['p50'], delta=500)
+        self.assertEqual(10, per_class.get_metrics()['latency_per_status_class_us']['5xx']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from apache_logs_parser.geoip import GeoIpDatabase
+from apache_logs_parser.ip import ip_to_int
+from apache_logs_parser.parser import parse_log_file, write_json_log
+from apache_logs_parser.sqlite_backend import write_sqlite_log, is_sqlite_file, SQL_STATES, iter_entries
+from apache_logs_parser.stats import generate_stats, get_stats
+from apache_logs_parser.stats_producers import get_stat_classes_by_name
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+ACCESS_LOG = os.path.join(current_dir, 'access.log')
+
+
+def normalize(state):
+    # Compare states independently of the order of lists and of the dict types
+    state = json.loads(json.dumps(state))
+    if isinstance(state, dict):
+        return {k: sorted(v, key=json.dumps) if isinstance(v, list) else v for k, v in state.items()}
+    return state
+
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp_dir.name, 'log.sqlite')
+        write_sqlite_log(ACCESS_LOG, self.database)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_database(self):
+        self.assertTrue(is_sqlite_file(self.database))
+        self.assertFalse(is_sqlite_file(ACCESS_LOG))
+        connection = sqlite3.connect(self.database)
+        connection.row_factory = sqlite3.Row
+        self.assertEqual(parse_log_file(ACCESS_LOG), list(iter_entries(connection)))
+        indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertEqual({'entries_time', 'entries_response', 'entries_path', 'entries_remote_ip'}, indexes)
+        connection.close()
+
+    def test_database_replaced(self):
+        write_sqlite_log(ACCESS_LOG, self.database)
+        connection = sqlite3.connect(self.database)
+        count, = connection.execute("SELECT COUNT(*) FROM entries").fetchone()
+        self.assertEqual(len(parse_log_file(ACCESS_LOG)), count)
+        connection.close()
+
+    def test_sql_states(self):
+        stats_classes = [get_stat_classes_by_name(name) for name in SQL_STATES]
+        from_rows = get_stats(parse_log_file(ACCESS_LOG), stats_classes)
+        from_sql = generate_stats(self.database, stats_classes)
+        for row_stat, sql_stat in zip(from_rows, from_sql):
+            self.assertEqual(normalize(row_stat.get_state()), normalize(sql_stat.get_state()), row_stat.name)
+
+    def test_enriched_unknown(self):
+        # Only some of the IP addresses are in the GeoIP database, the others count as 'Unknown'
+        database = GeoIpDatabase([(ip_to_int('83.149.0.0'), ip_to_int('83.149.63.255'), ('RU', 12389, 'Rostelecom'))])
+        json_file = os.path.join(self.tmp_dir.name, 'log.json')
+        write_json_log(ACCESS_LOG, json_file, enrichers=[database.enrich])
+        write_sqlite_log(ACCESS_LOG, self.database, enrichers=[database.enrich])
+        connection = sqlite3.connect(self.database)
+        connection.row_factory = sqlite3.Row
+        self.assertEqual(parse_log_file(ACCESS_LOG, enrichers=[database.enrich]), list(iter_entries(connection)))
+        connection.close()
+        stats_classes = [get_stat_classes_by_name(name) for name in ['StatPerCountry', 'StatPerAsn']]
+        from_json = generate_stats(json_file, stats_classes)
+        from_sql = generate_stats(self.database, stats_classes)
+        for json_stat, sql_stat in zip(from_json, from_sql):
+            self.assertIn('Unknown', json_stat.get_state())
+            self.assertEqual(normalize(json_stat.get_state()), normalize(sql_stat.get_state()), json_stat.name)
+
+    def test_not_enriched(self):
+        stats_classes = [get_stat_classes_by_name(name) for name in ['StatPerCountry', 'StatPerAsn']]
+        for stat in generate_stats(self.database, stats_classes):
+            self.assertEqual({}, stat.get_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(current_dir)
+
+# Maximum number of milliseconds spent importing modules to build the parsers of all the commands
+IMPORT_TIME_BUDGET_MS = 150
+# Modules only needed by some commands, they must not be imported to start the tool
+HEAVY_MODULES = [
+    'json',
+    'urllib.parse',
+    'http.client',
+    'http.server',
+    'socket',
+    'sqlite3',
+    'importlib.metadata',
+    'apache_logs_parser.parser',
+    'apache_logs_parser.display',
+    'apache_logs_parser.colors',
+    'apache_logs_parser.stats',
+    'apache_logs_parser.stats_producers',
+    'apache_logs_parser.server',
+    'apache_logs_parser.distributed',
+    'apache_logs_parser.sqlite_backend',
+]
+
+
+def profile_imports(*args):
+    """
+    Run the tool with `-X importtime`
+    :return: Modules imported by the tool, after the interpreter start up, and their cumulative import time in
+    microseconds
+    :rtype: dict[str,int]
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'apache_logs_parser'] + list(args),
+                             cwd=root_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = dict()
+    started = False
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        started = started or name.strip() == 'apache_logs_parser'
+        if started:
+            # Nested imports are indented, their time is in the cumulative time of the top level import
+            modules[name.strip()] = int(cumulative) if not name[1:].startswith(' ') else 0
+    return modules
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_version(self):
+        modules = profile_imports('--version')
+        self.assertEqual([], [name for name in modules if name.startswith('apache_logs_parser.')
+                              and name != 'apache_logs_parser.commands'])
+        self.assertNotIn('logging', modules)
+
+    def test_parsers(self):
+        # Fails after building the parsers of all the commands as the JSON files are missing
+        modules = profile_imports('stats')
+        self.assertEqual([], [name for name in HEAVY_MODULES if name in modules])
+
+    def test_import_time_budget(self):
+        # Best of a few runs, to ignore the noise of the other processes
+        import_time = min(sum(profile_imports('stats').values()) for _ in range(3))
+        self.assertLess(import_time / 1000, IMPORT_TIME_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
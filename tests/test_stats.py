@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from apache_logs_parser.geoip import GeoIpDatabase
+from apache_logs_parser.parser import parse_log_file
+from apache_logs_parser.stats import create_stats_instances, feed_stats, generate_json_stats
+from apache_logs_parser.stats_producers import StatProducer, StatPageIssues, StatPerAsn, get_stats_classes, \
+    get_stats_classes_names, load_plugins, PLUGINS_ENTRY_POINT_GROUP
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestFeedStats(unittest.TestCase):
+
+    def setUp(self):
+        database = GeoIpDatabase([(0, 1 << 128, ('ZZ', 64500, 'Example'))])
+        self.data = parse_log_file(os.path.join(current_dir, 'access.log'), enrichers=[database.enrich])
+        # Only some entries have a response time, and the response times repeat
+        for i, data_entry in enumerate(self.data):
+            if i % 3:
+                data_entry['response_time_us'] = (i % 4) * 1500
+
+    @staticmethod
+    def feed_entries(stats_instances, data):
+        for data_entry in data:
+            for stat in stats_instances:
+                stat.process_entry(data_entry)
+        return stats_instances
+
+    def test_batch_same_as_entries(self):
+        by_batch = generate_json_stats(feed_stats(create_stats_instances(), self.data * 3 + [False]))
+        by_entry = generate_json_stats(self.feed_entries(create_stats_instances(), self.data * 3))
+        self.assertEqual(json.loads(json.dumps(by_entry)), json.loads(json.dumps(by_batch)))
+
+    def test_batch_producers(self):
+        # All the built-in producers aggregate a batch at once
+        for stats_class in get_stats_classes():
+            if stats_class.__module__ != StatProducer.__module__:
+                # Plugin loaded by another test
+                continue
+            self.assertIsNot(StatProducer.process_batch, stats_class.process_batch, stats_class.__name__)
+
+    def test_default_process_batch(self):
+        class StatPerAsnEntries(StatPerAsn):
+            # Only implements `process_entry`
+            process_batch = StatProducer.process_batch
+
+        stat, = feed_stats([StatPerAsnEntries()], self.data)
+        self.assertEqual({'AS64500 Example': dict(hits=30, bytes=sum(e['bytes'] for e in self.data))},
+                         stat.get_metrics()['per_asn'])
+
+    def test_display_default_top(self):
+        stat, = feed_stats([StatPageIssues()], [dict(response=404, url=f"/missing{i}") for i in range(100)])
+        output = io.StringIO()
+        with redirect_stdout(output):
+            stat.display()
+        lines = output.getvalue().splitlines()
+        self.assertEqual(StatPageIssues.DEFAULT_TOP, len([line for line in lines if '/missing' in line]))
+        self.assertIn(f"... {100 - StatPageIssues.DEFAULT_TOP} more URLs", lines[-1])
+
+
+class FakeEntryPoint(object):
+    """
+    Entry point of a plugin, its StatProducer subclass only exists once it is loaded
+    """
+    name = 'stat_plugin'
+
+    def __init__(self, class_name):
+        self.class_name = class_name
+
+    def load(self):
+        # The subclass has no metrics, so that the tests using all the producers do not change once it is loaded
+        return type(self.class_name, (StatProducer,), dict(
+            process_entry=lambda self, data_entry: None,
+            get_metrics=lambda self: dict(),
+            get_state=lambda self: dict(),
+            merge_state=lambda self, state: None,
+            display=lambda self, top=None, output=None: None,
+        ))
+
+
+class TestPlugins(unittest.TestCase):
+
+    def setUp(self):
+        load_plugins.cache_clear()
+        self.addCleanup(load_plugins.cache_clear)
+
+    def test_entry_point(self):
+        entry_points = mock.Mock()
+        entry_points.select.return_value = [FakeEntryPoint('StatEntryPointPlugin')]
+        with mock.patch('importlib.metadata.entry_points', return_value=entry_points):
+            self.assertIn('StatEntryPointPlugin', get_stats_classes_names())
+        entry_points.select.assert_called_once_with(group=PLUGINS_ENTRY_POINT_GROUP)
+
+    def test_setuptools_entry_point(self):
+        # Python 3.7 without the importlib_metadata backport
+        with mock.patch.dict(sys.modules, {'importlib.metadata': None, 'importlib_metadata': None}), \
+                mock.patch('pkg_resources.iter_entry_points', return_value=[FakeEntryPoint('StatSetuptoolsPlugin')]):
+            self.assertIn('StatSetuptoolsPlugin', get_stats_classes_names())
+
+
+if __name__ == '__main__':
+    unittest.main()